@@ -0,0 +1,110 @@
+"""Стоимость разбора полос частот на один чанк против длительности чанка
+
+Сравнивает BandMapper (окно и матрица полос посчитаны заранее) с
+наивным вариантом, который на каждый чанк заново строит окно и маски
+бинов, и проверяет, что гул и свист попадают в свои полосы.
+
+    python benchmarks/bench_bands.py --fft 1024,2048,4096 --bands 2,8,32
+"""
+
+import argparse
+import time
+
+import numpy as np
+
+from _common import dump_json, print_table, summarize_ms
+
+import voice_coop
+
+
+def make_bands(count, rate):
+    # Равные полосы от 60 Гц почти до Найквиста (узкие низкие полосы
+    # при малом окне БПФ не попадают ни в один бин)
+    edges = np.linspace(60, rate / 2 * 0.9, count + 1)
+    return [{'low': float(lo), 'high': float(hi), 'key': f"f{i + 1}"}
+            for i, (lo, hi) in enumerate(zip(edges[:-1], edges[1:]))]
+
+
+def naive_levels(samples, bands, rate, fft_size):
+    """Всё считается заново на каждый чанк"""
+    window = np.hanning(fft_size)
+    spectrum = np.abs(np.fft.rfft(samples[-fft_size:] * window)) ** 2
+    freqs = np.fft.rfftfreq(fft_size, 1.0 / rate)
+    scale = 2.0 / (fft_size * np.sum(window ** 2) * voice_coop.FULL_SCALE_SQ)
+    levels = []
+    for band in bands:
+        mask = (freqs >= band['low']) & (freqs < band['high'])
+        levels.append(10 * np.log10(max(spectrum[mask].sum() * scale, 1e-30)))
+    return levels
+
+
+def tone(rate, freq, length, db=-12):
+    t = np.arange(length) / rate
+    amplitude = 32768 * 10 ** (db / 20) * np.sqrt(2)
+    return (np.sin(2 * np.pi * freq * t) * amplitude).astype(np.int16)
+
+
+def check_mapping(rate, fft_size):
+    """Гул 150 Гц и свист 2 кГц должны нажать разные кнопки"""
+    mapper = voice_coop.BandMapper(voice_coop.parse_bands(voice_coop.DEFAULT_BANDS), rate, fft_size)
+    hum = mapper.match(mapper.levels(tone(rate, 150, fft_size)), -30)
+    whistle = mapper.match(mapper.levels(tone(rate, 2000, fft_size)), -30)
+    return hum == 0 and whistle == 1
+
+
+def time_calls(func, repeats):
+    latencies = []
+    for _ in range(repeats):
+        t0 = time.perf_counter()
+        func()
+        latencies.append(time.perf_counter() - t0)
+    return summarize_ms(latencies)
+
+
+def run_case(fft_size, n_bands, args):
+    rate = args.rate
+    rng = np.random.default_rng(0)
+    ring = voice_coop.AudioRingBuffer(int(rate * voice_coop.RING_SECONDS), rate)
+    ring.write((rng.standard_normal(rate) * 3000).astype(np.int16))
+    bands = make_bands(n_bands, rate)
+    mapper = voice_coop.BandMapper(bands, rate, fft_size)
+
+    for _ in range(args.warmup):
+        mapper.levels(ring.latest(fft_size))
+    cached = time_calls(lambda: mapper.levels(ring.latest(fft_size)), args.repeats)
+    naive = time_calls(lambda: naive_levels(ring.latest(fft_size), bands, rate, fft_size), args.repeats)
+
+    chunk_ms = args.chunk / rate * 1000
+    return {
+        "fft": fft_size,
+        "bands": n_bands,
+        "cached_p50_us": round(cached["p50_ms"] * 1000, 1),
+        "cached_p99_us": round(cached["p99_ms"] * 1000, 1),
+        "naive_p50_us": round(naive["p50_ms"] * 1000, 1),
+        "chunk_ms": round(chunk_ms, 2),
+        "chunk_pct": round(cached["p99_ms"] / chunk_ms * 100, 2),
+        "mapping_ok": check_mapping(rate, fft_size),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--fft", default="1024,2048,4096")
+    parser.add_argument("--bands", default="2,8,32")
+    parser.add_argument("--rate", type=int, default=voice_coop.RATE)
+    parser.add_argument("--chunk", type=int, default=voice_coop.CHUNK)
+    parser.add_argument("--repeats", type=int, default=2000)
+    parser.add_argument("--warmup", type=int, default=100)
+    parser.add_argument("--json", help="Куда сохранить результат (- для stdout)")
+    args = parser.parse_args()
+
+    results = [run_case(int(f), int(b), args)
+               for f in args.fft.split(",") for b in args.bands.split(",")]
+    print_table(results, ["fft", "bands", "cached_p50_us", "cached_p99_us", "naive_p50_us",
+                          "chunk_ms", "chunk_pct", "mapping_ok"])
+    if args.json:
+        dump_json({"benchmark": "bands", "params": vars(args), "results": results}, args.json)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,59 @@
+"""Сравнение бинарного протокола с прежним pickle: байты и время кодирования
+
+    python benchmarks/bench_codec.py
+"""
+
+import argparse
+import pickle
+import time
+import timeit
+
+from _common import dump_json, print_table
+
+import voice_coop
+
+COMMANDS = {
+    "key_press space": {'type': 'key_press', 'key': 'space'},
+    "key_press f5": {'type': 'key_press', 'key': 'f5'},
+    "key_press by name": {'type': 'key_press', 'key': 'XF86AudioPlay'},
+    "hotkey ctrl+c": {'type': 'hotkey', 'keys': ['ctrl', 'c']},
+    "hotkey ctrl+shift+esc": {'type': 'hotkey', 'keys': ['ctrl', 'shift', 'esc']},
+}
+
+
+def ns_per_op(func, number):
+    return min(timeit.repeat(func, number=number, repeat=5)) / number * 1e9
+
+
+def bench_command(name, command, number):
+    command = dict(command, timestamp=time.time())
+    pickled = pickle.dumps(command)
+    frame = voice_coop.encode_command(command)
+    decoder = voice_coop.FrameDecoder()
+
+    return {
+        "command": name,
+        "pickle_bytes": len(pickled),
+        "frame_bytes": len(frame),
+        "pickle_enc_ns": round(ns_per_op(lambda: pickle.dumps(command), number)),
+        "frame_enc_ns": round(ns_per_op(lambda: voice_coop.encode_command(command), number)),
+        "pickle_dec_ns": round(ns_per_op(lambda: pickle.loads(pickled), number)),
+        "frame_dec_ns": round(ns_per_op(lambda: decoder.feed(frame), number)),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--number", type=int, default=20000)
+    parser.add_argument("--json", help="Куда сохранить результат (- для stdout)")
+    args = parser.parse_args()
+
+    results = [bench_command(name, command, args.number) for name, command in COMMANDS.items()]
+    print_table(results, ["command", "pickle_bytes", "frame_bytes", "pickle_enc_ns",
+                          "frame_enc_ns", "pickle_dec_ns", "frame_dec_ns"])
+    if args.json:
+        dump_json({"benchmark": "codec", "results": results}, args.json)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,201 @@
+"""Скорость детекции (чанков/с) и точность срабатываний на размеченном корпусе
+
+Звук идёт через AudioSource в ускоренном режиме (без ожидания реального
+времени) в настоящий DetectionEngine. Корпус - WAV-файлы с метками в
+формате Audacity (<имя>.txt: "начало<TAB>конец<TAB>метка" на строку);
+без --corpus генерируется синтетический: крики разной громкости на
+фоне шума разного уровня. --save-corpus сохраняет его для повторных
+прогонов и других детекторов. С --mode hold срабатывание - зажатие, и
+ещё меряется, насколько позже конца метки клавиша отпущена.
+
+    python benchmarks/bench_detection.py --detectors volume,onset
+    python benchmarks/bench_detection.py --mode hold --hold-hang 0.1
+    python benchmarks/bench_detection.py --corpus recordings/
+"""
+
+import argparse
+import glob
+import os
+import random
+import tempfile
+import time
+import wave
+
+from _common import dump_json, print_table, summarize_ms
+
+import voice_coop
+
+# Синтетический корпус: (громкость крика, уровень шума), дБ
+SYNTHETIC_CASES = [(-6, -60), (-12, -60), (-18, -60), (-12, -40), (-18, -35)]
+MATCH_BEFORE = 0.05  # Срабатывание раньше метки на столько - ещё попадание, с
+MATCH_AFTER = 0.3  # И позже метки
+
+
+def synthetic_corpus(seconds, seed):
+    corpus = []
+    for i, (level_db, noise_db) in enumerate(SYNTHETIC_CASES):
+        rng = random.Random(seed + i)
+        shouts, t = [], 1.0
+        while t < seconds - 1.0:
+            shouts.append((t, rng.uniform(0.2, 0.6), level_db))
+            t += rng.uniform(1.0, 2.5)
+
+        def factory(noise_db=noise_db, shouts=shouts, seed=seed + i):
+            return voice_coop.SyntheticSource("shout", seconds=seconds, noise_db=noise_db, shouts=shouts,
+                                              seed=seed, realtime=False)
+
+        corpus.append((f"крик {level_db} / шум {noise_db}", factory,
+                       [(start, start + length) for start, length, _ in shouts]))
+    return corpus
+
+
+def save_corpus(corpus, path):
+    os.makedirs(path, exist_ok=True)
+    for i, (_, factory, _) in enumerate(corpus):
+        source = factory()
+        name = os.path.join(path, f"synthetic_{i}")
+        with wave.open(name + ".wav", "wb") as f:
+            f.setnchannels(1)
+            f.setsampwidth(2)
+            f.setframerate(source.rate)
+            for block in source.blocks():
+                f.writeframes(block.tobytes())
+        with open(name + ".txt", "w", encoding="utf-8") as f:
+            for start, length, level_db in source.shouts:
+                f.write(f"{start:.6f}\t{start + length:.6f}\tкрик {level_db:g} дБ\n")
+
+
+def load_corpus(path):
+    corpus = []
+    for wav_path in sorted(glob.glob(os.path.join(path, "*.wav"))):
+        labels_path = os.path.splitext(wav_path)[0] + ".txt"
+        if not os.path.exists(labels_path):
+            print(f"Нет меток для {wav_path}, пропускаем")
+            continue
+        with open(labels_path, encoding="utf-8") as f:
+            labels = [tuple(float(x) for x in line.split("\t")[:2]) for line in f if line.strip()]
+        corpus.append((os.path.basename(wav_path),
+                       lambda wav_path=wav_path: voice_coop.WavSource(wav_path, realtime=False), labels))
+    return corpus
+
+
+def check_stereo_wav(seconds=1.0):
+    """Стерео WAV сводится в моно: кадров столько же, сэмпл - среднее каналов"""
+    rate = voice_coop.RATE
+    t = voice_coop.np.arange(int(rate * seconds)) / rate
+    left = (8000 * voice_coop.np.sin(2 * voice_coop.np.pi * 300 * t)).astype(voice_coop.np.int16)
+    right = voice_coop.np.full_like(left, 2000)
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "stereo.wav")
+        with wave.open(path, "wb") as f:
+            f.setnchannels(2)
+            f.setsampwidth(2)
+            f.setframerate(rate)
+            f.writeframes(voice_coop.np.column_stack([left, right]).tobytes())
+        source = voice_coop.WavSource(path, realtime=False)
+        samples = voice_coop.np.concatenate(list(source.blocks()))
+    expected = ((left.astype(voice_coop.np.int32) + right) / 2).astype(voice_coop.np.int16)
+    if source.channels != 1 or len(samples) != len(left) or not voice_coop.np.array_equal(samples, expected):
+        raise SystemExit(f"Стерео WAV прочитан неверно: {len(samples)} кадров вместо {len(left)}")
+
+
+def run_clip(source, detector, args):
+    """Прогоняет клип через детектор: (срабатывания, отпускания, секунды работы, сэмплы)"""
+    triggers = []
+    releases = []
+    engine = voice_coop.DetectionEngine(source)
+
+    def record(command):
+        moment = engine.position / source.rate
+        (releases if command['type'] == 'key_up' else triggers).append(moment)
+
+    engine.configure(threshold=args.threshold, detector=detector, sender=record,
+                     cooldown=args.cooldown, sender_stage="inject", mode=args.mode,
+                     hold_hang=args.hold_hang)
+    engine.start()
+    started = time.perf_counter()
+    source.start_recording()
+    source.finished.wait()
+    while engine.position < source.ring.write_index:
+        time.sleep(0.001)
+    elapsed = time.perf_counter() - started
+    engine.stop()
+    source.stop_recording()
+    return triggers, releases, elapsed, source.ring.write_index
+
+
+def match(labels, triggers, releases):
+    """Задержки срабатываний, задержки отпусканий от конца метки и ложные срабатывания"""
+    delays = []
+    release_delays = []
+    used = set()
+    for start, end in labels:
+        for i, trigger in enumerate(triggers):
+            if i not in used and start - MATCH_BEFORE <= trigger <= start + MATCH_AFTER:
+                used.add(i)
+                delays.append(trigger - start)
+                # Зажатию соответствует первое отпускание после него
+                later = [r for r in releases if r > trigger]
+                if later:
+                    release_delays.append(later[0] - end)
+                break
+    return delays, release_delays, len(triggers) - len(used)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--detectors", default="volume,onset", help="Детекторы через запятую")
+    parser.add_argument("--corpus", help="Папка с WAV и метками Audacity (.txt)")
+    parser.add_argument("--save-corpus", help="Сохранить синтетический корпус в папку")
+    parser.add_argument("--seconds", type=float, default=30.0, help="Длина синтетического клипа, с")
+    parser.add_argument("--threshold", type=float, default=-25.0, help="Порог детектора, дБ")
+    parser.add_argument("--cooldown", type=float, default=voice_coop.TRIGGER_COOLDOWN, help="Пауза между срабатываниями, с")
+    parser.add_argument("--mode", choices=list(voice_coop.TRIGGER_MODES), default="tap",
+                        help="tap - нажатие на крик, hold - зажатие на время крика")
+    parser.add_argument("--hold-hang", type=float, default=voice_coop.HOLD_HANG,
+                        help="Сколько тишины терпеть до отпускания, с")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--json", help="Куда сохранить результат (- для stdout)")
+    args = parser.parse_args()
+
+    check_stereo_wav()
+    corpus = load_corpus(args.corpus) if args.corpus else synthetic_corpus(args.seconds, args.seed)
+    if args.save_corpus and not args.corpus:
+        save_corpus(corpus, args.save_corpus)
+
+    results = []
+    for detector in args.detectors.split(","):
+        detector = detector.strip()
+        for name, factory, labels in corpus:
+            source = factory()
+            triggers, releases, elapsed, samples = run_clip(source, detector, args)
+            delays, release_delays, false_positives = match(labels, triggers, releases)
+            stats = summarize_ms(delays)
+            release_stats = summarize_ms(release_delays)
+            results.append({
+                "detector": detector,
+                "clip": name,
+                "chunks_per_sec": round(samples / source.chunk / elapsed),
+                "realtime_x": round(samples / source.rate / elapsed, 1),
+                "labels": len(labels),
+                "hits": len(delays),
+                "missed": len(labels) - len(delays),
+                "false_pos": false_positives,
+                "delay_p50_ms": stats.get("p50_ms"),
+                "delay_p90_ms": stats.get("p90_ms"),
+                "delay_max_ms": stats.get("max_ms"),
+                "release_p50_ms": release_stats.get("p50_ms"),
+                "release_max_ms": release_stats.get("max_ms"),
+            })
+
+    columns = ["detector", "clip", "chunks_per_sec", "realtime_x", "labels", "hits", "missed",
+               "false_pos", "delay_p50_ms", "delay_p90_ms", "delay_max_ms"]
+    if args.mode == "hold":
+        columns += ["release_p50_ms", "release_max_ms"]
+    print_table(results, columns)
+    if args.json:
+        dump_json({"benchmark": "detection", "params": vars(args), "results": results}, args.json)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,135 @@
+"""Задержка рассылки одного крика на много получателей (отдельные процессы)
+
+Поднимает N процессов-получателей с NetworkServer на соседних портах,
+подключает один NetworkClient ко всем и шлёт команды. Для каждой
+команды задержка до каждого получателя и до последнего из них.
+--stalled K замораживает K получателей (SIGSTOP): остальные не должны
+замедлиться, а замороженные - отключиться как медленные.
+
+    python benchmarks/bench_fanout.py --receivers 1,5,10,25,50
+"""
+
+import argparse
+import multiprocessing
+import os
+import signal
+import sys
+import time
+
+from _common import dump_json, print_table, raise_fd_limit, summarize_ms
+
+import voice_coop
+
+
+def receiver(index, port, results, ready):
+    sys.stdout = open(os.devnull, "w")
+
+    def sink(command):
+        results.put((index, command['timestamp'], time.time()))
+
+    server = voice_coop.NetworkServer(executor=sink, port=port)
+    ready.put((index, server.start_server()))
+    while True:
+        time.sleep(3600)
+
+
+def run_case(n, args):
+    results = multiprocessing.Queue()
+    ready = multiprocessing.Queue()
+    procs = []
+    for i in range(n):
+        proc = multiprocessing.Process(target=receiver, args=(i, args.port + i, results, ready), daemon=True)
+        proc.start()
+        procs.append(proc)
+
+    client = voice_coop.NetworkClient()
+    try:
+        for _ in range(n):
+            _, ok = ready.get(timeout=30)
+            if not ok:
+                raise SystemExit("Получатель не запустился")
+        addresses = ",".join(f"127.0.0.1:{args.port + i}" for i in range(n))
+        if not client.connect_to_server(addresses, args.transport):
+            raise SystemExit(client.last_error)
+        # connect_to_server ждёт только первого получателя - остальные догоняют в фоне
+        deadline = time.time() + voice_coop.CONNECT_TIMEOUT
+        while not all(r['alive'] for r in client.get_receivers()) and time.time() < deadline:
+            time.sleep(0.01)
+
+        stalled = procs[:args.stalled]
+        for proc in stalled:
+            os.kill(proc.pid, signal.SIGSTOP)
+
+        sent = []
+        for _ in range(args.commands):
+            command = voice_coop.make_command(args.key)
+            # Длинное имя клавиши - чтобы замороженные быстрее переполнились
+            command['key'] = args.key + "_" * args.padding if args.padding else args.key
+            command['timestamp'] = time.time()
+            client.send_key_press(command)
+            sent.append(command['timestamp'])
+            time.sleep(args.gap)
+
+        expected = args.commands * (n - len(stalled))
+        arrivals = {}
+        deadline = time.time() + 5
+        while sum(len(v) for v in arrivals.values()) < expected and time.time() < deadline:
+            try:
+                index, ts, arrived = results.get(timeout=0.5)
+            except Exception:
+                continue
+            arrivals.setdefault(ts, []).append(arrived - ts)
+        receivers = client.get_receivers()
+    finally:
+        client.disconnect()
+        for proc in procs:
+            try:
+                os.kill(proc.pid, signal.SIGCONT)
+            except OSError:
+                pass
+            proc.terminate()
+            proc.join()
+
+    per_receiver = [x for values in arrivals.values() for x in values]
+    last = [max(values) for values in arrivals.values() if len(values) == n - args.stalled]
+    all_stats = summarize_ms(per_receiver)
+    last_stats = summarize_ms(last)
+    return {
+        "receivers": n,
+        "stalled": args.stalled,
+        "delivered_pct": round(len(per_receiver) / max(1, expected) * 100, 1),
+        "p50_ms": all_stats.get("p50_ms"),
+        "p99_ms": all_stats.get("p99_ms"),
+        "last_p50_ms": last_stats.get("p50_ms"),
+        "last_p99_ms": last_stats.get("p99_ms"),
+        # Отключённый получатель клиент переподключает - считаем и таких
+        "dropped_receivers": sum(1 for r in receivers if not r['alive'] or r['reconnects']),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--receivers", default="1,5,10,25,50")
+    parser.add_argument("--transport", choices=voice_coop.TRANSPORTS, default="tcp")
+    parser.add_argument("--commands", type=int, default=200)
+    parser.add_argument("--gap", type=float, default=0.01, help="Пауза между командами, с")
+    parser.add_argument("--stalled", type=int, default=0, help="Сколько получателей заморозить")
+    parser.add_argument("--padding", type=int, default=0, help="Удлинить имя клавиши на столько байт")
+    parser.add_argument("--key", default="space")
+    parser.add_argument("--port", type=int, default=24500)
+    parser.add_argument("--json", help="Куда сохранить результат (- для stdout)")
+    args = parser.parse_args()
+
+    os.environ.setdefault(voice_coop.KEY_BACKEND_ENV, "simulated")
+    counts = [int(x) for x in args.receivers.split(",")]
+    raise_fd_limit(max(counts) * 8 + 64)
+
+    results = [run_case(n, args) for n in counts]
+    print_table(results, ["receivers", "stalled", "delivered_pct", "p50_ms", "p99_ms", "last_p50_ms",
+                          "last_p99_ms", "dropped_receivers"])
+    if args.json:
+        dump_json({"benchmark": "fanout", "params": vars(args), "results": results}, args.json)
+
+
+if __name__ == "__main__":
+    main()
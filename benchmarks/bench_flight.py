@@ -0,0 +1,138 @@
+"""Во что обходится бортовой самописец детектору
+
+Поток захвата самописец не трогает вовсе, поэтому меряем остальное:
+  record - сколько стоит вызов record() в потоке детекции (очередь);
+  write  - сколько потоку самописца стоит запись события в mmap-файл;
+  engine - скорость детекции синтетических криков в ускоренном режиме
+           без самописца и с ним, и сколько событий дошло до файла.
+
+    python benchmarks/bench_flight.py --events 2000 --json result.json
+"""
+
+import argparse
+import os
+import tempfile
+import time
+
+from _common import dump_json, print_table, summarize_ms
+
+import voice_coop
+
+SETTINGS = (-20.0, "volume", "tap", voice_coop.TRIGGER_COOLDOWN, voice_coop.HOLD_HANG, None, voice_coop.CHUNK)
+
+
+def filled_ring(seconds=voice_coop.RING_SECONDS):
+    """Буфер, уже полный шума: звук после события есть сразу"""
+    ring = voice_coop.AudioRingBuffer(int(voice_coop.RATE * seconds))
+    noise = voice_coop.np.random.default_rng(0).normal(0, 1000, ring.capacity).astype(voice_coop.np.int16)
+    ring.write(noise.tobytes())
+    return ring
+
+
+def bench_record(path, args):
+    recorder = voice_coop.FlightRecorder(path, int(args.size * 2 ** 20))
+    recorder.open(voice_coop.RATE, 1)
+    recorder.start()
+    ring = filled_ring()
+    position = ring.write_index - int(recorder.post * ring.rate)
+    calls = []
+    try:
+        for i in range(args.events):
+            # Пачками меньше очереди: меряем вызов, а не отброс
+            if i % (voice_coop.FLIGHT_PENDING // 2) == 0:
+                while recorder.pending:
+                    time.sleep(0.001)
+            t0 = time.perf_counter()
+            recorder.record(ring, position, "tap", "space", -12.0, SETTINGS)
+            calls.append(time.perf_counter() - t0)
+        while recorder.pending:
+            time.sleep(0.001)
+    finally:
+        recorder.stop()
+    stats = summarize_ms(calls)
+    return {"case": "record", "events": args.events, "p50_us": round(stats["p50_ms"] * 1000, 2),
+            "p99_us": round(stats["p99_ms"] * 1000, 2), "max_us": round(stats["max_ms"] * 1000, 2),
+            "recorded": recorder.recorded, "dropped": recorder.dropped}
+
+
+def bench_write(path, args):
+    recorder = voice_coop.FlightRecorder(path, int(args.size * 2 ** 20))
+    recorder.open(voice_coop.RATE, 1)
+    ring = filled_ring()
+    position = ring.write_index - int(recorder.post * ring.rate)
+    writes = []
+    try:
+        for _ in range(args.events):
+            t0 = time.perf_counter()
+            recorder._write(ring, position, time.time(), "tap", "space", -12.0, SETTINGS, -1, "")
+            writes.append(time.perf_counter() - t0)
+    finally:
+        recorder.close()
+    stats = summarize_ms(writes)
+    return {"case": "write", "events": args.events, "p50_us": round(stats["p50_ms"] * 1000, 2),
+            "p99_us": round(stats["p99_ms"] * 1000, 2), "max_us": round(stats["max_ms"] * 1000, 2),
+            "recorded": recorder.recorded, "dropped": recorder.dropped}
+
+
+def run_engine(path, args):
+    """(секунды работы, процессорное время, срабатывания, событий в файле)"""
+    source = voice_coop.SyntheticSource("shout", seconds=args.seconds, period=args.period, realtime=False)
+    engine = voice_coop.DetectionEngine(source)
+    triggers = []
+    engine.configure(threshold=args.threshold, sender=triggers.append, sender_stage="inject")
+    recorder = None
+    if path:
+        recorder = voice_coop.FlightRecorder(path, int(args.size * 2 ** 20))
+        recorder.start()
+        engine.configure(recorder=recorder)
+    engine.start()
+    started = time.perf_counter()
+    cpu_started = time.process_time()
+    source.start_recording()
+    source.finished.wait()
+    while engine.position < source.ring.write_index:
+        time.sleep(0.001)
+    elapsed = time.perf_counter() - started
+    cpu = time.process_time() - cpu_started
+    engine.stop()
+    source.stop_recording()
+    recorded = 0
+    if recorder is not None:
+        recorder.stop()
+        recorded = recorder.recorded
+    return elapsed, cpu, len(triggers), recorded
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--events", type=int, default=2000, help="Событий в замерах record и write")
+    parser.add_argument("--size", type=float, default=voice_coop.FLIGHT_SIZE / 2 ** 20, help="Размер файла, МБ")
+    parser.add_argument("--seconds", type=float, default=60.0, help="Длина звука для детектора, с")
+    parser.add_argument("--period", type=float, default=1.0, help="Пауза между криками, с")
+    parser.add_argument("--threshold", type=float, default=-20.0, help="Порог, дБ")
+    parser.add_argument("--json", help="Куда сохранить результат (- для stdout)")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "flight.bin")
+        calls = [bench_record(path, args), bench_write(path, args)]
+        engine = []
+        for name, flight in (("off", None), ("on", path)):
+            elapsed, cpu, triggers, recorded = run_engine(flight, args)
+            engine.append({
+                "recorder": name,
+                "realtime_x": round(args.seconds / elapsed, 1),
+                "cpu_ms_per_s": round(cpu / args.seconds * 1000, 2),
+                "triggers": triggers,
+                "recorded": recorded,
+            })
+
+    print_table(calls, ["case", "events", "p50_us", "p99_us", "max_us", "recorded", "dropped"])
+    print()
+    print_table(engine, ["recorder", "realtime_x", "cpu_ms_per_s", "triggers", "recorded"])
+    if args.json:
+        dump_json({"benchmark": "flight", "params": vars(args), "calls": calls, "engine": engine}, args.json)
+
+
+if __name__ == "__main__":
+    main()
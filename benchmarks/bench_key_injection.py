@@ -0,0 +1,116 @@
+"""Микро-бенчмарк бэкендов инъекции клавиш (нажатий/с, p50/p99)
+
+Запуск под виртуальным X-сервером:
+    python benchmarks/bench_key_injection.py --xvfb
+"""
+
+import argparse
+import os
+import shutil
+import subprocess
+import time
+
+from _common import dump_json, print_table, summarize_ms
+
+import voice_coop
+
+
+class LegacyXdotool:
+    """Старый путь: `which xdotool` + `xdotool key` на каждое нажатие"""
+
+    name = "legacy-xdotool"
+
+    def __init__(self):
+        if shutil.which("xdotool") is None:
+            raise RuntimeError("xdotool не установлен")
+
+    def press(self, key):
+        if subprocess.run(["which", "xdotool"], capture_output=True).returncode == 0:
+            subprocess.run(["xdotool", "key", key], check=False)
+
+    def close(self):
+        pass
+
+
+def start_xvfb(display):
+    """Запускает Xvfb и ждёт появления сокета дисплея"""
+    if shutil.which("Xvfb") is None:
+        raise SystemExit("Xvfb не установлен")
+    proc = subprocess.Popen(["Xvfb", display, "-screen", "0", "640x480x24", "-nolisten", "tcp"],
+                            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    socket_path = f"/tmp/.X11-unix/X{display.lstrip(':')}"
+    deadline = time.time() + 5
+    while not os.path.exists(socket_path):
+        if time.time() > deadline or proc.poll() is not None:
+            proc.kill()
+            raise SystemExit("Xvfb не запустился")
+        time.sleep(0.05)
+    os.environ["DISPLAY"] = display
+    return proc
+
+
+def bench_backend(backend, key, presses, warmup):
+    for _ in range(warmup):
+        backend.press(key)
+
+    latencies = []
+    started = time.perf_counter()
+    for _ in range(presses):
+        t0 = time.perf_counter()
+        backend.press(key)
+        latencies.append(time.perf_counter() - t0)
+    elapsed = time.perf_counter() - started
+
+    stats = summarize_ms(latencies)
+    return {
+        "backend": backend.name,
+        "presses": presses,
+        "presses_per_sec": round(presses / elapsed, 1),
+        "p50_ms": stats["p50_ms"],
+        "p99_ms": stats["p99_ms"],
+        "max_ms": stats["max_ms"],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--backends", default="xtest,uinput,xdotool,legacy-xdotool",
+                        help="Список бэкендов через запятую")
+    parser.add_argument("--key", default="shift", help="Клавиша для нажатий")
+    parser.add_argument("--presses", type=int, default=500)
+    parser.add_argument("--warmup", type=int, default=20)
+    parser.add_argument("--xvfb", action="store_true", help="Запустить Xvfb на время теста")
+    parser.add_argument("--display", default=":99")
+    parser.add_argument("--json", help="Куда сохранить результат (- для stdout)")
+    args = parser.parse_args()
+
+    xvfb = start_xvfb(args.display) if args.xvfb else None
+    factories = dict(voice_coop.KEY_BACKENDS)
+    factories["legacy-xdotool"] = LegacyXdotool
+
+    results = []
+    try:
+        for name in args.backends.split(","):
+            name = name.strip()
+            try:
+                backend = factories[name]()
+            except Exception as e:
+                results.append({"backend": name, "error": str(e)})
+                continue
+            try:
+                presses = args.presses if name != "legacy-xdotool" else min(args.presses, 100)
+                results.append(bench_backend(backend, args.key, presses, args.warmup))
+            finally:
+                backend.close()
+    finally:
+        if xvfb is not None:
+            xvfb.terminate()
+            xvfb.wait()
+
+    print_table(results, ["backend", "presses", "presses_per_sec", "p50_ms", "p99_ms", "max_ms", "error"])
+    if args.json:
+        dump_json({"benchmark": "key_injection", "key": args.key, "results": results}, args.json)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+"""Громкость чанка: прежний calculate_volume против потокового LoudnessMeter
+
+Для размеров чанка 128..8192 сэмплов печатает время на чанк и объём
+памяти, выделяемой за вызов (по tracemalloc).
+
+    python benchmarks/bench_loudness.py
+"""
+
+import argparse
+import timeit
+import tracemalloc
+
+import numpy as np
+
+from _common import dump_json, print_table
+
+import voice_coop
+
+SIZES = (128, 256, 512, 1024, 2048, 4096, 8192)
+BATCH = 64
+
+
+def legacy_calculate_volume(audio_data):
+    """calculate_volume до перехода на потоковый измеритель"""
+    if audio_data is None or len(audio_data) == 0:
+        return -100
+    audio_float = audio_data.astype(np.float32)
+    rms = np.sqrt(np.mean(audio_float ** 2))
+    return 20 * np.log10(rms / 32768.0) if rms > 0 else -100
+
+
+def us_per_call(func, number):
+    return min(timeit.repeat(func, number=number, repeat=5)) / number * 1e6
+
+
+def alloc_per_call(func):
+    func()
+    tracemalloc.start()
+    tracemalloc.reset_peak()
+    func()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return peak
+
+
+def bench_size(size, number):
+    rng = np.random.default_rng(size)
+    chunk = (rng.standard_normal(size) * 3000).astype(np.int16)
+    block = (rng.standard_normal((BATCH, size)) * 3000).astype(np.int16)
+    meter = voice_coop.LoudnessMeter(window_ms=100)
+
+    cases = {
+        "legacy": lambda: legacy_calculate_volume(chunk),
+        "calculate_volume": lambda: voice_coop.calculate_volume(chunk),
+        "meter.update": lambda: meter.update(chunk),
+    }
+    row = {"chunk": size}
+    for name, func in cases.items():
+        row[f"{name}_us"] = round(us_per_call(func, number), 2)
+        row[f"{name}_alloc_b"] = alloc_per_call(func)
+
+    batched = us_per_call(lambda: voice_coop.calculate_volumes(block), max(1, number // BATCH))
+    row["batched_us_per_chunk"] = round(batched / BATCH, 2)
+
+    # Результаты должны совпадать с прежней функцией
+    assert abs(voice_coop.calculate_volume(chunk) - legacy_calculate_volume(chunk)) < 0.01
+    return row
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--number", type=int, default=5000)
+    parser.add_argument("--json", help="Куда сохранить результат (- для stdout)")
+    args = parser.parse_args()
+
+    results = [bench_size(size, args.number) for size in SIZES]
+    print_table(results, ["chunk", "legacy_us", "legacy_alloc_b", "calculate_volume_us",
+                          "calculate_volume_alloc_b", "meter.update_us", "meter.update_alloc_b",
+                          "batched_us_per_chunk"])
+    if args.json:
+        dump_json({"benchmark": "loudness", "results": results}, args.json)
+
+
+if __name__ == "__main__":
+    main()
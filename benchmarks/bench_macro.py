@@ -0,0 +1,183 @@
+"""Точность таймингов макросов: планировщик по срокам против цепочки sleep
+
+Без дисплея: нажатия пишет записывающий исполнитель. Срабатывания идут
+с темпом --rate, так что макросы перекрываются; меряем опоздание
+каждого события от планового срока, разброс опозданий внутри прогона
+(джиттер интервалов) и сколько занимает сам запуск макроса - он не
+должен ждать уже идущих. --load добавляет потоки, занятые Python-кодом:
+с ними опоздание упирается в sys.getswitchinterval() (5 мс), пока поток
+ждёт GIL. С --backend нажатия уходят в
+настоящий бэкенд, например под Xvfb:
+
+    python benchmarks/bench_macro.py --triggers 200 --rate 20 --load 0,2
+    python benchmarks/bench_macro.py --backend xtest --xvfb
+"""
+
+import argparse
+import collections
+import threading
+import time
+
+from _common import dump_json, print_table, summarize_ms
+
+import voice_coop
+
+DEFAULT_MACRO = "hold shift 120, tap e, wait 30, tap r"
+
+
+class RecordingKeys:
+    """Исполнитель вместо KeyPresser: время каждого зажатия и отпускания"""
+
+    def __init__(self, backend=None):
+        self.backend = backend
+        self.lock = threading.Lock()
+        self.held = {}
+
+    def _record(self, key, delta):
+        with self.lock:
+            self.held[key] = self.held.get(key, 0) + delta
+
+    def key_down(self, key):
+        if self.backend is not None:
+            self.backend.key_down(key)
+        self._record(key, 1)
+
+    def key_up(self, key):
+        if self.backend is not None:
+            self.backend.key_up(key)
+        self._record(key, -1)
+
+    def stuck(self):
+        """Клавиши, которые остались зажатыми (или отпущены лишний раз)"""
+        with self.lock:
+            return sorted(key for key, count in self.held.items() if count)
+
+
+def busy(stop):
+    while not stop.is_set():
+        sum(range(1000))
+
+
+def play_with_sleeps(events, keys, runs):
+    """Старый способ: sleep между шагами, каждый макрос в своём потоке"""
+    start = time.perf_counter()
+    previous = 0.0
+    late = []
+    runs.append(late)
+    for offset, action, key in events:
+        time.sleep(offset - previous)
+        previous = offset
+        late.append(time.perf_counter() - (start + offset))
+        if action == "down":
+            keys.key_down(key)
+        else:
+            keys.key_up(key)
+
+
+def run_case(mode, load, args, backend):
+    events = voice_coop.parse_macro(args.macro)
+    keys = RecordingKeys(backend)
+    stop = threading.Event()
+    loaders = [threading.Thread(target=busy, args=(stop,), daemon=True) for _ in range(load)]
+    for loader in loaders:
+        loader.start()
+
+    scheduler = voice_coop.MacroScheduler(keys) if mode == "scheduler" else None
+    if scheduler is not None:
+        scheduler.recent = collections.deque(maxlen=args.triggers)  # Джиттер по всем прогонам
+        scheduler.start()
+    runs = []
+    players = []
+    submits = []
+    try:
+        due = time.perf_counter()
+        for _ in range(args.triggers):
+            now = time.perf_counter()
+            if now < due:
+                time.sleep(due - now)
+            t0 = time.perf_counter()
+            if scheduler is not None:
+                scheduler.submit(events)
+            else:
+                player = threading.Thread(target=play_with_sleeps, args=(events, keys, runs))
+                player.start()
+                players.append(player)
+            submits.append(time.perf_counter() - t0)
+            due += 1.0 / args.rate
+
+        deadline = time.perf_counter() + events[-1][0] + 2.0
+        if scheduler is not None:
+            while scheduler.get_stats()['active'] and time.perf_counter() < deadline:
+                time.sleep(0.01)
+            stats = scheduler.get_stats()
+        for player in players:
+            player.join()
+    finally:
+        if scheduler is not None:
+            scheduler.stop()
+        stop.set()
+        for loader in loaders:
+            loader.join()
+
+    if scheduler is not None:
+        late = {"p50_ms": round(stats['late_p50_ms'], 4), "p99_ms": round(stats['late_p99_ms'], 4),
+                "max_ms": round(stats['late_max_ms'], 4)}
+        jitter = [run['jitter_ms'] / 1000 for run in stats['recent']]
+        completed = stats['completed']
+    else:
+        late = summarize_ms([x for run in runs for x in run])
+        # У цепочки sleep опоздание копится от шага к шагу
+        jitter = [max(run) - min(run) for run in runs]
+        completed = len(players)
+    jitter_stats = summarize_ms(jitter)
+    submit_stats = summarize_ms(submits)
+    return {
+        "mode": mode,
+        "load": load,
+        "macros": completed,
+        "late_p50_ms": late.get("p50_ms"),
+        "late_p99_ms": late.get("p99_ms"),
+        "late_max_ms": late.get("max_ms"),
+        "jitter_p50_ms": jitter_stats.get("p50_ms"),
+        "jitter_p99_ms": jitter_stats.get("p99_ms"),
+        "submit_p99_ms": submit_stats.get("p99_ms"),
+        "stuck_keys": ",".join(keys.stuck()),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--macro", default=DEFAULT_MACRO, help="Макрос для проверки")
+    parser.add_argument("--triggers", type=int, default=100, help="Сколько раз запустить макрос")
+    parser.add_argument("--rate", type=float, default=20.0, help="Запусков в секунду (макросы перекрываются)")
+    parser.add_argument("--load", default="0,2", help="Числа занятых потоков через запятую")
+    parser.add_argument("--modes", default="scheduler,sleep", help="Способы исполнения через запятую")
+    parser.add_argument("--backend", help="Нажимать по-настоящему: xtest, uinput, xdotool, simulated")
+    parser.add_argument("--xvfb", action="store_true", help="Запустить Xvfb на время теста")
+    parser.add_argument("--display", default=":99")
+    parser.add_argument("--json", help="Куда сохранить результат (- для stdout)")
+    args = parser.parse_args()
+
+    xvfb = None
+    if args.xvfb:
+        from bench_key_injection import start_xvfb
+        xvfb = start_xvfb(args.display)
+    backend = voice_coop.KEY_BACKENDS[args.backend]() if args.backend else None
+    try:
+        results = [run_case(mode.strip(), int(load), args, backend)
+                   for mode in args.modes.split(",") for load in args.load.split(",")]
+    finally:
+        if backend is not None:
+            backend.close()
+        if xvfb is not None:
+            xvfb.terminate()
+            xvfb.wait()
+
+    print_table(results, ["mode", "load", "macros", "late_p50_ms", "late_p99_ms", "late_max_ms",
+                          "jitter_p50_ms", "jitter_p99_ms", "submit_p99_ms", "stuck_keys"])
+    if args.json:
+        dump_json({"benchmark": "macro", "params": vars(args), "results": results}, args.json)
+
+
+if __name__ == "__main__":
+    main()
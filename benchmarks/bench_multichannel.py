@@ -0,0 +1,191 @@
+"""Многоканальная детекция одним векторным проходом против детектора на каждый микрофон
+
+Каналы - синтетические крики (у каждого игрока свой шум и свои
+моменты криков), звук идёт в ускоренном режиме. Способы:
+  vector    - один DetectionEngine на многоканальный MixSource
+              (ChannelDetector: все каналы за один проход);
+  threads   - свой источник и DetectionEngine на канал в одном процессе;
+  processes - отдельный процесс на канал, как отдельный экземпляр
+              программы на каждый микрофон.
+Каждый случай идёт в свежем процессе, чтобы память мерилась честно.
+cpu_ms_per_s - процессорное время детекции на секунду звука,
+total_cpu_ms - всё время процессов вместе с запуском интерпретатора
+и импортами. Вторая таблица - сам проход детектора на один чанк.
+
+    python benchmarks/bench_multichannel.py --channels 1,2,4,8,16 --json result.json
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+
+from _common import dump_json, print_table
+
+import voice_coop
+
+SHOUT_LEVEL = -12.0
+SHOUT_LENGTH = 0.4
+
+
+def player_source(index, seconds, period):
+    """Синтетический игрок: крики каждые period секунд со своим сдвигом"""
+    offset = 1.0 + (index * 0.137) % period
+    shouts = [(t, SHOUT_LENGTH, SHOUT_LEVEL) for t in voice_coop.np.arange(offset, seconds - 1.0, period)]
+    return voice_coop.SyntheticSource("shout", seconds=seconds, noise_db=-50.0, shouts=shouts,
+                                      seed=index, realtime=False)
+
+
+def run_child(mode, channels, first, args):
+    """Один случай в этом процессе: замеры для родителя"""
+    import resource
+
+    if mode == "vector":
+        players = [player_source(first + i, args.seconds, args.period) for i in range(channels)]
+        sources = [voice_coop.MixSource(players, realtime=False)]
+        keys = [[f"ch{first + i}" for i in range(channels)]]
+        labels = sum(len(player.labels) for player in players)
+    else:
+        sources = [player_source(first + i, args.seconds, args.period) for i in range(channels)]
+        keys = [[f"ch{first + i}"] for i in range(channels)]
+        labels = sum(len(source.labels) for source in sources)
+
+    triggers = []
+    engines = []
+    for source, source_keys in zip(sources, keys):
+        engine = voice_coop.DetectionEngine(source)
+        engine.configure(threshold=args.threshold, button_input=source_keys[0], channel_keys=source_keys,
+                         sender=triggers.append, sender_stage="inject")
+        engines.append(engine)
+
+    started = time.perf_counter()
+    cpu_started = time.process_time()
+    for engine in engines:
+        engine.start()
+    for source in sources:
+        source.start_recording()
+    for engine, source in zip(engines, sources):
+        source.finished.wait()
+        while engine.position < source.ring.write_index:
+            time.sleep(0.001)
+    wall = time.perf_counter() - started
+    cpu = time.process_time() - cpu_started
+    for engine, source in zip(engines, sources):
+        engine.stop()
+        source.stop_recording()
+
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    return {
+        "wall": wall,
+        "cpu": cpu,
+        "total_cpu": usage.ru_utime + usage.ru_stime,
+        "rss_mb": usage.ru_maxrss / 1024,
+        "triggers": len(triggers),
+        "labels": labels,
+    }
+
+
+def spawn(mode, channels, first, args):
+    command = [sys.executable, os.path.abspath(__file__), "--child", mode, "--channels", str(channels),
+               "--first", str(first), "--seconds", str(args.seconds), "--period", str(args.period),
+               "--threshold", str(args.threshold)]
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(sys.path))
+    return subprocess.Popen(command, stdout=subprocess.PIPE, text=True, env=env)
+
+
+def collect(procs):
+    reports = []
+    for proc in procs:
+        out, _ = proc.communicate()
+        if proc.returncode != 0:
+            raise SystemExit(f"Дочерний процесс упал: {proc.returncode}")
+        reports.append(json.loads(out))
+    return reports
+
+
+def run_case(mode, channels, args):
+    if mode == "processes":
+        reports = collect([spawn("single", 1, i, args) for i in range(channels)])
+    else:
+        reports = collect([spawn(mode, channels, 0, args)])
+    wall = max(r["wall"] for r in reports)
+    cpu = sum(r["cpu"] for r in reports)
+    return {
+        "mode": mode,
+        "channels": channels,
+        "realtime_x": round(args.seconds / wall, 1),
+        "cpu_ms_per_s": round(cpu / args.seconds * 1000, 2),
+        "total_cpu_ms": round(sum(r["total_cpu"] for r in reports) * 1000),
+        "rss_mb": round(sum(r["rss_mb"] for r in reports), 1),
+        "labels": sum(r["labels"] for r in reports),
+        "triggers": sum(r["triggers"] for r in reports),
+    }
+
+
+def bench_pass(channels, args):
+    """Один чанк: ChannelDetector на все каналы против LoudnessMeter на каждый"""
+    np = voice_coop.np
+    rng = np.random.default_rng(channels)
+    block = rng.normal(0, 3000, (voice_coop.CHUNK, channels)).astype(np.int16)
+    columns = [np.ascontiguousarray(block[:, i]) for i in range(channels)]
+    detector = voice_coop.ChannelDetector(channels)
+    meters = [voice_coop.LoudnessMeter() for _ in range(channels)]
+    last = [-voice_coop.math.inf] * channels
+
+    started = time.perf_counter()
+    for i in range(args.passes):
+        detector.process(block, i * 0.01, args.threshold)
+    vector = (time.perf_counter() - started) / args.passes
+
+    started = time.perf_counter()
+    for i in range(args.passes):
+        now = i * 0.01
+        for c in range(channels):
+            if meters[c].update(columns[c]) > args.threshold and now - last[c] > voice_coop.TRIGGER_COOLDOWN:
+                last[c] = now
+    loop = (time.perf_counter() - started) / args.passes
+    return {
+        "channels": channels,
+        "vector_us": round(vector * 1e6, 2),
+        "per_channel_us": round(loop * 1e6, 2),
+        "speedup": round(loop / vector, 2),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--channels", default="1,2,4,8,16", help="Числа каналов через запятую")
+    parser.add_argument("--modes", default="vector,threads,processes", help="Способы через запятую")
+    parser.add_argument("--seconds", type=float, default=20.0, help="Длина звука каждого канала, с")
+    parser.add_argument("--period", type=float, default=1.5, help="Пауза между криками игрока, с")
+    parser.add_argument("--threshold", type=float, default=-25.0, help="Порог, дБ")
+    parser.add_argument("--passes", type=int, default=2000, help="Повторов прохода по чанку")
+    parser.add_argument("--json", help="Куда сохранить результат (- для stdout)")
+    parser.add_argument("--child", help=argparse.SUPPRESS)
+    parser.add_argument("--first", type=int, default=0, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        # Движок печатает о своей работе - в родителя идёт только JSON
+        output, sys.stdout = sys.stdout, open(os.devnull, "w")
+        report = run_child(args.child, int(args.channels), args.first, args)
+        output.write(json.dumps(report) + "\n")
+        return
+
+    counts = [int(x) for x in args.channels.split(",")]
+    results = [run_case(mode.strip(), n, args) for mode in args.modes.split(",") for n in counts]
+    passes = [bench_pass(n, args) for n in counts]
+
+    print_table(results, ["mode", "channels", "realtime_x", "cpu_ms_per_s", "total_cpu_ms", "rss_mb",
+                          "labels", "triggers"])
+    print()
+    print_table(passes, ["channels", "vector_us", "per_channel_us", "speedup"])
+    if args.json:
+        dump_json({"benchmark": "multichannel", "params": vars(args), "results": results,
+                   "passes": passes}, args.json)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,107 @@
+"""Выигрыш онсет-детектора по задержке срабатывания против порога по чанку
+
+Синтетические крики (шум + нарастающий тон) начинаются в случайном месте
+чанка. Для каждого способа считается, сколько миллисекунд проходит от
+настоящего начала крика до конца чанка, после которого детектор может
+нажать клавишу (раньше конца чанка звук в программу не попадает).
+engine - чем детектор "onset" пользуется на таком чанке: на чанках
+меньше ONSET_MIN_CHUNK онсет не выигрывает, и движок берёт громкость.
+
+    python benchmarks/bench_onset.py --trials 500 --chunks 256,1024
+"""
+
+import argparse
+
+import numpy as np
+
+from _common import dump_json, print_table, summarize_ms
+
+import voice_coop
+
+
+def make_signal(rng, rate, onset, length, shout_db, attack_ms):
+    t = np.arange(length) / rate
+    noise = rng.standard_normal(length) * 32768 * 10 ** (-55 / 20)
+    envelope = np.clip((np.arange(length) - onset) / (rate * attack_ms / 1000), 0, 1)
+    amplitude = 32768 * 10 ** (shout_db / 20) * np.sqrt(2)
+    tone = np.sin(2 * np.pi * 400 * t) * amplitude * envelope
+    return np.clip(noise + tone, -32768, 32767).astype(np.int16)
+
+
+def volume_decision(signal, chunk, threshold):
+    for start in range(0, len(signal) - chunk + 1, chunk):
+        if voice_coop.calculate_volume(signal[start:start + chunk]) > threshold:
+            return start + chunk
+    return None
+
+
+def onset_decision(signal, chunk, threshold, rate, frame_ms):
+    detector = voice_coop.OnsetDetector(rate, threshold, frame_ms=frame_ms)
+    for start in range(0, len(signal) - chunk + 1, chunk):
+        onsets = detector.process(signal[start:start + chunk], start)
+        if onsets:
+            return start + chunk, onsets[0]['onset_index']
+    return None, None
+
+
+def run(chunk, args):
+    rng = np.random.default_rng(args.seed)
+    rate = args.rate
+    volume_lat, onset_lat, onset_err = [], [], []
+    missed = {"volume": 0, "onset": 0}
+
+    for _ in range(args.trials):
+        onset = 4 * chunk + int(rng.integers(0, chunk))
+        signal = make_signal(rng, rate, onset, 12 * chunk, args.shout_db, args.attack_ms)
+
+        decided = volume_decision(signal, chunk, args.threshold)
+        if decided is None:
+            missed["volume"] += 1
+        else:
+            volume_lat.append((decided - onset) / rate)
+
+        decided, found = onset_decision(signal, chunk, args.threshold, rate, args.frame_ms)
+        if decided is None:
+            missed["onset"] += 1
+        else:
+            onset_lat.append((decided - onset) / rate)
+            onset_err.append(abs(found - onset) / rate)
+
+    vol = summarize_ms(volume_lat)
+    ons = summarize_ms(onset_lat)
+    return {
+        "chunk": chunk,
+        "engine": "onset" if chunk >= voice_coop.ONSET_MIN_CHUNK else "volume",
+        "volume_p50_ms": vol.get("p50_ms"),
+        "onset_p50_ms": ons.get("p50_ms"),
+        "saved_p50_ms": round(vol.get("p50_ms", 0) - ons.get("p50_ms", 0), 3),
+        "volume_p99_ms": vol.get("p99_ms"),
+        "onset_p99_ms": ons.get("p99_ms"),
+        "onset_err_p50_ms": summarize_ms(onset_err).get("p50_ms"),
+        "missed_volume": missed["volume"],
+        "missed_onset": missed["onset"],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--chunks", default="256,512,1024")
+    parser.add_argument("--rate", type=int, default=voice_coop.RATE)
+    parser.add_argument("--trials", type=int, default=300)
+    parser.add_argument("--threshold", type=float, default=-20)
+    parser.add_argument("--shout-db", type=float, default=-12, help="Уровень крика, дБ")
+    parser.add_argument("--attack-ms", type=float, default=10, help="Нарастание крика, мс")
+    parser.add_argument("--frame-ms", type=float, default=voice_coop.ONSET_FRAME_MS)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--json", help="Куда сохранить результат (- для stdout)")
+    args = parser.parse_args()
+
+    results = [run(int(c), args) for c in args.chunks.split(",")]
+    print_table(results, ["chunk", "engine", "volume_p50_ms", "onset_p50_ms", "saved_p50_ms", "volume_p99_ms",
+                          "onset_p99_ms", "onset_err_p50_ms", "missed_volume", "missed_onset"])
+    if args.json:
+        dump_json({"benchmark": "onset", "params": vars(args), "results": results}, args.json)
+
+
+if __name__ == "__main__":
+    main()
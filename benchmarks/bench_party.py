@@ -0,0 +1,221 @@
+"""Нагрузочный тест режима вечеринки: сотни кричащих клиентов на один сервер
+
+Каждое "событие" - часть клиентов почти одновременно кричит (разброс
+--spread мс) разные клавиши с разной громкостью. Для каждой политики
+считается, сколько нажатий получилось на событие (в идеале "first" -
+по одному на каждую прокричанную клавишу, голосование - одно, а без
+большинства ни одного), задержка от первой команды события до нажатия,
+доля событий с верными нажатиями и CPU потоков сервера. Перед нагрузкой
+проверяется, что голосование двух игроков с разными клавишами даёт не
+больше одного нажатия.
+
+    python benchmarks/bench_party.py --clients 300 --events 40
+"""
+
+import argparse
+import os
+import random
+import socket
+import threading
+import time
+
+from _common import dump_json, print_table, raise_fd_limit, summarize_ms
+
+import voice_coop
+
+
+class RecordingSink:
+    """Исполнитель вместо KeyPresser: запоминает время и клавиши нажатий"""
+
+    def __init__(self):
+        self.presses = []
+        self.lock = threading.Lock()
+
+    def __call__(self, command):
+        with self.lock:
+            self.presses.append((time.time(), voice_coop.command_keys(command)))
+
+
+class UdpClient:
+    def __init__(self, port):
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.connect(("127.0.0.1", port))
+        self.session_id = int.from_bytes(os.urandom(4), "big")
+        self.seq = 0
+
+    def send(self, frame):
+        self.seq += 1
+        self.sock.send(voice_coop.UDP_HEADER.pack(self.session_id, self.seq) + frame)
+
+    def close(self):
+        self.sock.close()
+
+
+class TcpClient:
+    def __init__(self, port):
+        self.sock = socket.create_connection(("127.0.0.1", port))
+        self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+    def send(self, frame):
+        self.sock.sendall(frame)
+
+    def close(self):
+        self.sock.close()
+
+
+def thread_cpu(thread):
+    return time.clock_gettime(time.pthread_getcpuclockid(thread.ident))
+
+
+def expected_presses(policy, shouts):
+    """Что должно нажаться: (клавиша, громкость, время) по всем крикам события"""
+    if policy == "first":
+        return sorted({key for key, _, _ in shouts})
+    totals = {}
+    for key, level, _ in shouts:
+        weight = 10 ** (round(level) / 20) if policy == "loudness" else 1.0
+        totals[key] = totals.get(key, 0.0) + weight
+    winner = max(totals, key=totals.get)
+    if policy == "majority" and totals[winner] * 2 <= len(shouts):
+        return []
+    return [winner]
+
+
+def check_voting():
+    """Два игрока с разными клавишами: громкость - ровно одно нажатие,
+    большинство - ни одного (1:1), а при 2:1 - одно"""
+    cases = [
+        ("loudness", [("p1", "space", -10.0), ("p2", "enter", -20.0)], ["space"]),
+        ("loudness", [("p1", "space", -20.0), ("p2", "enter", -10.0)], ["enter"]),
+        ("majority", [("p1", "space", -10.0), ("p2", "enter", -10.0)], []),
+        ("majority", [("p1", "space", -10.0), ("p2", "enter", -10.0), ("p3", "enter", -30.0)], ["enter"]),
+    ]
+    for policy, shouts, expected in cases:
+        pressed = []
+        aggregator = voice_coop.CommandAggregator(lambda c: pressed.append(voice_coop.command_keys(c)),
+                                                  policy, window=0.1, rate_limit=0)
+        for i, (source, key, level) in enumerate(shouts):
+            command = voice_coop.make_command(key)
+            command['level'] = level
+            aggregator.submit(source, command, i * 0.01)
+        aggregator.flush(1.0)
+        if pressed != expected:
+            raise SystemExit(f"Голосование {policy} неверно: {shouts} -> {pressed}, ждали {expected}")
+
+
+def make_event(rng, n_clients, args):
+    """Кто кричит, что, как громко и с какой задержкой от начала события"""
+    shouters = rng.sample(range(n_clients), max(1, int(n_clients * args.participation)))
+    keys = args.keys.split(",")
+    weights = [len(keys) - i for i in range(len(keys))]  # Первая клавиша популярнее
+    shouts = []
+    for index in shouters:
+        key = rng.choices(keys, weights)[0]
+        level = rng.uniform(-40, -3)
+        offset = rng.uniform(0, args.spread / 1000)
+        shouts.append((index, key, level, offset))
+    shouts.sort(key=lambda s: s[3])
+    return shouts
+
+
+def run_policy(policy, args):
+    rng = random.Random(args.seed)
+    sink = RecordingSink()
+    server = voice_coop.NetworkServer(executor=sink, port=args.port)
+    if not server.start_server():
+        raise SystemExit("Сервер не запустился")
+    server.configure_party(None if policy == "none" else policy, window=args.window / 1000,
+                           rate_limit=args.rate_limit)
+
+    client_class = UdpClient if args.transport == "udp" else TcpClient
+    clients = [client_class(args.port) for _ in range(args.clients)]
+    time.sleep(0.3)
+
+    presses_per_event = []
+    keys_per_event = []
+    latencies = []
+    correct = 0
+    cpu_before = thread_cpu(server.server_thread) + thread_cpu(server.injector.thread)
+    started = time.monotonic()
+    try:
+        for _ in range(args.events):
+            shouts = make_event(rng, args.clients, args)
+            before = len(sink.presses)
+            event_start = time.time()
+            sent = []
+            for index, key, level, offset in shouts:
+                delay = event_start + offset - time.time()
+                if delay > 0:
+                    time.sleep(delay)
+                now = time.time()
+                command = voice_coop.make_command(key)
+                command['level'] = level
+                clients[index].send(voice_coop.encode_command(command))
+                sent.append((key, level, now))
+
+            # Окно голосования + запас на доставку и нажатие
+            time.sleep(args.window / 1000 + args.gap)
+            with sink.lock:
+                presses = sink.presses[before:]
+            presses_per_event.append(len(presses))
+            shouted = {key for key, _, _ in sent}
+            keys_per_event.append(len(shouted))
+            if presses:
+                latencies.append(presses[0][0] - sent[0][2])
+            if policy != "none" and sorted(keys for _, keys in presses) == expected_presses(policy, sent):
+                correct += 1
+    finally:
+        elapsed = time.monotonic() - started
+        cpu = thread_cpu(server.server_thread) + thread_cpu(server.injector.thread) - cpu_before
+        party = server.get_party_stats() or {}
+        for client in clients:
+            client.close()
+        server.stop_server()
+
+    stats = summarize_ms(latencies)
+    return {
+        "policy": policy,
+        "clients": args.clients,
+        "keys_per_event": round(sum(keys_per_event) / len(keys_per_event), 2),
+        "presses_per_event": round(sum(presses_per_event) / len(presses_per_event), 2),
+        "correct_pct": round(correct / args.events * 100, 1) if policy != "none" else "-",
+        "p50_ms": stats.get("p50_ms"),
+        "p99_ms": stats.get("p99_ms"),
+        "undecided": party.get("undecided", 0),
+        "limited": party.get("limited", 0),
+        "server_cpu_pct": round(cpu / elapsed * 100, 2),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--policies", default="none,first,majority,loudness",
+                        help="Политики через запятую (none - без сведения)")
+    parser.add_argument("--clients", type=int, default=300)
+    parser.add_argument("--transport", choices=voice_coop.TRANSPORTS, default="udp")
+    parser.add_argument("--events", type=int, default=30)
+    parser.add_argument("--participation", type=float, default=0.5, help="Доля клиентов, кричащих в событии")
+    parser.add_argument("--spread", type=float, default=80, help="Разброс криков внутри события, мс")
+    parser.add_argument("--keys", default="space,enter,a")
+    parser.add_argument("--window", type=float, default=voice_coop.PARTY_WINDOW * 1000, help="Окно, мс")
+    parser.add_argument("--rate-limit", type=float, default=voice_coop.PARTY_RATE_LIMIT)
+    parser.add_argument("--gap", type=float, default=0.3, help="Пауза между событиями, с")
+    parser.add_argument("--port", type=int, default=23457)
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--json", help="Куда сохранить результат (- для stdout)")
+    args = parser.parse_args()
+
+    if args.spread >= args.window:
+        print("Внимание: разброс криков не меньше окна - часть события попадёт в следующее окно")
+    raise_fd_limit(args.clients * 2 + 64)
+
+    check_voting()
+    results = [run_policy(policy.strip(), args) for policy in args.policies.split(",")]
+    print_table(results, ["policy", "clients", "keys_per_event", "presses_per_event", "correct_pct", "p50_ms", "p99_ms",
+                          "undecided", "limited", "server_cpu_pct"])
+    if args.json:
+        dump_json({"benchmark": "party", "params": vars(args), "results": results}, args.json)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,202 @@
+"""Пропускная способность и задержки цепочки NetworkClient -> NetworkServer -> нажатие
+
+Настоящий NetworkServer на loopback, вместо KeyPresser - записывающий
+исполнитель. N клиентов (потоки или процессы) шлют команды с заданным
+темпом по расписанию (открытый цикл): задержка считается от момента,
+когда команда должна была уйти, поэтому отставание отправителя тоже
+видно. --rate 0 - каждый клиент шлёт так быстро, как может.
+
+    python benchmarks/bench_pipeline.py --clients 1,4,16 --rate 200 --json result.json
+    python benchmarks/bench_pipeline.py --save-baseline pipeline.json
+    python benchmarks/bench_pipeline.py --baseline pipeline.json
+"""
+
+import argparse
+import json
+import multiprocessing
+import os
+import sys
+import threading
+import time
+
+from _common import dump_json, percentile, print_table, raise_fd_limit, summarize_ms
+
+import voice_coop
+
+
+class RecordingSink:
+    """Исполнитель вместо KeyPresser: время доставки каждой команды"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.received = {}  # (клавиша, отметка времени) -> задержка, с
+
+    def __call__(self, command):
+        latency = time.time() - command['timestamp']
+        with self.lock:
+            self.received[(command['key'], command['timestamp'])] = latency
+
+
+def client_key(index):
+    """Своя клавиша у каждого клиента: команда опознаётся по (клавиша, время)"""
+    if index < len(voice_coop.KEY_TABLE):
+        return voice_coop.KEY_TABLE[index]
+    return f"client{index}"
+
+
+def shout(port, transport, rate, duration, start_at, index):
+    """Один клиент: шлёт команды по расписанию, возвращает (клавиша, время) отправленных"""
+    client = voice_coop.NetworkClient(port=port)
+    if not client.connect_to_server("127.0.0.1", transport):
+        return []
+    sent = []
+    key = client_key(index)
+    try:
+        while time.time() < start_at:
+            time.sleep(0.001)
+        # Клиенты сдвинуты по фазе, чтобы не слать все разом
+        due = start_at + (index % 8 / rate / 8 if rate else 0.0)
+        end = start_at + duration
+        while due < end:
+            now = time.time()
+            if now < due:
+                time.sleep(due - now)
+            # Время в кадре - плановое: задержка отправителя не прячется
+            timestamp = due if rate else time.time()
+            client.send_key_press({'type': 'key_press', 'key': key, 'timestamp': timestamp})
+            sent.append((key, timestamp))
+            due = due + 1.0 / rate if rate else time.time()
+        time.sleep(0.2)
+    finally:
+        client.disconnect()
+    return sent
+
+
+def shout_process(port, transport, rate, duration, start_at, index, results):
+    sys.stdout = open(os.devnull, "w")
+    results.put(shout(port, transport, rate, duration, start_at, index))
+
+
+def run_case(transport, clients, args):
+    sink = RecordingSink()
+    server = voice_coop.NetworkServer(executor=sink, port=args.port)
+    if not server.start_server():
+        raise SystemExit("Сервер не запустился")
+
+    start_at = time.time() + 1.0 + clients * 0.01
+    sent = []
+    try:
+        if args.mode == "process":
+            results = multiprocessing.Queue()
+            procs = [multiprocessing.Process(target=shout_process, daemon=True,
+                                             args=(args.port, transport, args.rate, args.duration,
+                                                   start_at, i, results))
+                     for i in range(clients)]
+            for proc in procs:
+                proc.start()
+            for _ in procs:
+                sent.extend(results.get(timeout=args.duration + 30))
+            for proc in procs:
+                proc.join()
+        else:
+            outputs = [None] * clients
+
+            def worker(i):
+                outputs[i] = shout(args.port, transport, args.rate, args.duration, start_at, i)
+
+            threads = [threading.Thread(target=worker, args=(i,)) for i in range(clients)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            for output in outputs:
+                sent.extend(output)
+        injection = server.get_injection_stats()
+    finally:
+        server.stop_server()
+
+    with sink.lock:
+        latencies = [sink.received[item] for item in sent if item in sink.received]
+    stats = summarize_ms(latencies)
+    ms = [x * 1000 for x in latencies]
+    return {
+        "transport": transport,
+        "clients": clients,
+        "rate": args.rate,
+        "sent": len(sent),
+        "received": len(latencies),
+        "loss_pct": round((len(sent) - len(latencies)) / max(1, len(sent)) * 100, 3),
+        "throughput": round(len(latencies) / args.duration, 1),
+        "queue_dropped": injection['dropped'],
+        "p50_ms": stats.get("p50_ms"),
+        "p90_ms": stats.get("p90_ms"),
+        "p99_ms": stats.get("p99_ms"),
+        "p999_ms": round(percentile(ms, 99.9), 4) if ms else None,
+        "max_ms": stats.get("max_ms"),
+    }
+
+
+def case_key(row):
+    return f"{row['transport']}/{row['clients']}/{row['rate']}"
+
+
+def compare(results, baseline, tolerance):
+    """Случаи, где p99 вырос, пропускная способность упала или появились потери"""
+    base = {case_key(r): r for r in baseline.get("results", [])}
+    regressions = []
+    for row in results:
+        old = base.get(case_key(row))
+        if not old or row["p99_ms"] is None or old["p99_ms"] is None:
+            continue
+        row["baseline_p99_ms"] = old["p99_ms"]
+        row["baseline_throughput"] = old["throughput"]
+        # Доли миллисекунды на loopback - шум планировщика, не регрессия
+        if row["p99_ms"] > max(old["p99_ms"] * (1 + tolerance), old["p99_ms"] + 0.5):
+            regressions.append(f"{case_key(row)}: p99")
+        if row["throughput"] < old["throughput"] * (1 - tolerance):
+            regressions.append(f"{case_key(row)}: пропускная способность")
+        if row["loss_pct"] > old["loss_pct"] + 0.1:
+            regressions.append(f"{case_key(row)}: потери")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--clients", default="1,4,16", help="Числа клиентов через запятую")
+    parser.add_argument("--transport", default="tcp,udp", help="Транспорты через запятую")
+    parser.add_argument("--mode", choices=["thread", "process"], default="thread",
+                        help="Клиенты - потоки или отдельные процессы")
+    parser.add_argument("--rate", type=float, default=100.0, help="Команд в секунду на клиента (0 - максимум)")
+    parser.add_argument("--duration", type=float, default=3.0, help="Длительность нагрузки, с")
+    parser.add_argument("--port", type=int, default=24800)
+    parser.add_argument("--baseline", help="JSON прошлого запуска для сравнения")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="Допустимое ухудшение, доля")
+    parser.add_argument("--save-baseline", help="Сохранить результат как базу")
+    parser.add_argument("--json", help="Куда сохранить результат (- для stdout)")
+    args = parser.parse_args()
+
+    os.environ.setdefault(voice_coop.KEY_BACKEND_ENV, "simulated")
+    counts = [int(x) for x in args.clients.split(",")]
+    raise_fd_limit(max(counts) * 8 + 64)
+
+    results = [run_case(transport.strip(), n, args)
+               for transport in args.transport.split(",") for n in counts]
+    regressions = []
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+
+    print_table(results, ["transport", "clients", "rate", "sent", "received", "loss_pct", "throughput",
+                          "queue_dropped", "p50_ms", "p99_ms", "p999_ms", "max_ms", "baseline_p99_ms"])
+    data = {"benchmark": "pipeline", "params": vars(args), "results": results, "regressions": regressions}
+    if args.save_baseline:
+        dump_json(data, args.save_baseline)
+    if args.json:
+        dump_json(data, args.json)
+    if regressions:
+        print("Регрессии: " + "; ".join(regressions))
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,216 @@
+"""Переподключение клиента к убитому и перезапущенному серверу
+
+Сервер работает в отдельном процессе и отчитывается о каждом нажатии
+датаграммой. Клиент шлёт команды с постоянным темпом; сервер убивается
+(SIGKILL) и через --outage секунд запускается снова. Меряем, когда
+клиент заметил обрыв (и во сколько интервалов пульса это обошлось),
+через сколько после перезапуска снова на связи, сколько команд
+потеряно, дослано из окна и отброшено как устаревшие, и сколько было
+ложных обрывов без убийства сервера. --signal stop замораживает сервер
+(SIGSTOP) вместо убийства: сокет остаётся открытым, и обрыв замечает
+только пульс.
+
+    python benchmarks/bench_reconnect.py --transport tcp,udp --cycles 5
+    python benchmarks/bench_reconnect.py --signal stop --outage 1.5
+"""
+
+import argparse
+import multiprocessing
+import os
+import random
+import signal
+import socket
+import struct
+import sys
+import threading
+import time
+
+from _common import dump_json, print_table, summarize_ms
+
+import voice_coop
+
+REPORT = struct.Struct("!d")
+
+
+def server_process(port, report_port):
+    sys.stdout = open(os.devnull, "w")
+    report = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+
+    def sink(command):
+        report.sendto(REPORT.pack(command['timestamp']), ("127.0.0.1", report_port))
+
+    server = voice_coop.NetworkServer(executor=sink, port=port)
+    report.sendto(b"ready" if server.start_server() else b"fail", ("127.0.0.1", report_port))
+    while True:
+        time.sleep(3600)
+
+
+class Reports:
+    """Принимает отчёты серверов: готовность и отметки времени нажатий"""
+
+    def __init__(self):
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.socket.bind(("127.0.0.1", 0))
+        self.socket.settimeout(0.1)
+        self.port = self.socket.getsockname()[1]
+        self.received = set()
+        self.ready = threading.Event()
+        self.running = True
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def _run(self):
+        while self.running:
+            try:
+                data, _ = self.socket.recvfrom(64)
+            except socket.timeout:
+                continue
+            if data == b"ready":
+                self.ready.set()
+            elif len(data) == REPORT.size:
+                self.received.add(REPORT.unpack(data)[0])
+
+    def close(self):
+        self.running = False
+        self.thread.join()
+        self.socket.close()
+
+
+def start_server(port, reports):
+    reports.ready.clear()
+    proc = multiprocessing.Process(target=server_process, args=(port, reports.port), daemon=True)
+    proc.start()
+    if not reports.ready.wait(10):
+        raise SystemExit("Сервер не запустился")
+    return proc, time.monotonic()
+
+
+def wait_for(predicate, timeout):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if predicate():
+            return time.monotonic()
+        time.sleep(0.001)
+    return None
+
+
+def run_case(transport, args):
+    reports = Reports()
+    proc, _ = start_server(args.port, reports)
+    client = voice_coop.NetworkClient(port=args.port)
+    if not client.connect_to_server("127.0.0.1", transport):
+        raise SystemExit(client.last_error)
+
+    sent = []
+    stop = threading.Event()
+
+    def shout():
+        while not stop.is_set():
+            command = voice_coop.make_command("space")
+            command['timestamp'] = time.time()
+            client.send_key_press(command)
+            sent.append(command['timestamp'])
+            time.sleep(args.gap)
+
+    drops = []
+
+    def watch():
+        # Моменты, когда клиент счёл сервер пропавшим
+        online = True
+        while not stop.is_set():
+            now_online = client.is_online()
+            if online and not now_online:
+                drops.append(time.monotonic())
+            online = now_online
+            time.sleep(0.001)
+
+    sender = threading.Thread(target=shout, daemon=True)
+    sender.start()
+    watcher = threading.Thread(target=watch, daemon=True)
+    watcher.start()
+    rng = random.Random(1)
+    detect, reconnect, outages = [], [], []
+    try:
+        for _ in range(args.cycles):
+            # Случайная фаза относительно пульса: иначе замер видит всегда одну и ту же
+            time.sleep(args.steady + rng.uniform(0, voice_coop.HEARTBEAT_INTERVAL))
+            killed = time.monotonic()
+            if args.signal == "stop":
+                os.kill(proc.pid, signal.SIGSTOP)
+            else:
+                os.kill(proc.pid, signal.SIGKILL)
+                proc.join()
+            noticed = wait_for(lambda: not client.is_online(), args.outage + 5)
+            if noticed is not None:
+                detect.append(noticed - killed)
+            time.sleep(max(0.0, args.outage - (time.monotonic() - killed)))
+            if args.signal == "stop":
+                os.kill(proc.pid, signal.SIGKILL)
+                proc.join()
+            proc, restarted = start_server(args.port, reports)
+            online = wait_for(client.is_online, voice_coop.RECONNECT_MAX_DELAY * 2)
+            if online is not None:
+                reconnect.append(online - restarted)
+            outages.append((killed, online or time.monotonic()))
+        time.sleep(args.steady)
+    finally:
+        stop.set()
+        sender.join()
+        watcher.join()
+        time.sleep(0.2)
+        receivers = client.get_receivers()
+        client.disconnect()
+        os.kill(proc.pid, signal.SIGKILL)
+        proc.join()
+        reports.close()
+
+    link = receivers[0]
+    lost = len(set(sent) - reports.received)
+    detect_stats = summarize_ms(detect)
+    reconnect_stats = summarize_ms(reconnect)
+    interval_ms = voice_coop.HEARTBEAT_INTERVAL * 1000
+    return {
+        "transport": transport,
+        "signal": args.signal,
+        "cycles": args.cycles,
+        "detect_p50_ms": detect_stats.get("p50_ms"),
+        "detect_max_ms": detect_stats.get("max_ms"),
+        # Худшее обнаружение в интервалах пульса
+        "detect_intervals": round(detect_stats.get("max_ms", 0) / interval_ms, 2),
+        "reconnect_p50_ms": reconnect_stats.get("p50_ms"),
+        "reconnect_max_ms": reconnect_stats.get("max_ms"),
+        "reconnected": f"{len(reconnect)}/{args.cycles}",
+        # Обрывы вне простоя сервера - пульс посчитал живого мёртвым
+        "spurious": sum(1 for t in drops if not any(start <= t <= end for start, end in outages)),
+        "sent": len(sent),
+        "lost": lost,
+        "lost_pct": round(lost / max(1, len(sent)) * 100, 2),
+        "replayed": link['replayed'],
+        "expired": link['expired'],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--transport", default="tcp,udp", help="Транспорты через запятую")
+    parser.add_argument("--cycles", type=int, default=5, help="Сколько раз убить сервер")
+    parser.add_argument("--outage", type=float, default=0.3, help="Сколько сервер лежит, с")
+    parser.add_argument("--signal", choices=["kill", "stop"], default="kill",
+                        help="kill - убить сервер, stop - заморозить (обрыв замечает только пульс)")
+    parser.add_argument("--steady", type=float, default=1.0, help="Работа без обрывов между циклами, с")
+    parser.add_argument("--gap", type=float, default=0.02, help="Пауза между командами, с")
+    parser.add_argument("--port", type=int, default=24700)
+    parser.add_argument("--json", help="Куда сохранить результат (- для stdout)")
+    args = parser.parse_args()
+
+    os.environ.setdefault(voice_coop.KEY_BACKEND_ENV, "simulated")
+    results = [run_case(transport.strip(), args) for transport in args.transport.split(",")]
+    print_table(results, ["transport", "signal", "cycles", "detect_p50_ms", "detect_max_ms", "detect_intervals",
+                          "reconnect_p50_ms", "reconnect_max_ms", "reconnected", "spurious", "sent", "lost", "lost_pct",
+                          "replayed", "expired"])
+    if args.json:
+        dump_json({"benchmark": "reconnect", "params": vars(args), "results": results}, args.json)
+
+
+if __name__ == "__main__":
+    main()
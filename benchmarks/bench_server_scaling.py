@@ -0,0 +1,98 @@
+"""Задержка команды на сервере в зависимости от числа подключённых клиентов
+
+Открывает N-1 простаивающих клиентов и одного активного, который шлёт
+команды; задержка считается от отправки до вызова исполнителя нажатий.
+
+    python benchmarks/bench_server_scaling.py --clients 1,10,100,250,500
+"""
+
+import argparse
+import socket
+import threading
+import time
+
+from _common import dump_json, print_table, raise_fd_limit, summarize_ms
+
+import voice_coop
+
+
+class RecordingSink:
+    """Исполнитель вместо KeyPresser: запоминает задержку доставки"""
+
+    def __init__(self):
+        self.latencies = []
+        self.event = threading.Event()
+
+    def __call__(self, command):
+        self.latencies.append(time.time() - command['timestamp'])
+        self.event.set()
+
+
+def connect(port):
+    sock = socket.create_connection(("127.0.0.1", port))
+    sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    return sock
+
+
+def run_case(port, n_clients, commands, gap, idle_seconds):
+    sink = RecordingSink()
+    server = voice_coop.NetworkServer(executor=sink, port=port)
+    if not server.start_server():
+        raise SystemExit("Сервер не запустился")
+
+    sockets = []
+    try:
+        for _ in range(n_clients):
+            sockets.append(connect(port))
+        while len(server.get_connected_clients()) < n_clients:
+            time.sleep(0.01)
+
+        # Нагрузка CPU на простое со всеми подключёнными клиентами
+        cpu_before = time.process_time()
+        time.sleep(idle_seconds)
+        idle_cpu = (time.process_time() - cpu_before) / idle_seconds * 100
+
+        active = sockets[-1]
+        for _ in range(commands):
+            sink.event.clear()
+            command = {'type': 'key_press', 'key': 'space', 'timestamp': time.time()}
+            active.sendall(voice_coop.encode_command(command))
+            sink.event.wait(1.0)
+            time.sleep(gap)
+    finally:
+        for sock in sockets:
+            sock.close()
+        server.stop_server()
+
+    stats = summarize_ms(sink.latencies)
+    return {
+        "clients": n_clients,
+        "received": stats["count"],
+        "p50_ms": stats.get("p50_ms"),
+        "p99_ms": stats.get("p99_ms"),
+        "max_ms": stats.get("max_ms"),
+        "idle_cpu_pct": round(idle_cpu, 2),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--clients", default="1,10,50,100,250,500")
+    parser.add_argument("--commands", type=int, default=200)
+    parser.add_argument("--gap", type=float, default=0.005, help="Пауза между командами, с")
+    parser.add_argument("--idle", type=float, default=1.0, help="Замер CPU на простое, с")
+    parser.add_argument("--port", type=int, default=23456)
+    parser.add_argument("--json", help="Куда сохранить результат (- для stdout)")
+    args = parser.parse_args()
+
+    counts = [int(x) for x in args.clients.split(",")]
+    raise_fd_limit(max(counts) * 2 + 64)
+
+    results = [run_case(args.port, n, args.commands, args.gap, args.idle) for n in counts]
+    print_table(results, ["clients", "received", "p50_ms", "p99_ms", "max_ms", "idle_cpu_pct"])
+    if args.json:
+        dump_json({"benchmark": "server_scaling", "results": results}, args.json)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,142 @@
+"""Холодный старт каждой роли: время импортов (-X importtime) и тяжёлые модули
+
+Каждая роль запускается в отдельном интерпретаторе: импорт voice_coop и
+подготовка того, что роль делает при старте (без ожидания микрофона и
+сети). Сравнение с сохранённой базой ловит регрессии:
+
+    python benchmarks/bench_startup.py --save-baseline startup.json
+    python benchmarks/bench_startup.py --baseline startup.json
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+from _common import REPO_ROOT, dump_json, print_table
+
+HEAVY_MODULES = ("numpy", "pyaudio", "streamlit", "ctypes")
+
+# Что роль делает при старте; ошибки (нет аудио, нет порта) не важны
+ROLES = {
+    "import": "",
+    "serve": (
+        "s = voice_coop.NetworkServer(executor=lambda c: None, port=0)\n"
+        "s.start_server(); s.stop_server()\n"
+    ),
+    "shout": (
+        "c = voice_coop.NetworkClient()\n"
+        "p = voice_coop.AudioProcessor(); p.initialize_audio()\n"
+        "e = voice_coop.DetectionEngine(p)\n"
+        "voice_coop.calculate_volume(p.ring.latest(voice_coop.CHUNK))\n"
+    ),
+    "solo": (
+        "p = voice_coop.AudioProcessor(); p.initialize_audio()\n"
+        "e = voice_coop.DetectionEngine(p)\n"
+        "voice_coop.KeyPresser.get_backend()\n"
+    ),
+}
+
+PROBE = (
+    "import sys, time\n"
+    "t0 = time.perf_counter()\n"
+    "import voice_coop\n"
+    "{setup}"
+    "elapsed = time.perf_counter() - t0\n"
+    "sys.stderr.write('STARTUP %f %s\\n' % (elapsed, ','.join(m for m in {heavy!r} if m in sys.modules)))\n"
+)
+
+
+def parse_importtime(stderr):
+    """Суммарное время импортов верхнего уровня (мкс) и строка итогов пробы"""
+    total_us = 0
+    probe = None
+    for line in stderr.splitlines():
+        if line.startswith("STARTUP "):
+            probe = line.split(" ", 2)
+        elif line.startswith("import time:") and "|" in line:
+            _, cumulative, name = line[len("import time:"):].split("|")
+            # Верхний уровень - имя без отступа
+            if cumulative.strip().isdigit() and not name.startswith("  "):
+                total_us += int(cumulative)
+    return total_us, probe
+
+
+def run_role(role, python):
+    env = dict(os.environ)
+    env["PYTHONPATH"] = os.pathsep.join(filter(None, [REPO_ROOT, env.get("PYTHONPATH")]))
+    # Без X-сервера и /dev/uinput нажатия всё равно уйдут в симуляцию
+    env.setdefault("VOICE_COOP_KEY_BACKEND", "simulated")
+    code = PROBE.format(setup=ROLES[role], heavy=HEAVY_MODULES)
+    proc = subprocess.run([python, "-X", "importtime", "-c", code], capture_output=True,
+                          text=True, cwd=REPO_ROOT, env=env)
+    imports_us, probe = parse_importtime(proc.stderr)
+    if probe is None:
+        return {"role": role, "error": proc.stderr.strip().splitlines()[-1:]}
+    return {
+        "role": role,
+        "startup_ms": round(float(probe[1]) * 1000, 1),
+        "imports_ms": round(imports_us / 1000, 1),
+        "heavy": probe[2] if len(probe) > 2 and probe[2] else "-",
+    }
+
+
+def median_run(role, python, repeats):
+    runs = [run_role(role, python) for _ in range(repeats)]
+    ok = [r for r in runs if "error" not in r]
+    if not ok:
+        return runs[0]
+    ok.sort(key=lambda r: r["startup_ms"])
+    return ok[len(ok) // 2]
+
+
+def compare(results, baseline, tolerance):
+    """Роли, где старт стал медленнее базы больше чем на tolerance"""
+    base = {r["role"]: r for r in baseline.get("results", [])}
+    regressions = []
+    for row in results:
+        old = base.get(row["role"])
+        if not old or "startup_ms" not in old or "startup_ms" not in row:
+            continue
+        row["baseline_ms"] = old["startup_ms"]
+        if row["startup_ms"] > old["startup_ms"] * (1 + tolerance):
+            regressions.append(row["role"])
+        # Новый тяжёлый модуль в роли - регрессия, даже если старт пока быстрый
+        added = set(row["heavy"].split(",")) - set(old["heavy"].split(",")) - {"-"}
+        if added:
+            row["heavy"] += f" (+{','.join(sorted(added))})"
+            regressions.append(row["role"])
+    return sorted(set(regressions))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--roles", default=",".join(ROLES))
+    parser.add_argument("--repeats", type=int, default=5, help="Запусков на роль (берётся медиана)")
+    parser.add_argument("--python", default=sys.executable)
+    parser.add_argument("--baseline", help="JSON прошлого запуска для сравнения")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="Допустимое замедление, доля")
+    parser.add_argument("--save-baseline", help="Сохранить результат как базу")
+    parser.add_argument("--json", help="Куда сохранить результат (- для stdout)")
+    args = parser.parse_args()
+
+    results = [median_run(role.strip(), args.python, args.repeats) for role in args.roles.split(",")]
+    regressions = []
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+
+    print_table(results, ["role", "startup_ms", "imports_ms", "baseline_ms", "heavy", "error"])
+    data = {"benchmark": "startup", "results": results, "regressions": regressions}
+    if args.save_baseline:
+        dump_json(data, args.save_baseline)
+    if args.json:
+        dump_json(data, args.json)
+    if regressions:
+        print(f"Регрессия старта: {', '.join(regressions)}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,83 @@
+"""Задержка доставки команды по TCP и UDP на loopback
+
+    python benchmarks/bench_transport.py --commands 1000
+"""
+
+import argparse
+import threading
+import time
+
+from _common import dump_json, print_table, summarize_ms
+
+import voice_coop
+
+
+class RecordingSink:
+    """Исполнитель вместо KeyPresser: запоминает задержку доставки"""
+
+    def __init__(self):
+        self.latencies = []
+        self.event = threading.Event()
+
+    def __call__(self, command):
+        self.latencies.append(time.time() - command['timestamp'])
+        self.event.set()
+
+
+def run_mode(port, transport, commands, gap, redundancy):
+    sink = RecordingSink()
+    server = voice_coop.NetworkServer(executor=sink, port=port)
+    if not server.start_server():
+        raise SystemExit("Сервер не запустился")
+
+    client = voice_coop.NetworkClient(port=port)
+    try:
+        if not client.connect_to_server("127.0.0.1", transport, redundancy):
+            raise SystemExit(f"Не удалось подключиться по {transport}")
+        time.sleep(0.1)
+
+        for _ in range(commands):
+            sink.event.clear()
+            client.send_key_press({'type': 'key_press', 'key': 'space', 'timestamp': time.time()})
+            sink.event.wait(0.5)
+            time.sleep(gap)
+        time.sleep(0.1)
+    finally:
+        client.disconnect()
+        server.stop_server()
+
+    stats = summarize_ms(sink.latencies)
+    return {
+        "transport": transport,
+        "redundancy": redundancy if transport == "udp" else 1,
+        "sent": commands,
+        "received": stats["count"],
+        "p50_ms": stats.get("p50_ms"),
+        "p90_ms": stats.get("p90_ms"),
+        "p99_ms": stats.get("p99_ms"),
+        "max_ms": stats.get("max_ms"),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--commands", type=int, default=1000)
+    parser.add_argument("--gap", type=float, default=0.002, help="Пауза между командами, с")
+    parser.add_argument("--redundancy", type=int, default=voice_coop.UDP_REDUNDANCY)
+    parser.add_argument("--port", type=int, default=23457)
+    parser.add_argument("--json", help="Куда сохранить результат (- для stdout)")
+    args = parser.parse_args()
+
+    results = [
+        run_mode(args.port, "tcp", args.commands, args.gap, 1),
+        run_mode(args.port, "udp", args.commands, args.gap, 1),
+        run_mode(args.port, "udp", args.commands, args.gap, args.redundancy),
+    ]
+    print_table(results, ["transport", "redundancy", "sent", "received",
+                          "p50_ms", "p90_ms", "p99_ms", "max_ms"])
+    if args.json:
+        dump_json({"benchmark": "transport", "results": results}, args.json)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,278 @@
+"""Нагрузка веб-интерфейса на одну открытую вкладку: CPU сервера Streamlit и поток дельт
+
+Запускает `streamlit run` (текущий код или другую ревизию через --ref),
+открывает вкладки в headless Chromium (нужен playwright), доводит каждую
+до сценария мониторинга и считает CPU процесса Streamlit и число
+websocket-сообщений в секунду. Без браузера (--client protocol) вкладку
+изображает клиент протокола Streamlit: шлёт перезапуски скрипта с
+нажатой кнопкой и перезапуски фрагментов по их run_every, как это
+делает страница, только ничего не рисует. Сравнение до/после:
+
+    python benchmarks/bench_ui_cpu.py --ref HEAD~1 --scenario player1
+    python benchmarks/bench_ui_cpu.py --scenario player1
+    python benchmarks/bench_ui_cpu.py --client protocol --tabs 4
+
+Сценарий solo требует работающего микрофона.
+"""
+
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.request
+
+from _common import REPO_ROOT, dump_json, print_table
+
+# Клики, которые приводят вкладку к панели мониторинга
+SCENARIOS = {
+    "idle": [],
+    "solo": ["▶️ ЗАПУСТИТЬ"],
+    "player1": ["👥 КООПЕРАТИВНЫЙ РЕЖИМ", "🎮 ИГРОК 1 (Получает нажатия)", "🌐 ЗАПУСТИТЬ СЕРВЕР"],
+}
+
+
+def app_path(ref):
+    """Путь к voice_coop.py: рабочая копия или файл из ревизии git"""
+    if not ref:
+        return os.path.join(REPO_ROOT, "voice_coop.py")
+    source = subprocess.run(["git", "show", f"{ref}:voice_coop.py"], cwd=REPO_ROOT,
+                            capture_output=True, check=True).stdout
+    path = os.path.join(tempfile.mkdtemp(prefix="voice_coop_"), "voice_coop.py")
+    with open(path, "wb") as f:
+        f.write(source)
+    return path
+
+
+def cpu_seconds(pid):
+    """utime + stime процесса из /proc (Linux)"""
+    with open(f"/proc/{pid}/stat") as f:
+        fields = f.read().rsplit(")", 1)[1].split()
+    return (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+
+
+def start_streamlit(path, port):
+    proc = subprocess.Popen([sys.executable, "-m", "streamlit", "run", path,
+                             "--server.headless", "true", "--server.port", str(port),
+                             "--browser.gatherUsageStats", "false"],
+                            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    deadline = time.time() + 30
+    while time.time() < deadline:
+        try:
+            urllib.request.urlopen(f"http://127.0.0.1:{port}/_stcore/health", timeout=1)
+            return proc
+        except OSError:
+            time.sleep(0.2)
+    proc.kill()
+    raise SystemExit("Streamlit не запустился")
+
+
+def measure(pid, seconds):
+    cpu0, t0 = cpu_seconds(pid), time.monotonic()
+    time.sleep(seconds)
+    return (cpu_seconds(pid) - cpu0) / (time.monotonic() - t0) * 100
+
+
+def open_tab(browser, url, clicks, counter):
+    page = browser.new_page()
+    page.on("websocket", lambda ws: ws.on("framereceived", lambda _: counter.__setitem__(0, counter[0] + 1)))
+    page.goto(url)
+    page.get_by_text("ОДИНОЧНЫЙ РЕЖИМ").wait_for()
+    for label in clicks:
+        page.get_by_text(label, exact=True).first.click()
+        page.wait_for_timeout(1500)
+    return page
+
+
+class ProtocolTab:
+    """Вкладка без браузера: websocket-клиент протокола Streamlit
+
+    Кнопки и варианты радио ищет по подписи в пришедших элементах и
+    нажимает, как страница: перезапуск скрипта с trigger_value (кнопка)
+    или с выбранным вариантом, который дальше шлётся всегда. На каждый auto_rerun
+    заводит таймер и шлёт перезапуск фрагмента с is_auto_rerun.
+    """
+
+    def __init__(self, url, counter):
+        from streamlit.proto.BackMsg_pb2 import BackMsg
+        from streamlit.proto.ForwardMsg_pb2 import ForwardMsg
+        from websockets.sync.client import connect
+
+        self.BackMsg = BackMsg
+        self.ForwardMsg = ForwardMsg
+        self.ws = connect(url.replace("http", "ws") + "/_stcore/stream", subprotocols=["streamlit"],
+                          max_size=None)
+        self.counter = counter
+        self.lock = threading.Lock()
+        self.buttons = {}  # подпись -> id виджета
+        self.radios = {}  # подпись варианта -> id виджета
+        self.values = {}  # id виджета -> выбранный вариант
+        self.timers = {}  # фрагмент -> (интервал, следующий срок)
+        self.page_script_hash = ""
+        self.finished = threading.Event()
+        self.closed = False
+        self.reader = threading.Thread(target=self._read, daemon=True)
+        self.reader.start()
+        self.ticker = threading.Thread(target=self._tick, daemon=True)
+        self.ticker.start()
+
+    def _send(self, fragment_id="", trigger=None):
+        msg = self.BackMsg()
+        state = msg.rerun_script
+        state.page_script_hash = self.page_script_hash
+        if fragment_id:
+            state.fragment_id = fragment_id
+            state.is_auto_rerun = True
+        for widget_id, option in self.values.items():
+            widget = state.widget_states.widgets.add()
+            widget.id = widget_id
+            widget.string_value = option
+        if trigger is not None:
+            widget = state.widget_states.widgets.add()
+            widget.id = trigger
+            widget.trigger_value = True
+        with self.lock:
+            self.ws.send(msg.SerializeToString())
+
+    def _read(self):
+        try:
+            for data in self.ws:
+                self.counter[0] += 1
+                msg = self.ForwardMsg.FromString(data)
+                kind = msg.WhichOneof("type")
+                if kind == "new_session":
+                    self.page_script_hash = msg.new_session.page_script_hash
+                elif kind == "delta" and msg.delta.WhichOneof("type") == "new_element":
+                    element = msg.delta.new_element
+                    if element.WhichOneof("type") == "button":
+                        self.buttons[element.button.label] = element.button.id
+                    elif element.WhichOneof("type") == "radio":
+                        for option in element.radio.options:
+                            self.radios[option] = element.radio.id
+                elif kind == "auto_rerun":
+                    interval = msg.auto_rerun.interval
+                    self.timers[msg.auto_rerun.fragment_id] = (interval, time.monotonic() + interval)
+                elif kind == "script_finished":
+                    self.finished.set()
+        except Exception:
+            pass
+
+    def _tick(self):
+        while not self.closed:
+            now = time.monotonic()
+            for fragment_id, (interval, due) in list(self.timers.items()):
+                if now >= due:
+                    self.timers[fragment_id] = (interval, now + interval)
+                    try:
+                        self._send(fragment_id)
+                    except Exception:
+                        return
+            time.sleep(0.01)
+
+    def run_script(self, trigger=None, timeout=15):
+        self.finished.clear()
+        # Полный перезапуск сбрасывает таймеры фрагментов - сервер пришлёт их заново
+        self.timers.clear()
+        self._send(trigger=trigger)
+        self.finished.wait(timeout)
+        time.sleep(0.5)
+
+    def click(self, label):
+        if label in self.radios:
+            self.values[self.radios[label]] = label
+            self.run_script()
+        elif label in self.buttons:
+            self.run_script(self.buttons[label])
+        else:
+            raise SystemExit(f"Кнопка не найдена: {label}")
+
+    def close(self):
+        self.closed = True
+        self.ws.close()
+
+
+def open_protocol_tab(url, clicks, counter):
+    tab = ProtocolTab(url, counter)
+    tab.run_script()
+    for label in clicks:
+        tab.click(label)
+    return tab
+
+
+def run_tabs(args, url, counter):
+    """Открывает вкладки, выдерживает паузу и возвращает их (закрыть - close_tabs)"""
+    if args.client == "protocol":
+        return None, [open_protocol_tab(url, SCENARIOS[args.scenario], counter) for _ in range(args.tabs)]
+    try:
+        from playwright.sync_api import sync_playwright
+    except ImportError:
+        raise SystemExit("Нужен playwright: pip install playwright && playwright install chromium")
+    pw = sync_playwright().start()
+    browser = pw.chromium.launch()
+    return (pw, browser), [open_tab(browser, url, SCENARIOS[args.scenario], counter) for _ in range(args.tabs)]
+
+
+def close_tabs(handle, tabs):
+    for tab in tabs:
+        tab.close()
+    if handle is not None:
+        pw, browser = handle
+        browser.close()
+        pw.stop()
+
+
+def run(args):
+    proc = start_streamlit(app_path(args.ref), args.port)
+    url = f"http://127.0.0.1:{args.port}"
+    try:
+        idle_cpu = measure(proc.pid, args.seconds)
+        counter = [0]
+        handle, tabs = run_tabs(args, url, counter)
+        try:
+            time.sleep(args.settle)
+            frames_before = counter[0]
+            started = time.monotonic()
+            tabs_cpu = measure(proc.pid, args.seconds)
+            frames_per_sec = (counter[0] - frames_before) / (time.monotonic() - started)
+        finally:
+            close_tabs(handle, tabs)
+    finally:
+        proc.terminate()
+        proc.wait()
+
+    return {
+        "ref": args.ref or "worktree",
+        "client": args.client,
+        "scenario": args.scenario,
+        "tabs": args.tabs,
+        "idle_cpu_pct": round(idle_cpu, 2),
+        "cpu_pct": round(tabs_cpu, 2),
+        "cpu_per_tab_pct": round((tabs_cpu - idle_cpu) / args.tabs, 2),
+        "ws_msgs_per_sec": round(frames_per_sec, 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--scenario", choices=list(SCENARIOS), default="player1")
+    parser.add_argument("--tabs", type=int, default=1, help="Вкладок (сервер Игрока 1 поднимется только в первой)")
+    parser.add_argument("--ref", help="Ревизия git для замера 'до' (по умолчанию рабочая копия)")
+    parser.add_argument("--client", choices=["playwright", "protocol"], default="playwright",
+                        help="Вкладки в Chromium или клиент протокола Streamlit без браузера")
+    parser.add_argument("--seconds", type=float, default=20.0, help="Длительность замера, с")
+    parser.add_argument("--settle", type=float, default=3.0, help="Пауза после открытия вкладок, с")
+    parser.add_argument("--port", type=int, default=8599)
+    parser.add_argument("--json", help="Куда сохранить результат (- для stdout)")
+    args = parser.parse_args()
+
+    result = run(args)
+    print_table([result], ["ref", "client", "scenario", "tabs", "idle_cpu_pct", "cpu_pct", "cpu_per_tab_pct",
+                           "ws_msgs_per_sec"])
+    if args.json:
+        dump_json({"benchmark": "ui_cpu", "results": [result]}, args.json)
+
+
+if __name__ == "__main__":
+    main()
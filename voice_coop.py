@@ -1,31 +1,536 @@
-import streamlit as st
-import pyaudio
-import numpy as np
 import time
 import threading
 import socket
-import pickle
 import warnings
 import sys
 import subprocess
 import platform
 import os
+import shutil
+import struct
+import queue
+import math
+import random
+import collections
+import heapq
+import json
+import mmap
+import wave
+import selectors
+import importlib
+import argparse
+import signal
+import errno
 
 warnings.filterwarnings("ignore")
 
+
+class _LazyModule:
+    """Модуль, который импортируется при первом обращении к атрибуту
+
+    Каждой роли свои тяжёлые зависимости: Streamlit нужен только
+    веб-интерфейсу, numpy и PyAudio - только тем, кто слушает микрофон,
+    поэтому сервер Игрока 1 запускается и там, где аудио нет вовсе.
+    После импорта прокси заменяет себя в глобальных именах модулем,
+    и горячие циклы обращаются к нему напрямую.
+    """
+
+    def __init__(self, name, alias):
+        self._name = name
+        self._alias = alias
+        self._module = None
+
+    def __getattr__(self, attr):
+        if self._module is None:
+            self._module = importlib.import_module(self._name)
+            if globals().get(self._alias) is self:
+                globals()[self._alias] = self._module
+        return getattr(self._module, attr)
+
+
+st = _LazyModule("streamlit", "st")
+np = _LazyModule("numpy", "np")
+pyaudio = _LazyModule("pyaudio", "pyaudio")
+
 # Настройки
 CHUNK = 1024
-FORMAT = pyaudio.paInt16
+FORMAT = "paInt16"  # Имя формата сэмплов в pyaudio (модуль грузится лениво)
 CHANNELS = 1
 RATE = 44100
 
+RING_SECONDS = 2.0  # Сколько звука хранит кольцевой буфер
+TRIGGER_COOLDOWN = 0.5  # Минимальная пауза между срабатываниями, с
+DB_FLOOR = -100  # Уровень тишины, дБ
+FULL_SCALE_SQ = 32768.0 ** 2
+
+# Интерфейс: как часто перерисовываются панели мониторинга, с
+MONITOR_REFRESH = 0.25
+SERVER_REFRESH = 2.0
+REFRESH_OPTIONS = (0.1, 0.25, 0.5, 1.0, 2.0, 5.0)
+
+# Детекторы срабатывания и настройки онсет-детектора
+DETECTORS = {
+    "volume": "Громкость чанка",
+    "onset": "Начало крика (онсет)",
+    "bands": "Полосы частот",
+}
+ONSET_FRAME_MS = 2.0  # Длина подкадра
+ONSET_CONFIRM_FRAMES = 2  # Подкадров выше порога для подтверждения
+ONSET_RELEASE_DB = 6.0  # Насколько ниже порога нужно опуститься для сброса
+# На чанках меньше этого онсет не раньше порога по чанку (подтверждение
+# подкадрами дольше короткого чанка, см. bench_onset) - детектор берёт громкость чанка
+ONSET_MIN_CHUNK = 512
+
+# Режимы срабатывания: нажатие на каждый крик или удержание, пока кричишь
+TRIGGER_MODES = {
+    "tap": "Нажатие на крик",
+    "hold": "Удержание, пока кричишь",
+}
+HOLD_RELEASE_DB = 6.0  # Гистерезис: клавиша отпускается ниже порога на столько
+HOLD_HANG = 0.1  # Сколько тише порога терпеть до отпускания, с (паузы между словами)
+
+# Полосы частот: окно БПФ по последним сэмплам буфера и полосы по умолчанию
+BAND_FFT_SIZE = 2048
+DEFAULT_BANDS = "80-300: space\n1000-4000: enter"  # Гул и свист
+
+# Калибровка: кандидаты частоты/буфера и критерии стабильности
+CALIBRATION_RATES = (16000, 22050, 32000, 44100, 48000)
+CALIBRATION_CHUNKS = (64, 128, 256, 512, 1024)
+CALIBRATION_SECONDS = 2.0
+CALIBRATION_WARMUP = 5  # Колбэков на прогрев, в статистику не входят
+CALIBRATION_MAX_JITTER = 0.5  # Допустимый джиттер p99, доля длительности буфера
+CALIBRATION_MIN_RECEIVED = 0.95  # Доля ожидаемых колбэков
+AUDIO_PROFILE_PATH = os.path.join(os.path.expanduser("~"), ".voice_coop", "audio_profiles.json")
+
 # Конфигурация сети
 PORT = 12345
+SERVER_BACKLOG = 128
+
+# UDP-режим: повторы каждой датаграммы и окно переупорядочивания на сервере
+TRANSPORTS = ("tcp", "udp")
+UDP_REDUNDANCY = 2
+UDP_REORDER_WINDOW = 32
+UDP_REORDER_TIMEOUT = 0.015
+UDP_SESSION_TIMEOUT = 30.0
+UDP_HEADER = struct.Struct("!II")  # сессия, номер датаграммы
+
+# Рассылка нескольким получателям: медленный получатель отключается,
+# если не забирает данные дольше таймаута или копит слишком много
+CONNECT_TIMEOUT = 5.0
+RECEIVER_PENDING_LIMIT = 16 * 1024  # Байт, не ушедших в сокет
+SLOW_RECEIVER_TIMEOUT = 1.0  # С, сколько данные могут ждать отправки
+
+# Пульс соединения (пинг/понг с метками времени как в NTP)
+HEARTBEAT_INTERVAL = 0.5  # Как часто пинговать собеседника, с
+# Запас сверх интервала: пока RTT не измерен - весь, потом не меньше него (см. Heartbeat.timeout)
+HEARTBEAT_MARGIN = 0.1
+HEARTBEAT_TIMEOUT = HEARTBEAT_INTERVAL + HEARTBEAT_MARGIN  # Тишина дольше - собеседник мёртв
+HEARTBEAT_WINDOW = 16  # Сколько последних замеров хранить для оценки смещения часов
+
+# Переподключение к пропавшему получателю
+RECONNECT_BASE_DELAY = 0.05  # Пауза перед первой попыткой, с (дальше удваивается)
+RECONNECT_MAX_DELAY = 5.0  # Потолок паузы между попытками, с
+RECONNECT_BUFFER = 8  # Сколько команд держать на время обрыва
+RECONNECT_FRESHNESS = 0.5  # Команда старше этого после обрыва уже не досылается, с
+
+# Удержание на сервере: молчащий дольше клиент отпускает свои клавиши
+HOLD_TIMEOUT = HEARTBEAT_TIMEOUT
+
+# Режим вечеринки: команды многих клиентов сводятся в одно нажатие за окно
+PARTY_POLICIES = {
+    "first": "Кто первый",
+    "majority": "Большинство голосов",
+    "loudness": "Кто громче",
+}
+PARTY_WINDOW = 0.15  # Окно сбора голосов, с
+PARTY_RATE_LIMIT = 4.0  # Команд в секунду на клиента (0 - без ограничения)
+PARTY_BURST = 2  # Сколько команд подряд клиент может прислать сверх темпа
+PARTY_DEFAULT_LEVEL = -20.0  # Громкость для клиентов, которые её не присылают
+
+# Максимум команд, ожидающих нажатия (лишние отбрасываются)
+INJECTION_QUEUE_SIZE = 64
+
+# Макросы: шаги через запятую, например "hold shift 120, tap e, wait 30, tap r"
+MACRO_ACTIONS = ("tap", "hold", "down", "up", "wait")
+MACRO_TAP_TIME = 0.02  # Сколько держать клавишу в tap без длительности, с (игры опрашивают клавиши раз в кадр)
+MACRO_MAX_DURATION = 10.0  # Самый длинный макрос, с
+MACRO_MAX_PENDING = 1024  # Событий в очереди планировщика; сверх этого макросы отбрасываются
+MACRO_SPIN = 0.001  # Последние секунды до срока поток не спит, а крутится (сон неточен)
+MACRO_RECENT = 50  # Сколько последних прогонов хранить для статистики
+
+# Трассировка задержки по этапам: от АЦП микрофона до нажатия клавиши
+TRACE_STAGES = {
+    "capture": "АЦП → колбэк аудио",
+    "wakeup": "Колбэк → детектор",
+    "detect": "Детекция",
+    "send": "Кодирование и отправка",
+    "network": "Сеть (часы клиента сверены пульсом)",
+    "decode": "Приём и разбор",
+    "queue": "Очередь нажатий",
+    "inject": "Нажатие клавиши",
+    "total": "Итого",
+}
+TRACE_RECENT = 200  # Сколько последних срабатываний хранить целиком
+TRACE_REFRESH = 2.0  # Как часто обновлять таблицу в интерфейсе, с
+
+# Бортовой самописец: события детектора и звук вокруг них в кольцевом файле
+FLIGHT_PATH = os.path.join(os.path.expanduser("~"), ".voice_coop", "flight.bin")
+FLIGHT_SIZE = 8 * 1024 * 1024  # Размер файла, байт
+FLIGHT_PRE = 0.3  # Сколько звука до события сохранять, с
+FLIGHT_POST = 0.2  # И после
+FLIGHT_NEAR_DB = 6.0  # Тише порога не больше чем на столько - «почти крик», тоже пишется
+FLIGHT_PENDING = 256  # Событий в очереди записи; сверх этого новые отбрасываются
+FLIGHT_MAGIC = b"VCFR"
+FLIGHT_VERSION = 1
+# Заголовок файла: метка, версия, каналы, частота, размер слота, слотов, кадров до и после события
+FLIGHT_HEADER = struct.Struct("<4sHHIIIII")
+# Слот: номер (0 - пусто), время, позиция события и начала звука в потоке, кадров звука,
+# канал (-1 - все), вид, детектор, режим, чанк, громкость, порог, пауза, удержание, окно, кнопка, заметка
+FLIGHT_RECORD = struct.Struct("<QdqqIhBBBIfffff48s48s")
+FLIGHT_SEQ = struct.Struct("<Q")
+FLIGHT_EVENTS = {
+    "tap": "Нажатие",
+    "down": "Зажатие",
+    "up": "Отпускание",
+    "near": "Почти крик",
+    "cooldown": "Крик в паузе",
+    "error": "Ошибка",
+}
+
+# Порядок выбора бэкенда инъекции клавиш на Linux
+LINUX_KEY_BACKENDS = ("xtest", "uinput", "xdotool")
+
+# Переопределение бэкенда через окружение (xtest, uinput, xdotool, simulated)
+KEY_BACKEND_ENV = "VOICE_COOP_KEY_BACKEND"
+
+# Имена клавиш -> X keysym (остальные имена передаются как есть: a, 1, F1...)
+X_KEYSYMS = {
+    'space': 'space',
+    'enter': 'Return',
+    'return': 'Return',
+    'tab': 'Tab',
+    'esc': 'Escape',
+    'escape': 'Escape',
+    'backspace': 'BackSpace',
+    'ctrl': 'Control_L',
+    'control': 'Control_L',
+    'shift': 'Shift_L',
+    'alt': 'Alt_L',
+    'cmd': 'Super_L',
+    'super': 'Super_L',
+    'win': 'Super_L',
+    'up': 'Up',
+    'down': 'Down',
+    'left': 'Left',
+    'right': 'Right',
+}
+X_KEYSYMS.update({f'f{i}': f'F{i}' for i in range(1, 25)})
+
+# Имена клавиш -> коды Linux input (linux/input-event-codes.h)
+UINPUT_KEYCODES = {
+    'esc': 1, 'escape': 1,
+    '1': 2, '2': 3, '3': 4, '4': 5, '5': 6,
+    '6': 7, '7': 8, '8': 9, '9': 10, '0': 11,
+    'backspace': 14, 'tab': 15,
+    'q': 16, 'w': 17, 'e': 18, 'r': 19, 't': 20,
+    'y': 21, 'u': 22, 'i': 23, 'o': 24, 'p': 25,
+    'enter': 28, 'return': 28, 'ctrl': 29, 'control': 29,
+    'a': 30, 's': 31, 'd': 32, 'f': 33, 'g': 34,
+    'h': 35, 'j': 36, 'k': 37, 'l': 38,
+    'shift': 42,
+    'z': 44, 'x': 45, 'c': 46, 'v': 47, 'b': 48, 'n': 49, 'm': 50,
+    'alt': 56, 'space': 57,
+    'f1': 59, 'f2': 60, 'f3': 61, 'f4': 62, 'f5': 63,
+    'f6': 64, 'f7': 65, 'f8': 66, 'f9': 67, 'f10': 68,
+    'f11': 87, 'f12': 88,
+    'up': 103, 'left': 105, 'right': 106, 'down': 108,
+    'cmd': 125, 'super': 125, 'win': 125,
+}
+
+# Имена клавиш -> виртуальные коды Windows (keybd_event)
+WINDOWS_VK_CODES = {
+    'backspace': 0x08, 'tab': 0x09, 'enter': 0x0D, 'return': 0x0D,
+    'shift': 0x10, 'ctrl': 0x11, 'control': 0x11, 'alt': 0x12,
+    'esc': 0x1B, 'escape': 0x1B, 'space': 0x20,
+    'left': 0x25, 'up': 0x26, 'right': 0x27, 'down': 0x28,
+    'cmd': 0x5B, 'super': 0x5B, 'win': 0x5B,
+}
+WINDOWS_VK_CODES.update({c: ord(c.upper()) for c in 'abcdefghijklmnopqrstuvwxyz0123456789'})
+WINDOWS_VK_CODES.update({f'f{i}': 0x6F + i for i in range(1, 25)})
+WINDOWS_KEYUP = 0x0002
+
+# Модификаторы для AppleScript (key down/key up понимают только их)
+MAC_MODIFIERS = {
+    "ctrl": "control",
+    "alt": "option",
+    "shift": "shift",
+    "cmd": "command",
+}
+
+
+class XTestBackend:
+    """Инъекция через расширение XTest по постоянному соединению с X-сервером"""
+
+    name = "xtest"
+
+    def __init__(self, display_name=None):
+        import ctypes
+        import ctypes.util
+
+        x11_path = ctypes.util.find_library("X11")
+        xtst_path = ctypes.util.find_library("Xtst")
+        if not x11_path or not xtst_path:
+            raise RuntimeError("libX11/libXtst не найдены")
+
+        self._x11 = ctypes.CDLL(x11_path)
+        self._xtst = ctypes.CDLL(xtst_path)
+
+        self._x11.XOpenDisplay.restype = ctypes.c_void_p
+        self._x11.XOpenDisplay.argtypes = [ctypes.c_char_p]
+        self._x11.XCloseDisplay.argtypes = [ctypes.c_void_p]
+        self._x11.XFlush.argtypes = [ctypes.c_void_p]
+        self._x11.XStringToKeysym.restype = ctypes.c_ulong
+        self._x11.XStringToKeysym.argtypes = [ctypes.c_char_p]
+        self._x11.XKeysymToKeycode.restype = ctypes.c_ubyte
+        self._x11.XKeysymToKeycode.argtypes = [ctypes.c_void_p, ctypes.c_ulong]
+        self._xtst.XTestQueryExtension.argtypes = [ctypes.c_void_p] + [ctypes.POINTER(ctypes.c_int)] * 4
+        self._xtst.XTestFakeKeyEvent.argtypes = [ctypes.c_void_p, ctypes.c_uint, ctypes.c_int, ctypes.c_ulong]
+
+        name = display_name.encode() if display_name else None
+        self._display = self._x11.XOpenDisplay(name)
+        if not self._display:
+            raise RuntimeError("Нет подключения к X-серверу (проверьте DISPLAY)")
+
+        dummy = [ctypes.c_int() for _ in range(4)]
+        if not self._xtst.XTestQueryExtension(self._display, *[ctypes.byref(d) for d in dummy]):
+            self._x11.XCloseDisplay(self._display)
+            self._display = None
+            raise RuntimeError("X-сервер не поддерживает XTest")
+
+        self._keycodes = {}
+        self._lock = threading.Lock()
+
+    def _keycode(self, key):
+        keycode = self._keycodes.get(key)
+        if keycode is None:
+            keysym_name = X_KEYSYMS.get(key.lower(), key)
+            keysym = self._x11.XStringToKeysym(keysym_name.encode())
+            if not keysym:
+                raise ValueError(f"Неизвестная клавиша: {key}")
+            keycode = self._x11.XKeysymToKeycode(self._display, keysym)
+            if not keycode:
+                raise ValueError(f"Клавиша {key} отсутствует в раскладке")
+            self._keycodes[key] = keycode
+        return keycode
+
+    def press(self, key):
+        keycode = self._keycode(key)
+        with self._lock:
+            self._xtst.XTestFakeKeyEvent(self._display, keycode, True, 0)
+            self._xtst.XTestFakeKeyEvent(self._display, keycode, False, 0)
+            self._x11.XFlush(self._display)
+
+    def _send(self, key, is_press):
+        keycode = self._keycode(key)
+        with self._lock:
+            self._xtst.XTestFakeKeyEvent(self._display, keycode, is_press, 0)
+            self._x11.XFlush(self._display)
+
+    def key_down(self, key):
+        self._send(key, True)
+
+    def key_up(self, key):
+        self._send(key, False)
+
+    def hotkey(self, *keys):
+        keycodes = [self._keycode(key) for key in keys]
+        with self._lock:
+            for keycode in keycodes:
+                self._xtst.XTestFakeKeyEvent(self._display, keycode, True, 0)
+            for keycode in reversed(keycodes):
+                self._xtst.XTestFakeKeyEvent(self._display, keycode, False, 0)
+            self._x11.XFlush(self._display)
+
+    def close(self):
+        with self._lock:
+            if self._display:
+                self._x11.XCloseDisplay(self._display)
+                self._display = None
+
+
+class UinputBackend:
+    """Инъекция через виртуальную клавиатуру /dev/uinput (работает и без X)"""
+
+    name = "uinput"
+
+    UI_SET_EVBIT = 0x40045564
+    UI_SET_KEYBIT = 0x40045565
+    UI_DEV_CREATE = 0x5501
+    UI_DEV_DESTROY = 0x5502
+    EV_SYN = 0x00
+    EV_KEY = 0x01
+    SYN_REPORT = 0
+    BUS_USB = 0x03
+
+    # struct input_event: timeval, type, code, value
+    EVENT = struct.Struct("llHHi")
+
+    def __init__(self, device="/dev/uinput"):
+        import fcntl
+
+        self._fd = os.open(device, os.O_WRONLY | os.O_NONBLOCK)
+        try:
+            fcntl.ioctl(self._fd, self.UI_SET_EVBIT, self.EV_KEY)
+            fcntl.ioctl(self._fd, self.UI_SET_EVBIT, self.EV_SYN)
+            for code in set(UINPUT_KEYCODES.values()):
+                fcntl.ioctl(self._fd, self.UI_SET_KEYBIT, code)
+
+            # struct uinput_user_dev: name, input_id, ff_effects_max, abs*[64]
+            user_dev = struct.pack("80sHHHHi", b"voice-coop-keyboard", self.BUS_USB, 0x1, 0x1, 1, 0)
+            user_dev += b"\0" * (4 * 64 * 4)
+            os.write(self._fd, user_dev)
+            fcntl.ioctl(self._fd, self.UI_DEV_CREATE)
+        except Exception:
+            os.close(self._fd)
+            raise
+
+        self._fcntl = fcntl
+        self._lock = threading.Lock()
+        # Даём udev зарегистрировать устройство, иначе первые события теряются
+        time.sleep(0.1)
+
+    def _code(self, key):
+        code = UINPUT_KEYCODES.get(key.lower())
+        if code is None:
+            raise ValueError(f"Неизвестная клавиша: {key}")
+        return code
+
+    def _key_event(self, code, value):
+        return self.EVENT.pack(0, 0, self.EV_KEY, code, value)
+
+    def _sync(self):
+        return self.EVENT.pack(0, 0, self.EV_SYN, self.SYN_REPORT, 0)
+
+    def press(self, key):
+        code = self._code(key)
+        events = self._key_event(code, 1) + self._sync() + self._key_event(code, 0) + self._sync()
+        with self._lock:
+            os.write(self._fd, events)
+
+    def key_down(self, key):
+        events = self._key_event(self._code(key), 1) + self._sync()
+        with self._lock:
+            os.write(self._fd, events)
+
+    def key_up(self, key):
+        events = self._key_event(self._code(key), 0) + self._sync()
+        with self._lock:
+            os.write(self._fd, events)
+
+    def hotkey(self, *keys):
+        codes = [self._code(key) for key in keys]
+        events = b"".join(self._key_event(code, 1) for code in codes) + self._sync()
+        events += b"".join(self._key_event(code, 0) for code in reversed(codes)) + self._sync()
+        with self._lock:
+            os.write(self._fd, events)
+
+    def close(self):
+        with self._lock:
+            if self._fd is not None:
+                try:
+                    self._fcntl.ioctl(self._fd, self.UI_DEV_DESTROY)
+                finally:
+                    os.close(self._fd)
+                    self._fd = None
+
+
+class XdotoolBackend:
+    """Запасной вариант: отдельный процесс xdotool на каждое нажатие"""
+
+    name = "xdotool"
+
+    def __init__(self):
+        self._xdotool = shutil.which("xdotool")
+        if self._xdotool is None:
+            raise RuntimeError("xdotool не установлен")
+
+    def press(self, key):
+        subprocess.run([self._xdotool, "key", key], check=False)
+
+    def hotkey(self, *keys):
+        subprocess.run([self._xdotool, "key", "+".join(keys)], check=False)
+
+    def key_down(self, key):
+        subprocess.run([self._xdotool, "keydown", key], check=False)
+
+    def key_up(self, key):
+        subprocess.run([self._xdotool, "keyup", key], check=False)
+
+    def close(self):
+        pass
+
+
+class SimulatedBackend:
+    """Эмуляция нажатий (только вывод в консоль)"""
+
+    name = "simulated"
+
+    def press(self, key):
+        print(f"[SIMULATED] Нажата клавиша: {key}")
+
+    def hotkey(self, *keys):
+        print(f"[SIMULATED] Нажата комбинация: {'+'.join(keys)}")
+
+    def key_down(self, key):
+        print(f"[SIMULATED] Клавиша зажата: {key}")
+
+    def key_up(self, key):
+        print(f"[SIMULATED] Клавиша отпущена: {key}")
+
+    def close(self):
+        pass
+
+
+KEY_BACKENDS = {
+    "xtest": XTestBackend,
+    "uinput": UinputBackend,
+    "xdotool": XdotoolBackend,
+    "simulated": SimulatedBackend,
+}
+
+
+def select_key_backend(order=None):
+    """Выбирает первый доступный бэкенд инъекции клавиш"""
+    if order is None:
+        forced = os.environ.get(KEY_BACKEND_ENV)
+        order = (forced,) if forced else LINUX_KEY_BACKENDS
+
+    for name in order:
+        try:
+            backend = KEY_BACKENDS[name]()
+            print(f"Бэкенд нажатий клавиш: {backend.name}")
+            return backend
+        except Exception as e:
+            print(f"Бэкенд {name} недоступен: {e}")
+
+    return SimulatedBackend()
 
 
 class KeyPresser:
     """Класс для нажатия клавиш, работающий без GUI зависимости"""
-    
+
+    _backend = None
+    _backend_lock = threading.Lock()
+
+    @classmethod
+    def get_backend(cls):
+        """Бэкенд инъекции для Linux (выбирается один раз при первом нажатии)"""
+        if cls._backend is None:
+            with cls._backend_lock:
+                if cls._backend is None:
+                    cls._backend = select_key_backend()
+        return cls._backend
+
     @staticmethod
     def press(key):
         """Нажать одну клавишу"""
@@ -33,74 +538,16 @@ class KeyPresser:
             # Для Windows
             if platform.system() == "Windows":
                 import ctypes
-                # Простейшие коды клавиш
-                key_map = {
-                    'space': 0x20,
-                    'enter': 0x0D,
-                    'a': 0x41,
-                    'b': 0x42,
-                    'c': 0x43,
-                    'd': 0x44,
-                    'e': 0x45,
-                    'f': 0x46,
-                    'g': 0x47,
-                    'h': 0x48,
-                    'i': 0x49,
-                    'j': 0x4A,
-                    'k': 0x4B,
-                    'l': 0x4C,
-                    'm': 0x4D,
-                    'n': 0x4E,
-                    'o': 0x4F,
-                    'p': 0x50,
-                    'q': 0x51,
-                    'r': 0x52,
-                    's': 0x53,
-                    't': 0x54,
-                    'u': 0x55,
-                    'v': 0x56,
-                    'w': 0x57,
-                    'x': 0x58,
-                    'y': 0x59,
-                    'z': 0x5A,
-                    '0': 0x30,
-                    '1': 0x31,
-                    '2': 0x32,
-                    '3': 0x33,
-                    '4': 0x34,
-                    '5': 0x35,
-                    '6': 0x36,
-                    '7': 0x37,
-                    '8': 0x38,
-                    '9': 0x39,
-                    'f1': 0x70,
-                    'f2': 0x71,
-                    'f3': 0x72,
-                    'f4': 0x73,
-                    'f5': 0x74,
-                    'f6': 0x75,
-                    'f7': 0x76,
-                    'f8': 0x77,
-                    'f9': 0x78,
-                    'f10': 0x79,
-                    'f11': 0x7A,
-                    'f12': 0x7B,
-                }
-                
-                if key.lower() in key_map:
-                    key_code = key_map[key.lower()]
+                if key.lower() in WINDOWS_VK_CODES:
+                    key_code = WINDOWS_VK_CODES[key.lower()]
                     # Симуляция нажатия и отпускания клавиши
                     ctypes.windll.user32.keybd_event(key_code, 0, 0, 0)  # Нажатие
                     time.sleep(0.05)
-                    ctypes.windll.user32.keybd_event(key_code, 0, 2, 0)  # Отпускание
+                    ctypes.windll.user32.keybd_event(key_code, 0, WINDOWS_KEYUP, 0)  # Отпускание
             
-            # Для Linux (используем xdotool если доступен)
+            # Для Linux (XTest / uinput / xdotool, выбирается один раз)
             elif platform.system() == "Linux":
-                # Проверяем доступность xdotool
-                if subprocess.run(["which", "xdotool"], capture_output=True).returncode == 0:
-                    subprocess.run(["xdotool", "key", key], check=False)
-                else:
-                    print(f"[SIMULATED] Нажата клавиша: {key}")
+                KeyPresser.get_backend().press(key)
             
             # Для macOS
             elif platform.system() == "Darwin":
@@ -128,55 +575,25 @@ class KeyPresser:
             if platform.system() == "Windows":
                 import ctypes
                 
-                # Простейшая реализация для common комбинаций
-                if len(keys) == 2 and keys[0].lower() == "ctrl" and keys[1] == "c":
-                    # Ctrl+C
-                    ctypes.windll.user32.keybd_event(0x11, 0, 0, 0)  # Ctrl
-                    time.sleep(0.05)
-                    ctypes.windll.user32.keybd_event(0x43, 0, 0, 0)  # C
-                    time.sleep(0.05)
-                    ctypes.windll.user32.keybd_event(0x43, 0, 2, 0)  # C отпустить
-                    time.sleep(0.05)
-                    ctypes.windll.user32.keybd_event(0x11, 0, 2, 0)  # Ctrl отпустить
-                
-                elif len(keys) == 2 and keys[0].lower() == "ctrl" and keys[1] == "v":
-                    # Ctrl+V
-                    ctypes.windll.user32.keybd_event(0x11, 0, 0, 0)  # Ctrl
-                    time.sleep(0.05)
-                    ctypes.windll.user32.keybd_event(0x56, 0, 0, 0)  # V
-                    time.sleep(0.05)
-                    ctypes.windll.user32.keybd_event(0x56, 0, 2, 0)  # V отпустить
-                    time.sleep(0.05)
-                    ctypes.windll.user32.keybd_event(0x11, 0, 2, 0)  # Ctrl отпустить
-                
-                else:
-                    # Общий случай
-                    for key in keys:
-                        KeyPresser.press(key)
+                codes = [WINDOWS_VK_CODES[key.lower()] for key in keys]
+                # Зажимаем по порядку, отпускаем в обратном - без пауз, как XTest и uinput
+                for key_code in codes:
+                    ctypes.windll.user32.keybd_event(key_code, 0, 0, 0)
+                for key_code in reversed(codes):
+                    ctypes.windll.user32.keybd_event(key_code, 0, WINDOWS_KEYUP, 0)
             
             # Для Linux
             elif platform.system() == "Linux":
-                if subprocess.run(["which", "xdotool"], capture_output=True).returncode == 0:
-                    key_str = "+".join(keys)
-                    subprocess.run(["xdotool", "key", key_str], check=False)
-                else:
-                    print(f"[SIMULATED] Нажата комбинация: {'+'.join(keys)}")
+                KeyPresser.get_backend().hotkey(*keys)
             
             # Для macOS
             elif platform.system() == "Darwin":
-                key_map = {
-                    "ctrl": "control",
-                    "alt": "option",
-                    "shift": "shift",
-                    "cmd": "command"
-                }
-                
                 modifiers = []
                 main_key = None
                 
                 for key in keys:
-                    if key.lower() in key_map:
-                        modifiers.append(key_map[key.lower()])
+                    if key.lower() in MAC_MODIFIERS:
+                        modifiers.append(MAC_MODIFIERS[key.lower()])
                     else:
                         main_key = key
                 
@@ -206,310 +623,4030 @@ class KeyPresser:
             print(f"Ошибка при нажатии комбинации {keys}: {e}")
             print(f"[DEBUG] Комбинация нажата (эмуляция): {'+'.join(keys)}")
 
+    @staticmethod
+    def key_down(key):
+        """Зажать клавишу (отпускает key_up)"""
+        KeyPresser._send(key, True)
 
-class AudioProcessor:
-    def __init__(self):
-        self.audio = None
-        self.stream = None
-        self.is_recording = False
-        self.audio_data = None
-        self.lock = threading.Lock()
-        
-    def initialize_audio(self):
-        """Инициализация аудио (ленивая загрузка)"""
-        if self.audio is None:
+    @staticmethod
+    def key_up(key):
+        """Отпустить зажатую клавишу"""
+        KeyPresser._send(key, False)
+
+    @staticmethod
+    def _send(key, is_press):
+        system = platform.system()
+        if system == "Windows":
+            import ctypes
+            key_code = WINDOWS_VK_CODES.get(key.lower())
+            if key_code is None:
+                raise ValueError(f"Неизвестная клавиша: {key}")
+            ctypes.windll.user32.keybd_event(key_code, 0, 0 if is_press else WINDOWS_KEYUP, 0)
+        elif system == "Linux":
+            backend = KeyPresser.get_backend()
+            if is_press:
+                backend.key_down(key)
+            else:
+                backend.key_up(key)
+        elif system == "Darwin":
+            # Обычные клавиши AppleScript зажимать не умеет - нажимаем их при key down
+            modifier = MAC_MODIFIERS.get(key.lower())
+            if modifier:
+                action = f"key {'down' if is_press else 'up'} {modifier}"
+            elif is_press:
+                action = f'keystroke "{key}"'
+            else:
+                return
+            subprocess.run(["osascript", "-e", f'tell application "System Events" to {action}'], check=False)
+        else:
+            print(f"[SIMULATED] Клавиша {'зажата' if is_press else 'отпущена'}: {key}")
+
+
+def execute_command(command):
+    """Выполняет полученную команду нажатия на этой машине"""
+    if command.get('type') == 'key_press':
+        key = command.get('key', '')
+        if key:
             try:
-                self.audio = pyaudio.PyAudio()
-                return True
+                KeyPresser.press(key)
+                print(f"Нажата клавиша: {key}")
             except Exception as e:
-                st.error(f"Ошибка инициализации аудио: {e}")
-                return False
-        return True
-
-    def start_recording(self):
-        if not self.initialize_audio():
-            return False
-            
-        if self.stream is None:
+                print(f"Ошибка нажатия {key}: {e}")
+    elif command.get('type') == 'hotkey':
+        keys = command.get('keys', [])
+        if keys and len(keys) >= 2:
             try:
-                self.stream = self.audio.open(
-                    format=FORMAT,
-                    channels=CHANNELS,
-                    rate=RATE,
-                    input=True,
-                    frames_per_buffer=CHUNK,
-                    stream_callback=self.callback
-                )
+                KeyPresser.hotkey(*keys)
+                print(f"Нажата комбинация: {keys}")
             except Exception as e:
-                st.error(f"Ошибка микрофона: {e}")
-                return False
+                print(f"Ошибка комбинации {keys}: {e}")
+    elif command.get('type') in ('key_down', 'key_up'):
+        keys = command.get('keys', [])
+        try:
+            if command['type'] == 'key_down':
+                for key in keys:
+                    KeyPresser.key_down(key)
+            else:
+                for key in reversed(keys):
+                    KeyPresser.key_up(key)
+        except Exception as e:
+            print(f"Ошибка {'зажатия' if command['type'] == 'key_down' else 'отпускания'} {keys}: {e}")
+    elif command.get('type') == 'macro':
+        text = command.get('macro', '')
+        if text:
+            # Макрос только ставится в расписание: следующая команда не ждёт его конца
+            try:
+                MacroScheduler.get_default().submit(text)
+            except Exception as e:
+                print(f"Ошибка макроса '{text}': {e}")
 
-        self.is_recording = True
-        self.stream.start_stream()
-        return True
 
-    def callback(self, in_data, frame_count, time_info, status):
+class LatencyHistogram:
+    """Гистограмма задержек в стиле HDR: корзины по степеням двойки,
+    каждая поделена на 64 линейные части
+
+    Перцентили отдаются серединой корзины, поэтому их относительная
+    ошибка меньше 1/128 (~0.8%) на любом масштабе (от микросекунд до
+    минут); память не растёт с числом замеров.
+    """
+
+    SUB_BITS = 7
+
+    def __init__(self):
+        self.counts = {}
+        self.count = 0
+        self.total = 0
+        self.min = None
+        self.max = 0
+
+    def record(self, seconds):
+        value = max(0, int(seconds * 1e6))  # Микросекунды
+        shift = max(0, value.bit_length() - self.SUB_BITS)
+        index = (shift << self.SUB_BITS) | (value >> shift)
+        self.counts[index] = self.counts.get(index, 0) + 1
+        self.count += 1
+        self.total += value
+        self.max = max(self.max, value)
+        self.min = value if self.min is None else min(self.min, value)
+
+    def _value(self, index):
+        # Середина корзины, мкс
+        shift = index >> self.SUB_BITS
+        low = (index & ((1 << self.SUB_BITS) - 1)) << shift
+        return low + ((1 << shift) - 1) / 2
+
+    def percentile(self, p):
+        """Перцентиль в мс (p от 0 до 100)"""
+        if not self.count:
+            return 0.0
+        target = max(1, math.ceil(self.count * p / 100))
+        seen = 0
+        for index in sorted(self.counts):
+            seen += self.counts[index]
+            if seen >= target:
+                return min(self._value(index), self.max) / 1000
+        return self.max / 1000
+
+    def buckets(self):
+        """Непустые корзины: (верхняя граница в мс, число замеров)"""
+        result = []
+        for index in sorted(self.counts):
+            shift = index >> self.SUB_BITS
+            upper = (((index & ((1 << self.SUB_BITS) - 1)) + 1) << shift) - 1
+            result.append((upper / 1000, self.counts[index]))
+        return result
+
+
+class LatencyTracer:
+    """Задержки срабатываний по этапам (TRACE_STAGES) для интерфейса и выгрузки
+
+    Пишут поток детектора, сеть и поток нажатий, читает интерфейс.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
         with self.lock:
-            self.audio_data = np.frombuffer(in_data, dtype=np.int16)
-        return (in_data, pyaudio.paContinue)
+            self.histograms = {stage: LatencyHistogram() for stage in TRACE_STAGES}
+            self.recent = collections.deque(maxlen=TRACE_RECENT)
 
-    def get_audio_data(self):
+    def record_trace(self, trace):
+        """Этапы одного срабатывания: {этап: секунды}"""
         with self.lock:
-            return self.audio_data
+            for stage, seconds in trace.items():
+                if stage in self.histograms and seconds >= 0:
+                    self.histograms[stage].record(seconds)
+            self.recent.append(dict(trace, time=time.time()))
 
-    def stop_recording(self):
-        self.is_recording = False
-        if self.stream:
-            try:
-                self.stream.stop_stream()
-                self.stream.close()
-            except:
-                pass
-            self.stream = None
+    def summary(self):
+        """Строки по этапам с замерами: перцентили в мс"""
+        rows = []
+        with self.lock:
+            for stage, hist in self.histograms.items():
+                if not hist.count:
+                    continue
+                rows.append({
+                    'stage': stage,
+                    'label': TRACE_STAGES[stage],
+                    'count': hist.count,
+                    'min_ms': round(hist.min / 1000, 3),
+                    'p50_ms': round(hist.percentile(50), 3),
+                    'p90_ms': round(hist.percentile(90), 3),
+                    'p99_ms': round(hist.percentile(99), 3),
+                    'p999_ms': round(hist.percentile(99.9), 3),
+                    'max_ms': round(hist.max / 1000, 3),
+                    'mean_ms': round(hist.total / hist.count / 1000, 3),
+                })
+        return rows
 
-    def cleanup(self):
-        self.stop_recording()
-        if self.audio:
-            try:
-                self.audio.terminate()
-            except:
-                pass
-            self.audio = None
+    def export_csv(self):
+        rows = self.summary()
+        columns = ['stage', 'label', 'count', 'min_ms', 'p50_ms', 'p90_ms', 'p99_ms', 'p999_ms',
+                   'max_ms', 'mean_ms']
+        lines = [",".join(columns)]
+        for row in rows:
+            lines.append(",".join(f'"{row[c]}"' if c == 'label' else str(row[c]) for c in columns))
+        return "\n".join(lines) + "\n"
 
+    def export_json(self):
+        with self.lock:
+            recent = [{k: (round(v * 1000, 3) if k != 'time' else v) for k, v in trace.items()}
+                      for trace in self.recent]
+            histograms = {stage: hist.buckets() for stage, hist in self.histograms.items() if hist.count}
+        return json.dumps({
+            'summary': self.summary(),
+            'recent_ms': recent,
+            'histograms_ms': histograms,
+        }, indent=2, ensure_ascii=False)
 
-class NetworkClient:
-    """Игрок который орет в микрофон - подключается к серверу"""
+    def save(self, path):
+        """Выгрузка в файл: CSV, если имя кончается на .csv, иначе JSON"""
+        data = self.export_csv() if path.endswith(".csv") else self.export_json()
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(data)
 
-    def __init__(self):
-        self.socket = None
-        self.is_connected = False
-        self.receive_thread = None
-        self.server_address = ""
 
-    def connect_to_server(self, server_ip):
-        try:
-            self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            self.socket.settimeout(5)
-            
-            # Обработка localhost
-            if server_ip == "localhost":
-                server_ip = "127.0.0.1"
-                
-            self.socket.connect((server_ip, PORT))
-            self.socket.settimeout(None)
-            self.is_connected = True
-            self.server_address = server_ip
+class InjectionWorker:
+    """Поток нажатий с ограниченной очередью (сеть только кладёт команды)"""
 
-            st.success(f"✅ Успешно подключено к {server_ip}")
-            return True
-        except Exception as e:
-            st.error(f"Ошибка подключения к {server_ip}: {e}")
-            return False
+    def __init__(self, executor=None, maxsize=INJECTION_QUEUE_SIZE, tracer=None):
+        self.executor = executor or execute_command
+        self.tracer = tracer
+        self.maxsize = maxsize
+        # Предел проверяет submit: отпускание клавиши проходит и в полную очередь
+        self.queue = queue.Queue()
+        self.thread = None
+        self.is_running = False
+        self.lock = threading.Lock()
+        self.reset_stats()
 
-    def send_key_press(self, key_data):
-        """Отправляет команду на нажатие клавиши на сервер"""
-        if not self.is_connected or self.socket is None:
+    def reset_stats(self):
+        with self.lock:
+            self.submitted = 0
+            self.executed = 0
+            self.dropped = 0
+            self.max_depth = 0
+            self.total_wait = 0.0
+            self.max_wait = 0.0
+
+    def start(self):
+        if self.is_running:
+            return
+        self.is_running = True
+        self.thread = threading.Thread(target=self._run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def submit(self, command, trace=None):
+        """Ставит команду в очередь, не блокируя вызывающий поток
+
+        trace - этапы, уже замеренные сетью (network, decode), в секундах.
+        Отпускание не отбрасывается никогда, иначе клавиша залипнет.
+        """
+        if command.get('type') != 'key_up' and self.queue.qsize() >= self.maxsize:
+            with self.lock:
+                self.dropped += 1
+            print(f"Очередь нажатий переполнена, команда отброшена: {command.get('type')}")
             return False
+        self.queue.put_nowait((time.perf_counter(), command, trace))
+
+        with self.lock:
+            self.submitted += 1
+            self.max_depth = max(self.max_depth, self.queue.qsize())
+        return True
+
+    def _run(self):
+        while self.is_running:
+            item = self.queue.get()
+            if item is None:
+                break
+
+            enqueued_at, command, trace = item
+            started = time.perf_counter()
+            wait = started - enqueued_at
+            try:
+                self.executor(command)
+            except Exception as e:
+                print(f"Ошибка выполнения команды: {e}")
+
+            if self.tracer is not None:
+                trace = dict(trace or {})
+                trace['queue'] = wait
+                trace['inject'] = time.perf_counter() - started
+                if command.get('timestamp'):
+                    trace['total'] = time.time() - command['timestamp']
+                self.tracer.record_trace(trace)
+
+            with self.lock:
+                self.executed += 1
+                self.total_wait += wait
+                self.max_wait = max(self.max_wait, wait)
+
+    def get_stats(self):
+        """Счётчики очереди: глубина, ожидание, отброшенные команды"""
+        with self.lock:
+            return {
+                'depth': self.queue.qsize(),
+                'max_depth': self.max_depth,
+                'submitted': self.submitted,
+                'executed': self.executed,
+                'dropped': self.dropped,
+                'avg_wait_ms': self.total_wait / self.executed * 1000 if self.executed else 0.0,
+                'max_wait_ms': self.max_wait * 1000,
+            }
 
+    def stop(self):
+        self.is_running = False
+        # Выбрасываем невыполненные нажатия и будим поток. Отпускания
+        # оставляем: держатель клавиши уже забыт, и без них она залипнет
+        releases = []
+        dropped_downs = set()
         try:
-            self.socket.sendall(pickle.dumps(key_data))
-            return True
-        except Exception as e:
-            print(f"Ошибка отправки: {e}")
-            self.is_connected = False
-            return False
+            while True:
+                item = self.queue.get_nowait()
+                if item is None:
+                    continue
+                command = item[1]
+                if command.get('type') == 'key_down':
+                    dropped_downs.add(command_keys(command).lower())
+                elif command.get('type') == 'key_up':
+                    name = command_keys(command).lower()
+                    if name in dropped_downs:
+                        dropped_downs.discard(name)  # Зажатие выброшено - отпускать нечего
+                    else:
+                        releases.append(command)
+        except queue.Empty:
+            pass
+        self.queue.put_nowait(None)
+        if self.thread is not None:
+            self.thread.join(timeout=1.0)
+            self.thread = None
+        for command in releases:
+            try:
+                self.executor(command)
+            except Exception as e:
+                print(f"Ошибка выполнения команды: {e}")
+
+
+def parse_duration(text):
+    """Длительность шага макроса: '120', '120ms', '120 мс', '0.12s' -> секунды"""
+    value = text.replace(" ", "").lower()
+    scale = 0.001
+    for suffix, factor in (("ms", 0.001), ("мс", 0.001), ("s", 1.0), ("с", 1.0)):
+        if value.endswith(suffix):
+            value, scale = value[:-len(suffix)], factor
+            break
+    try:
+        seconds = float(value) * scale
+    except ValueError:
+        raise ValueError(f"Не понял длительность: '{text}'")
+    if not 0 <= seconds <= MACRO_MAX_DURATION:
+        raise ValueError(f"Длительность вне 0..{MACRO_MAX_DURATION:g} с: '{text}'")
+    return seconds
+
+
+def is_macro(text):
+    """Похож ли текст кнопки на макрос ('down' без клавиши - это стрелка)"""
+    words = text.split()
+    return len(words) > 1 and words[0].lower() in MACRO_ACTIONS
+
+
+def parse_macro(text):
+    """Макрос -> события (смещение от старта в секундах, 'down'/'up', клавиша)
+
+    Шаги через запятую или точку с запятой:
+      tap KEY [ДЛИТ]  - нажать и отпустить (по умолчанию MACRO_TAP_TIME),
+                        следующий шаг - после отпускания
+      hold KEY ДЛИТ   - зажать на время; следующие шаги идут сразу,
+                        под зажатой клавишей
+      down KEY / up KEY - зажать и отпустить вручную
+      wait ДЛИТ       - пауза
+    Длительность в мс, если не указано 's'. "hold shift 120, tap e,
+    wait 30, tap r" - E и R нажимаются с зажатым Shift.
+    """
+    events = []
+    held = set()
+    cursor = 0.0
+    for step in text.replace(";", ",").split(","):
+        words = step.split()
+        if not words:
+            continue
+        action = words[0].lower()
+        if action not in MACRO_ACTIONS:
+            raise ValueError(f"Неизвестный шаг '{step.strip()}' (нужно: {', '.join(MACRO_ACTIONS)})")
+        if action == "wait":
+            cursor += parse_duration(" ".join(words[1:]))
+            continue
+        if len(words) < 2:
+            raise ValueError(f"Не указана клавиша: '{step.strip()}'")
+        key = words[1]
+        rest = " ".join(words[2:])
+        if action == "tap":
+            duration = parse_duration(rest) if rest else MACRO_TAP_TIME
+            events.append((cursor, "down", key))
+            cursor += duration
+            events.append((cursor, "up", key))
+        elif action == "hold":
+            if not rest:
+                raise ValueError(f"Не указано, сколько держать: '{step.strip()}'")
+            events.append((cursor, "down", key))
+            events.append((cursor + parse_duration(rest), "up", key))
+        elif action == "down":
+            held.add(key.lower())
+            events.append((cursor, "down", key))
+        else:
+            held.discard(key.lower())
+            events.append((cursor, "up", key))
+    if held:
+        raise ValueError(f"Макрос оставляет зажатыми: {', '.join(sorted(held))}")
+    if not events:
+        raise ValueError("В макросе нет нажатий")
+    # Сортировка устойчивая: при равном времени порядок шагов сохраняется
+    events.sort(key=lambda event: event[0])
+    if events[-1][0] > MACRO_MAX_DURATION:
+        raise ValueError(f"Макрос длиннее {MACRO_MAX_DURATION:g} с")
+    return events
+
+
+class MacroScheduler:
+    """Поток, который исполняет макросы по расписанию
+
+    Каждое событие макроса получает абсолютный срок по монотонным часам
+    (perf_counter) в момент запуска, поэтому ошибки не копятся от шага к
+    шагу, как у цепочки sleep. Поток спит до срока минус MACRO_SPIN и
+    докручивает остаток. submit только кладёт события в кучу, так что
+    макросы перекрываются и не задерживают новые срабатывания. Зажатия
+    одной клавиши считаются: перекрывшиеся hold shift отпустят Shift
+    только после последнего.
+    """
+
+    _default = None
+    _default_lock = threading.Lock()
+
+    def __init__(self, executor=None):
+        self.executor = executor or KeyPresser
+        self.cond = threading.Condition()
+        self.heap = []  # (срок, номер, прогон, действие, клавиша)
+        self.sequence = 0
+        self.held = {}  # клавиша -> сколько макросов её держат
+        self.thread = None
+        self.is_running = False
+        self.reset_stats()
+
+    @classmethod
+    def get_default(cls, create=True):
+        """Общий планировщик для execute_command (запускается при первом макросе)"""
+        if cls._default is None and create:
+            with cls._default_lock:
+                if cls._default is None:
+                    scheduler = cls()
+                    scheduler.start()
+                    cls._default = scheduler
+        return cls._default
+
+    @classmethod
+    def stop_default(cls):
+        """Останавливает общий планировщик и отпускает зажатые им клавиши"""
+        with cls._default_lock:
+            scheduler, cls._default = cls._default, None
+        if scheduler is not None:
+            scheduler.stop()
+
+    def reset_stats(self):
+        with self.cond:
+            self.submitted = 0
+            self.completed = 0
+            self.dropped = 0
+            self.errors = 0
+            self.lateness = LatencyHistogram()
+            self.recent = collections.deque(maxlen=MACRO_RECENT)
+
+    def start(self):
+        if self.is_running:
+            return
+        self.is_running = True
+        if platform.system() == "Windows":
+            # Без этого таймеры Windows тикают раз в 15.6 мс
+            import ctypes
+            ctypes.windll.winmm.timeBeginPeriod(1)
+        self.thread = threading.Thread(target=self._run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def submit(self, macro):
+        """Запускает макрос (текст или события parse_macro), не дожидаясь его"""
+        events = parse_macro(macro) if isinstance(macro, str) else macro
+        start = time.perf_counter()
+        with self.cond:
+            if len(self.heap) + len(events) > MACRO_MAX_PENDING:
+                self.dropped += 1
+                print(f"Слишком много макросов сразу, отброшен: {macro}")
+                return False
+            run = {'macro': macro if isinstance(macro, str) else "", 'start': start,
+                   'planned': events[-1][0], 'pending': len(events), 'late': []}
+            for offset, action, key in events:
+                self.sequence += 1
+                heapq.heappush(self.heap, (start + offset, self.sequence, run, action, key))
+            self.submitted += 1
+            self.cond.notify()
+        return True
+
+    def _run(self):
+        while True:
+            with self.cond:
+                while self.is_running and not self.heap:
+                    self.cond.wait()
+                if not self.is_running:
+                    break
+                deadline = self.heap[0][0]
+                remaining = deadline - time.perf_counter()
+                if remaining > MACRO_SPIN:
+                    # Новый макрос с более ранним сроком разбудит раньше
+                    self.cond.wait(remaining - MACRO_SPIN)
+                    continue
+            # Без sleep(0): отданный GIL под нагрузкой возвращается только через switchinterval
+            while time.perf_counter() < deadline:
+                pass
+            self._fire_due()
+
+    def _fire_due(self):
+        """Исполняет все события, чей срок наступил"""
+        while True:
+            with self.cond:
+                if not self.heap or self.heap[0][0] > time.perf_counter():
+                    return
+                deadline, _, run, action, key = heapq.heappop(self.heap)
+                # Перекрывшиеся макросы делят клавишу: жмём первое зажатие и последнее отпускание
+                name = key.lower()
+                count = self.held.get(name, 0)
+                if action == "down":
+                    self.held[name] = count + 1
+                    send = count == 0
+                elif count > 0:
+                    if count == 1:
+                        del self.held[name]
+                    else:
+                        self.held[name] = count - 1
+                    send = count == 1
+                else:
+                    send = False
+
+            fired = time.perf_counter()
+            if send:
+                try:
+                    if action == "down":
+                        self.executor.key_down(key)
+                    else:
+                        self.executor.key_up(key)
+                except Exception as e:
+                    with self.cond:
+                        self.errors += 1
+                    print(f"Ошибка макроса ({action} {key}): {e}")
+
+            with self.cond:
+                lateness = fired - deadline
+                self.lateness.record(lateness)
+                run['late'].append(lateness)
+                run['pending'] -= 1
+                if run['pending'] == 0:
+                    self._finish(run, fired)
+
+    def _finish(self, run, now):
+        late = run['late']
+        self.completed += 1
+        self.recent.append({
+            'macro': run['macro'],
+            'events': len(late),
+            'planned_ms': run['planned'] * 1000,
+            'duration_ms': (now - run['start']) * 1000,
+            'mean_late_ms': sum(late) / len(late) * 1000,
+            'max_late_ms': max(late) * 1000,
+            # Разброс опозданий внутри прогона - настолько плывут интервалы между шагами
+            'jitter_ms': (max(late) - min(late)) * 1000,
+        })
+
+    def get_stats(self):
+        """Опоздания событий (все прогоны) и по каждому из последних прогонов"""
+        with self.cond:
+            hist = self.lateness
+            return {
+                'submitted': self.submitted,
+                'completed': self.completed,
+                'active': self.submitted - self.completed,
+                'dropped': self.dropped,
+                'errors': self.errors,
+                'events': hist.count,
+                'late_p50_ms': hist.percentile(50),
+                'late_p99_ms': hist.percentile(99),
+                'late_max_ms': hist.max / 1000,
+                'held': sorted(self.held),
+                'recent': list(self.recent),
+            }
+
+    def stop(self):
+        """Останавливает поток и отпускает всё, что осталось зажатым"""
+        with self.cond:
+            self.is_running = False
+            self.heap = []
+            held, self.held = list(self.held), {}
+            self.cond.notify()
+        if self.thread is not None:
+            self.thread.join(timeout=1.0)
+            self.thread = None
+        for key in held:
+            try:
+                self.executor.key_up(key)
+            except Exception as e:
+                print(f"Не удалось отпустить {key}: {e}")
+        if platform.system() == "Windows":
+            import ctypes
+            ctypes.windll.winmm.timeEndPeriod(1)
+
+
+class AudioRingBuffer:
+    """Предвыделенный кольцевой буфер int16 для захвата звука
+
+    Пишет один поток (callback PyAudio), читать могут несколько. Данные
+    хранятся дважды (зеркально), поэтому любое окно длиной до capacity
+    отдаётся непрерывным срезом без копирования. Срез остаётся верным,
+    пока писатель не обогнал читателя на целый буфер. При channels > 1
+    сэмплы чередуются по каналам, как их отдаёт PortAudio, а срезы -
+    2D (кадры x каналы); индексы и capacity считаются в кадрах.
+    """
+
+    def __init__(self, capacity, rate=RATE, channels=1):
+        self.capacity = capacity
+        self.rate = rate
+        self.channels = channels
+        shape = capacity * 2 if channels == 1 else (capacity * 2, channels)
+        self.data = np.zeros(shape, dtype=np.int16)
+        self._bytes = memoryview(self.data).cast('B')
+        self._frame = 2 * channels  # Байт в кадре
+        self.write_index = 0  # Всего записано сэмплов (только растёт)
+        self.overruns = 0  # Переполнения входа по флагам PortAudio
+        self.dropped_samples = 0  # Сэмплы, которые читатели не успели забрать
+        self.last_write_time = 0.0  # Когда записан последний чанк (time.time)
+        self.last_adc_delay = 0.0  # Сколько последний чанк шёл от АЦП до колбэка, с
+        self.read_index = 0  # Докуда дочитал читатель (ждут его источники быстрее реального времени)
+        self.writer_waiting = False
+        # Только для пробуждения читателей; сами данные пишутся без блокировок
+        self.condition = threading.Condition()
+
+    def write(self, in_data, adc_delay=0.0):
+        """Копирует байты чанка в буфер (вызывается из callback, без выделений)"""
+        src = memoryview(in_data).cast('B')
+        size = self._frame
+        n = len(src) // size
+        if n > self.capacity:
+            src = src[-self.capacity * size:]
+            n = self.capacity
+
+        pos = self.write_index % self.capacity
+        first = min(n, self.capacity - pos)
+        rest = n - first
+        # Основная копия и зеркало: data[i] == data[i + capacity]
+        self._bytes[pos * size:(pos + n) * size] = src
+        self._bytes[(pos + self.capacity) * size:(pos + self.capacity + first) * size] = src[:first * size]
+        if rest:
+            self._bytes[:rest * size] = src[first * size:]
+
+        self.last_write_time = time.time()
+        self.last_adc_delay = adc_delay
+        # Индекс публикуем после данных: читатель не увидит недописанный чанк
+        self.write_index += n
+        with self.condition:
+            self.condition.notify_all()
+
+    def wait_for_data(self, cursor, timeout=None):
+        """Ждёт сэмплов новее cursor; False по таймауту"""
+        if self.write_index > cursor:
+            return True
+        with self.condition:
+            return self.condition.wait_for(lambda: self.write_index > cursor, timeout)
+
+    def wait_for_reader(self, index, timeout=None):
+        """Ждёт, пока читатель дочитает до index; False по таймауту"""
+        if self.read_index >= index:
+            return True
+        with self.condition:
+            self.writer_waiting = True
+            try:
+                return self.condition.wait_for(lambda: self.read_index >= index, timeout)
+            finally:
+                self.writer_waiting = False
+
+    def latest(self, n, end=None):
+        """Последние n сэмплов (до позиции end) как срез без копирования"""
+        end = self.write_index if end is None else end
+        n = min(n, self.capacity, end)
+        start = (end - n) % self.capacity
+        return self.data[start:start + n]
+
+    def last_ms(self, ms):
+        """Последние ms миллисекунд звука"""
+        return self.latest(int(self.rate * ms / 1000))
+
+    def read_since(self, cursor):
+        """Все сэмплы после cursor: (срез, новый cursor)
+
+        Если читатель отстал больше чем на буфер, пропущенное
+        учитывается в dropped_samples.
+        """
+        end = self.write_index
+        if end - cursor > self.capacity:
+            self.dropped_samples += end - cursor - self.capacity
+            cursor = end - self.capacity
+        self.read_index = end
+        if self.writer_waiting:
+            with self.condition:
+                self.condition.notify_all()
+        return self.latest(end - cursor, end), end
+
+
+class AudioSource:
+    """Источник звука для детектора: пишет чанки int16 в кольцевой буфер
+
+    DetectionEngine читает только ring и rate, поэтому ему всё равно,
+    микрофон это (AudioProcessor), WAV-файл или генератор. Источники
+    без железа гонят чанки своим потоком: в реальном времени
+    (realtime=True) или так быстро, как успевает читатель буфера.
+    """
+
+    name = "Источник звука"
+
+    def __init__(self, rate=RATE, chunk=CHUNK, realtime=True, loop=False, channels=1):
+        self.rate = rate
+        self.chunk = chunk
+        self.realtime = realtime
+        self.loop = loop
+        self.channels = channels
+        self.is_recording = False
+        self.last_error = ""
+        self.thread = None
+        self.finished = threading.Event()  # Источник отдал весь звук (файл кончился)
+        self.ring = AudioRingBuffer(int(self.rate * RING_SECONDS), self.rate, channels)
+
+    def blocks(self):
+        """Звук блоками int16 любой длины, 2D (кадры x каналы) при channels > 1
+        (переопределяют наследники)"""
+        raise NotImplementedError
+
+    def start_recording(self):
+        if self.thread is not None:
+            return True
+        if self.ring.write_index:
+            # Повторный запуск - с чистого буфера; первый пишет в уже созданный,
+            # чтобы запущенный заранее детектор не пропустил начало
+            self.ring = AudioRingBuffer(int(self.rate * RING_SECONDS), self.rate, self.channels)
+        self.finished.clear()
+        self.is_recording = True
+        self.thread = threading.Thread(target=self._run)
+        self.thread.daemon = True
+        self.thread.start()
+        return True
+
+    def _run(self):
+        ring = self.ring
+        started = time.perf_counter()
+        written = 0
+        try:
+            while self.is_recording:
+                for block in self.blocks():
+                    for start in range(0, len(block), self.chunk):
+                        if not self.is_recording:
+                            return
+                        chunk = block[start:start + self.chunk]
+                        if self.realtime:
+                            # Сон до срока чанка, а не на его длину: ошибки не копятся
+                            delay = started + (written + len(chunk)) / self.rate - time.perf_counter()
+                            if delay > 0:
+                                time.sleep(delay)
+                        else:
+                            # Ждём, пока читатель заберёт прошлый чанк: как и в реальном
+                            # времени, детектор видит звук по одному чанку
+                            ring.wait_for_reader(ring.write_index, timeout=1.0)
+                        ring.write(chunk)
+                        written += len(chunk)
+                if not self.loop:
+                    break
+        except Exception as e:
+            self.last_error = f"Ошибка источника звука: {e}"
+            print(self.last_error)
+        finally:
+            self.finished.set()
+
+    def get_device_name(self):
+        return self.name
+
+    def get_audio_data(self):
+        """Последний чанк (None, пока звука нет)"""
+        if self.ring.write_index == 0:
+            return None
+        return self.ring.latest(self.chunk)
+
+    def read_since(self, cursor):
+        """Все сэмплы после cursor без копирования: (срез, новый cursor)"""
+        return self.ring.read_since(cursor)
+
+    def get_overruns(self):
+        """Потери звука: переполнения входа и недочитанные сэмплы"""
+        return {
+            'input_overflows': self.ring.overruns,
+            'dropped_samples': self.ring.dropped_samples,
+        }
+
+    def stop_recording(self):
+        self.is_recording = False
+        if self.thread is not None:
+            self.thread.join(timeout=1.0)
+            self.thread = None
+
+    def cleanup(self):
+        self.stop_recording()
+
+
+class AudioProcessor(AudioSource):
+    """Микрофон через PyAudio: колбэк потока пишет чанки прямо в кольцевой буфер"""
+
+    name = "Микрофон"
+
+    def __init__(self, profile_path=AUDIO_PROFILE_PATH):
+        super().__init__(RATE, CHUNK)
+        self.audio = None
+        self.stream = None
+        self.device_index = None  # None - устройство ввода по умолчанию
+        self.profile_path = profile_path
+        self.profile = None
+
+    def initialize_audio(self):
+        """Инициализация аудио (ленивая загрузка)"""
+        if self.audio is None:
+            try:
+                self.audio = pyaudio.PyAudio()
+                self.load_profile()
+                return True
+            except Exception as e:
+                self.last_error = f"Ошибка инициализации аудио: {e}"
+                print(self.last_error)
+                return False
+        return True
+
+    def start_recording(self):
+        if not self.initialize_audio():
+            return False
+            
+        if self.stream is None:
+            try:
+                self.ring = AudioRingBuffer(int(self.rate * RING_SECONDS), self.rate)
+                self.stream = self.audio.open(
+                    format=getattr(pyaudio, FORMAT),
+                    channels=CHANNELS,
+                    rate=self.rate,
+                    input=True,
+                    input_device_index=self.device_index,
+                    frames_per_buffer=self.chunk,
+                    stream_callback=self.callback
+                )
+            except Exception as e:
+                self.last_error = f"Ошибка микрофона: {e}"
+                print(self.last_error)
+                return False
+
+        self.is_recording = True
+        self.stream.start_stream()
+        return True
+
+    def callback(self, in_data, frame_count, time_info, status):
+        # Время АЦП и текущее - по часам потока PortAudio; 0, если драйвер их не даёт
+        adc_delay = 0.0
+        if time_info and time_info.get('input_buffer_adc_time'):
+            adc_delay = time_info['current_time'] - time_info['input_buffer_adc_time']
+            if not 0.0 <= adc_delay < 1.0:
+                adc_delay = 0.0
+        self.ring.write(in_data, adc_delay)
+        if status & pyaudio.paInputOverflow:
+            self.ring.overruns += 1
+        return (None, pyaudio.paContinue)
+
+    def get_device_name(self):
+        """Имя текущего устройства ввода (ключ профиля калибровки)"""
+        if self.device_index is None:
+            info = self.audio.get_default_input_device_info()
+        else:
+            info = self.audio.get_device_info_by_index(self.device_index)
+        return info['name']
+
+    def load_profile(self):
+        """Применяет сохранённый профиль CHUNK/RATE для текущего устройства"""
+        try:
+            with open(self.profile_path, encoding="utf-8") as f:
+                profiles = json.load(f)
+            profile = profiles.get(self.get_device_name())
+        except (OSError, ValueError, KeyError):
+            return None
+        except Exception as e:
+            print(f"Профиль аудио не загружен: {e}")
+            return None
+
+        if profile:
+            self.rate = profile['rate']
+            self.chunk = profile['chunk']
+            self.profile = profile
+            print(f"Профиль аудио: {self.rate} Гц, чанк {self.chunk}")
+        return profile
+
+    def save_profile(self, profile):
+        """Сохраняет профиль для текущего устройства (остальные не трогает)"""
+        profiles = {}
+        try:
+            with open(self.profile_path, encoding="utf-8") as f:
+                profiles = json.load(f)
+        except (OSError, ValueError):
+            pass
+
+        profiles[self.get_device_name()] = profile
+        os.makedirs(os.path.dirname(self.profile_path), exist_ok=True)
+        with open(self.profile_path, "w", encoding="utf-8") as f:
+            json.dump(profiles, f, indent=2, ensure_ascii=False)
+
+    def measure_config(self, rate, chunk, seconds=CALIBRATION_SECONDS):
+        """Пробный захват: джиттер колбэков, переполнения, задержка до детекции"""
+        result = {'rate': rate, 'chunk': chunk, 'buffer_ms': chunk / rate * 1000, 'stable': False}
+        try:
+            if not self.audio.is_format_supported(rate, input_device=self.device_index,
+                                                  input_channels=CHANNELS, input_format=getattr(pyaudio, FORMAT)):
+                result['error'] = "формат не поддерживается"
+                return result
+        except ValueError as e:
+            result['error'] = str(e)
+            return result
+
+        arrivals = []
+        adc_delays = []
+        detect_times = []
+        overflows = [0]
+        meter = LoudnessMeter(rate=rate, max_chunk=chunk)
+
+        def calibration_callback(in_data, frame_count, time_info, status):
+            arrived = time.perf_counter()
+            arrivals.append(arrived)
+            if status & pyaudio.paInputOverflow:
+                overflows[0] += 1
+            adc_time = time_info.get('input_buffer_adc_time', 0) if time_info else 0
+            if adc_time:
+                # Сколько прошло от оцифровки первого сэмпла до колбэка
+                adc_delays.append(time_info['current_time'] - adc_time)
+            meter.update(np.frombuffer(in_data, dtype=np.int16))
+            detect_times.append(time.perf_counter() - arrived)
+            return (None, pyaudio.paContinue)
+
+        stream = None
+        try:
+            stream = self.audio.open(format=getattr(pyaudio, FORMAT), channels=CHANNELS, rate=rate, input=True,
+                                     input_device_index=self.device_index,
+                                     frames_per_buffer=chunk, stream_callback=calibration_callback)
+            stream.start_stream()
+            time.sleep(seconds)
+            stream.stop_stream()
+            input_latency = stream.get_input_latency()
+        except Exception as e:
+            result['error'] = str(e)
+            return result
+        finally:
+            if stream is not None:
+                try:
+                    stream.close()
+                except:
+                    pass
+
+        # Первые колбэки уходят на прогрев потока
+        arrivals = arrivals[CALIBRATION_WARMUP:]
+        expected = chunk / rate
+        if len(arrivals) < 2:
+            result['error'] = "нет колбэков"
+            return result
+
+        deviations = np.abs(np.diff(arrivals) - expected)
+        jitter = float(np.percentile(deviations, 99))
+        received = len(arrivals) / max(1.0, seconds / expected - CALIBRATION_WARMUP)
+        if adc_delays:
+            capture_delay = float(np.mean(adc_delays))
+        else:
+            # Хост-API не сообщает время АЦП - оцениваем по буферу и задержке входа
+            capture_delay = expected + input_latency
+
+        result.update(
+            callbacks=len(arrivals),
+            received_ratio=round(received, 3),
+            overflows=overflows[0],
+            jitter_ms=jitter * 1000,
+            latency_ms=(capture_delay + float(np.mean(detect_times))) * 1000,
+        )
+        result['stable'] = (overflows[0] == 0 and received >= CALIBRATION_MIN_RECEIVED
+                            and jitter <= expected * CALIBRATION_MAX_JITTER)
+        return result
+
+    def calibrate(self, rates=CALIBRATION_RATES, chunks=CALIBRATION_CHUNKS,
+                  seconds=CALIBRATION_SECONDS, save=True):
+        """Подбирает самую быструю стабильную пару CHUNK/RATE для устройства
+
+        Кандидаты проверяются от самого короткого буфера к длинному,
+        первый стабильный становится профилем устройства.
+        """
+        if self.is_recording:
+            raise RuntimeError("Остановите микрофон перед калибровкой")
+        if not self.initialize_audio():
+            raise RuntimeError(self.last_error)
+
+        candidates = sorted(((rate, chunk) for rate in rates for chunk in chunks),
+                            key=lambda c: (c[1] / c[0], c[0]))
+        report = []
+        chosen = None
+        for rate, chunk in candidates:
+            result = self.measure_config(rate, chunk, seconds)
+            report.append(result)
+            if result['stable']:
+                chosen = result
+                break
+
+        if chosen is not None:
+            profile = {
+                'rate': chosen['rate'],
+                'chunk': chosen['chunk'],
+                'latency_ms': round(chosen['latency_ms'], 2),
+                'jitter_ms': round(chosen['jitter_ms'], 3),
+                'calibrated_at': time.strftime("%Y-%m-%d %H:%M:%S"),
+            }
+            self.rate = profile['rate']
+            self.chunk = profile['chunk']
+            self.profile = profile
+            if save:
+                self.save_profile(profile)
+
+        return chosen, report
+
+    def stop_recording(self):
+        self.is_recording = False
+        if self.stream:
+            try:
+                self.stream.stop_stream()
+                self.stream.close()
+            except:
+                pass
+            self.stream = None
+
+    def cleanup(self):
+        self.stop_recording()
+        if self.audio:
+            try:
+                self.audio.terminate()
+            except:
+                pass
+            self.audio = None
+
+
+def level_amplitude(level_db):
+    """Уровень в дБ (как у calculate_volume) -> RMS в единицах int16"""
+    return math.sqrt(FULL_SCALE_SQ) * 10 ** (level_db / 20)
+
+
+class WavSource(AudioSource):
+    """WAV-файл (16 бит, стерео сводится в моно) с его частотой дискретизации"""
+
+    def __init__(self, path, chunk=CHUNK, realtime=True, loop=False):
+        with wave.open(path, "rb") as f:
+            if f.getsampwidth() != 2:
+                raise ValueError(f"{path}: нужен 16-битный WAV, а не {f.getsampwidth() * 8}-битный")
+            rate = f.getframerate()
+            self.file_channels = f.getnchannels()  # В буфер идёт моно: channels базового класса - 1
+            self.frames = f.getnframes()
+        self.path = path
+        self.name = os.path.basename(path)
+        super().__init__(rate, chunk, realtime, loop)
+
+    def blocks(self):
+        with wave.open(self.path, "rb") as f:
+            while True:
+                data = f.readframes(self.chunk * 16)
+                if not data:
+                    return
+                samples = np.frombuffer(data, dtype="<i2")
+                if self.file_channels > 1:
+                    samples = samples.reshape(-1, self.file_channels).mean(axis=1)
+                yield samples.astype(np.int16)
+
+
+class SyntheticSource(AudioSource):
+    """Генератор: тон, шум или крики (гармонический тон с атакой и спадом) на фоне шума
+
+    Для криков labels - моменты начала в секундах: по ним бенчмарк
+    проверяет, вовремя ли сработал детектор.
+    """
+
+    KINDS = {
+        "tone": "Тон",
+        "noise": "Шум",
+        "shout": "Крики",
+    }
+
+    def __init__(self, kind="shout", seconds=10.0, level_db=-12.0, noise_db=-60.0, frequency=300.0,
+                 shouts=None, period=2.0, length=0.4, attack=0.01, release=0.05, seed=0,
+                 rate=RATE, chunk=CHUNK, realtime=True, loop=False):
+        if kind not in self.KINDS:
+            raise ValueError(f"Неизвестный сигнал: {kind}")
+        super().__init__(rate, chunk, realtime, loop)
+        self.kind = kind
+        self.name = f"Генератор: {self.KINDS[kind]}"
+        self.seconds = seconds
+        self.level_db = level_db
+        self.noise_db = noise_db
+        self.frequency = frequency
+        self.attack = attack
+        self.release = release
+        self.seed = seed
+        if shouts is None and kind == "shout":
+            # По умолчанию - крик каждые period секунд, начиная с первой секунды
+            shouts = [(t, length, level_db) for t in np.arange(1.0, seconds - length, period)]
+        self.shouts = [tuple(float(x) for x in shout) for shout in shouts or ()]
+
+    @property
+    def labels(self):
+        return [start for start, _, _ in self.shouts]
+
+    def _shout_wave(self, t):
+        # Гармоники 1/n: у голоса энергия выше основного тона; RMS приведён к 1
+        harmonics = sum(np.sin(2 * np.pi * self.frequency * n * t) / n for n in range(1, 6))
+        return harmonics / math.sqrt(sum(0.5 / n ** 2 for n in range(1, 6)))
+
+    def _envelope(self, t, start, length):
+        rise = np.clip((t - start) / self.attack, 0.0, 1.0)
+        fall = np.clip((start + length - t) / self.release, 0.0, 1.0)
+        return np.minimum(rise, fall)
+
+    def blocks(self):
+        rng = np.random.default_rng(self.seed)
+        total = int(self.seconds * self.rate)
+        for start in range(0, total, self.chunk * 16):
+            t = np.arange(start, min(total, start + self.chunk * 16)) / self.rate
+            if self.kind == "noise":
+                samples = rng.normal(0.0, level_amplitude(self.level_db), len(t))
+            else:
+                samples = rng.normal(0.0, level_amplitude(self.noise_db), len(t))
+                if self.kind == "tone":
+                    samples += np.sqrt(2) * level_amplitude(self.level_db) * np.sin(2 * np.pi * self.frequency * t)
+                for shout_start, length, level_db in self.shouts:
+                    if shout_start < t[-1] and shout_start + length > t[0]:
+                        envelope = self._envelope(t, shout_start, length)
+                        samples += level_amplitude(level_db) * envelope * self._shout_wave(t)
+            yield np.clip(samples, -32768, 32767).astype(np.int16)
+
+
+class NullSource(AudioSource):
+    """Тишина: детектор работает без микрофона (интерфейс, замеры накладных расходов)"""
+
+    name = "Тишина"
+
+    def __init__(self, seconds=None, rate=RATE, chunk=CHUNK, realtime=True):
+        super().__init__(rate, chunk, realtime, loop=seconds is None)
+        self.seconds = seconds if seconds is not None else RING_SECONDS
+
+    def blocks(self):
+        yield np.zeros(int(self.seconds * self.rate), dtype=np.int16)
+
+
+class FlightSource(AudioSource):
+    """Звук события из бортового самописца - для повтора через детектор
+
+    Начало обрезается так, чтобы границы чанков совпали с теми, что
+    видел детектор при записи: событие приходится на конец чанка.
+    """
+
+    def __init__(self, record, realtime=False):
+        super().__init__(record['rate'], record['chunk'] or CHUNK, realtime, channels=record['channels'])
+        self.name = f"Самописец: событие {record['seq']}"
+        skip = (record['position'] - record['audio_start']) % self.chunk
+        self.start_position = record['audio_start'] + skip  # Позиция первого кадра в исходном потоке
+        self.audio = record['audio'][skip:]
+
+    def blocks(self):
+        yield self.audio
+
+
+class MixSource(AudioSource):
+    """Несколько источников без железа как каналы одного: по каналу на игрока"""
+
+    def __init__(self, sources, realtime=True, loop=False):
+        if not sources:
+            raise ValueError("Нет источников для сведения")
+        rates = sorted({source.rate for source in sources})
+        if len(rates) > 1:
+            raise ValueError(f"У источников разная частота: {', '.join(map(str, rates))} Гц")
+        self.sources = sources
+        self.name = " + ".join(source.get_device_name() for source in sources)
+        super().__init__(rates[0], sources[0].chunk, realtime, loop,
+                         channels=sum(source.channels for source in sources))
+
+    @property
+    def labels(self):
+        """Метки криков по каналам (у источников без меток - пусто)"""
+        return [getattr(source, 'labels', []) for source in self.sources]
+
+    def blocks(self):
+        # Блоки у источников разной длины: остаток каждого ждёт следующего
+        # сведения, а не выбрасывается. Кончился любой источник - кончилось всё
+        streams = [source.blocks() for source in self.sources]
+        pending = [[] for _ in streams]
+        while True:
+            for stream, parts in zip(streams, pending):
+                while sum(len(part) for part in parts) < self.chunk:
+                    part = next(stream, None)
+                    if part is None:
+                        break
+                    if len(part):
+                        parts.append(part)
+            n = min(sum(len(part) for part in parts) for parts in pending)
+            if not n:
+                return
+            columns = []
+            for parts in pending:
+                buffered = np.concatenate(parts) if len(parts) > 1 else parts[0]
+                columns.append(buffered[:n])
+                parts[:] = [buffered[n:]] if len(buffered) > n else []
+            yield np.column_stack(columns)
+
+
+class MultiMicProcessor(AudioSource):
+    """Несколько микрофонов или один многоканальный вход - по каналу на игрока
+
+    devices - список (индекс устройства или None, число каналов). Один
+    многоканальный вход пишет в буфер прямо из колбэка PortAudio, как
+    AudioProcessor. Несколько устройств читает один поток: по чанку
+    блокирующим read с каждого, чанки складываются в кадр (сэмплы x
+    каналы). Часы устройств немного расходятся - отставшее теряет
+    сэмплы при переполнении своего буфера.
+    """
+
+    name = "Несколько микрофонов"
+
+    def __init__(self, devices, rate=RATE, chunk=CHUNK):
+        self.devices = [(device, channels) for device, channels in devices]
+        if not self.devices:
+            raise ValueError("Не указано ни одного устройства")
+        super().__init__(rate, chunk, channels=sum(channels for _, channels in self.devices))
+        self.audio = None
+        self.streams = []
+
+    def start_recording(self):
+        if self.streams:
+            return True
+        try:
+            if self.audio is None:
+                self.audio = pyaudio.PyAudio()
+            self.ring = AudioRingBuffer(int(self.rate * RING_SECONDS), self.rate, self.channels)
+            single = len(self.devices) == 1
+            for device, channels in self.devices:
+                self.streams.append(self.audio.open(
+                    format=getattr(pyaudio, FORMAT),
+                    channels=channels,
+                    rate=self.rate,
+                    input=True,
+                    input_device_index=device,
+                    frames_per_buffer=self.chunk,
+                    stream_callback=self.callback if single else None
+                ))
+        except Exception as e:
+            self.last_error = f"Ошибка микрофона: {e}"
+            print(self.last_error)
+            self.stop_recording()
+            return False
+
+        self.is_recording = True
+        if len(self.streams) > 1:
+            self.thread = threading.Thread(target=self._read_devices)
+            self.thread.daemon = True
+            self.thread.start()
+        return True
+
+    def callback(self, in_data, frame_count, time_info, status):
+        self.ring.write(in_data)
+        if status & pyaudio.paInputOverflow:
+            self.ring.overruns += 1
+        return (None, pyaudio.paContinue)
+
+    def _read_devices(self):
+        ring = self.ring
+        frame = np.empty((self.chunk, self.channels), dtype=np.int16)
+        try:
+            while self.is_recording:
+                column = 0
+                for stream, (_, channels) in zip(self.streams, self.devices):
+                    data = stream.read(self.chunk, exception_on_overflow=False)
+                    frame[:, column:column + channels] = np.frombuffer(data, dtype=np.int16).reshape(-1, channels)
+                    column += channels
+                ring.write(frame)
+        except Exception as e:
+            self.last_error = f"Ошибка микрофона: {e}"
+            print(self.last_error)
+
+    def get_device_name(self):
+        names = []
+        for device, channels in self.devices:
+            if device is None:
+                info = self.audio.get_default_input_device_info()
+            else:
+                info = self.audio.get_device_info_by_index(device)
+            names.append(f"{info['name']} x{channels}" if channels > 1 else info['name'])
+        return " + ".join(names)
+
+    def stop_recording(self):
+        self.is_recording = False
+        if self.thread is not None:
+            self.thread.join(timeout=1.0)
+            self.thread = None
+        for stream in self.streams:
+            try:
+                stream.stop_stream()
+                stream.close()
+            except:
+                pass
+        self.streams = []
+
+    def cleanup(self):
+        self.stop_recording()
+        if self.audio:
+            try:
+                self.audio.terminate()
+            except:
+                pass
+            self.audio = None
+
+
+def parse_devices(text):
+    """Устройства из строки 'индекс[xканалы], ...': '0,1' или '2x4', default - по умолчанию"""
+    devices = []
+    for item in text.split(","):
+        item = item.strip()
+        if not item:
+            continue
+        device, _, channels = item.partition("x")
+        try:
+            devices.append((None if device in ("", "default") else int(device), int(channels or 1)))
+        except ValueError:
+            raise ValueError(f"Не понял устройство: '{item}' (нужно, например, 0,1 или 2x4)")
+    if not devices:
+        raise ValueError("Не указано ни одного устройства")
+    return devices
+
+
+AUDIO_SOURCES = {
+    "mic": "Микрофон",
+    "multi": "Несколько микрофонов",
+    "wav": "WAV-файл",
+    "synthetic": "Генератор",
+    "null": "Тишина",
+}
+
+
+def open_audio_source(spec, realtime=True):
+    """Источник по строке: mic, multi:0,1 или multi:2x4, wav:путь,
+    synthetic[:tone|noise|shout], null; несколько через запятую сводятся
+    в каналы (wav:a.wav,wav:b.wav)"""
+    kind, _, arg = spec.partition(":")
+    if kind == "multi":
+        return MultiMicProcessor(parse_devices(arg))
+    if "," in spec:
+        sources = [open_audio_source(part.strip(), realtime) for part in spec.split(",")]
+        if any(isinstance(source, (AudioProcessor, MultiMicProcessor)) for source in sources):
+            raise ValueError("Микрофоны сводятся в каналы через multi:, например multi:0,1")
+        return MixSource(sources, realtime, loop=any(source.loop for source in sources))
+    if kind == "mic":
+        return AudioProcessor()
+    if kind == "wav":
+        if not arg:
+            raise ValueError("wav: нужен путь к файлу (wav:запись.wav)")
+        return WavSource(arg, realtime=realtime)
+    if kind == "synthetic":
+        return SyntheticSource(arg or "shout", realtime=realtime, loop=True)
+    if kind == "null":
+        return NullSource(realtime=realtime)
+    raise ValueError(f"Неизвестный источник звука: {spec}")
+
+
+# Бинарный протокол: кадр = заголовок (длина тела, тип, флаги, время отправки) + тело
+FRAME_HEADER = struct.Struct("!HBBd")
+MAX_FRAME_BODY = 1024
+
+MSG_KEY_PRESS = 1
+MSG_HOTKEY = 2
+MSG_HELLO = 3
+MSG_PING = 4  # Время отправки t1 - в заголовке, тело пустое
+MSG_PONG = 5  # В заголовке t3 (время ответа), в теле t1 и t2 (время приёма пинга)
+MSG_MACRO = 6  # Тело - текст макроса в UTF-8, разбирает и исполняет получатель
+MSG_KEY_DOWN = 7  # Тело как у комбинации: зажать клавиши по порядку
+MSG_KEY_UP = 8  # Отпустить их в обратном порядке
+
+MESSAGE_TYPES = {
+    'key_press': MSG_KEY_PRESS,
+    'hotkey': MSG_HOTKEY,
+    'macro': MSG_MACRO,
+    'key_down': MSG_KEY_DOWN,
+    'key_up': MSG_KEY_UP,
+}
+
+# Флаг: последний байт тела - громкость крика в дБ (int8). Старые
+# серверы его не знают и просто не дочитывают тело
+FLAG_LEVEL = 0x01
+LEVEL = struct.Struct("!b")
+
+# Клавиша в теле кадра передаётся индексом в таблице (порядок менять нельзя)
+KEY_INDEX = struct.Struct("!H")
+KEY_BY_NAME = 0xFFFF  # Клавиши вне таблицы: индекс-маркер + длина + имя в UTF-8
+KEY_TABLE = (
+    ('space', 'enter', 'tab', 'esc', 'backspace',
+     'ctrl', 'shift', 'alt', 'cmd',
+     'up', 'down', 'left', 'right')
+    + tuple('abcdefghijklmnopqrstuvwxyz')
+    + tuple('0123456789')
+    + tuple(f'f{i}' for i in range(1, 13))
+)
+KEY_CODES = {name: index for index, name in enumerate(KEY_TABLE)}
+KEY_PRESS_FRAME = struct.Struct("!HBBdH")
+KEY_PRESS_LEVEL_FRAME = struct.Struct("!HBBdHb")
+PONG_BODY = struct.Struct("!dd")
+
+
+class ProtocolError(Exception):
+    """Некорректный кадр протокола"""
+
+
+def _pack_key(key):
+    index = KEY_CODES.get(key.lower())
+    if index is not None:
+        return KEY_INDEX.pack(index)
+    name = key.encode('utf-8')
+    if len(name) > 255:
+        raise ProtocolError(f"Слишком длинное имя клавиши: {key[:20]}...")
+    return KEY_INDEX.pack(KEY_BY_NAME) + bytes((len(name),)) + name
+
+
+def _unpack_key(body, offset):
+    if offset + KEY_INDEX.size > len(body):
+        raise ProtocolError("Обрезанный код клавиши")
+    index, = KEY_INDEX.unpack_from(body, offset)
+    offset += KEY_INDEX.size
+    if index != KEY_BY_NAME:
+        if index >= len(KEY_TABLE):
+            raise ProtocolError(f"Неизвестный код клавиши: {index}")
+        return KEY_TABLE[index], offset
+
+    if offset >= len(body) or offset + 1 + body[offset] > len(body):
+        raise ProtocolError("Обрезанное имя клавиши")
+    end = offset + 1 + body[offset]
+    return bytes(body[offset + 1:end]).decode('utf-8'), end
+
+
+def _level_byte(level):
+    return max(-128, min(127, int(round(level))))
+
+
+def encode_command(command):
+    """Кодирует команду (dict как у send_key_press) в кадр протокола"""
+    msg_type = MESSAGE_TYPES.get(command.get('type'))
+    level = command.get('level')
+    if msg_type == MSG_KEY_PRESS:
+        index = KEY_CODES.get(command['key'].lower())
+        if index is not None:
+            # Быстрый путь: клавиша из таблицы, весь кадр одним pack
+            timestamp = command.get('timestamp') or time.time()
+            if level is None:
+                return KEY_PRESS_FRAME.pack(KEY_INDEX.size, MSG_KEY_PRESS, 0, timestamp, index)
+            return KEY_PRESS_LEVEL_FRAME.pack(KEY_INDEX.size + LEVEL.size, MSG_KEY_PRESS, FLAG_LEVEL,
+                                              timestamp, index, _level_byte(level))
+        body = _pack_key(command['key'])
+    elif msg_type in (MSG_HOTKEY, MSG_KEY_DOWN, MSG_KEY_UP):
+        keys = command['keys']
+        body = bytes((len(keys),)) + b"".join(_pack_key(key) for key in keys)
+    elif msg_type == MSG_MACRO:
+        body = command['macro'].encode('utf-8')
+        if len(body) > MAX_FRAME_BODY - LEVEL.size:
+            raise ProtocolError(f"Слишком длинный макрос: {len(body)} байт")
+    else:
+        raise ProtocolError(f"Неизвестный тип команды: {command.get('type')}")
+
+    flags = 0
+    if level is not None:
+        flags |= FLAG_LEVEL
+        body += LEVEL.pack(_level_byte(level))
+    timestamp = command.get('timestamp') or time.time()
+    return FRAME_HEADER.pack(len(body), msg_type, flags, timestamp) + body
+
+
+def decode_frame(msg_type, flags, timestamp, body):
+    """Тело кадра -> команда; None для неизвестных типов (совместимость)"""
+    level = None
+    if flags & FLAG_LEVEL and msg_type in (MSG_KEY_PRESS, MSG_HOTKEY, MSG_MACRO, MSG_KEY_DOWN, MSG_KEY_UP):
+        if not body:
+            raise ProtocolError("Нет байта громкости")
+        level, = LEVEL.unpack_from(body, len(body) - LEVEL.size)
+        body = body[:len(body) - LEVEL.size]
+
+    if msg_type == MSG_KEY_PRESS:
+        key, _ = _unpack_key(body, 0)
+        command = {'type': 'key_press', 'key': key, 'timestamp': timestamp}
+    elif msg_type in (MSG_HOTKEY, MSG_KEY_DOWN, MSG_KEY_UP):
+        if not body:
+            raise ProtocolError("Пустая комбинация")
+        keys = []
+        offset = 1
+        for _ in range(body[0]):
+            key, offset = _unpack_key(body, offset)
+            keys.append(key)
+        names = {MSG_HOTKEY: 'hotkey', MSG_KEY_DOWN: 'key_down', MSG_KEY_UP: 'key_up'}
+        command = {'type': names[msg_type], 'keys': keys, 'timestamp': timestamp}
+    elif msg_type == MSG_MACRO:
+        try:
+            macro = bytes(body).decode('utf-8')
+        except UnicodeDecodeError:
+            raise ProtocolError("Макрос не в UTF-8")
+        command = {'type': 'macro', 'macro': macro, 'timestamp': timestamp}
+    else:
+        command = None
+
+    if command is not None:
+        if level is not None:
+            command['level'] = float(level)
+        return command
+
+    if msg_type == MSG_HELLO:
+        return {'type': 'hello', 'timestamp': timestamp}
+    if msg_type == MSG_PING:
+        return {'type': 'ping', 'timestamp': timestamp}
+    if msg_type == MSG_PONG:
+        if len(body) < PONG_BODY.size:
+            raise ProtocolError("Обрезанный понг")
+        origin, received = PONG_BODY.unpack_from(body)
+        return {'type': 'pong', 'timestamp': timestamp, 'origin': origin, 'received': received}
+
+    return None
+
+
+def encode_hello():
+    """Кадр приветствия: регистрирует UDP-сессию на сервере"""
+    return FRAME_HEADER.pack(0, MSG_HELLO, 0, time.time())
+
+
+def encode_ping():
+    return FRAME_HEADER.pack(0, MSG_PING, 0, time.time())
+
+
+def encode_pong(ping, received):
+    """Ответ на пинг: возвращает его время отправки и время приёма"""
+    return FRAME_HEADER.pack(PONG_BODY.size, MSG_PONG, 0, time.time()) + PONG_BODY.pack(ping['timestamp'], received)
+
+
+class Heartbeat:
+    """Пульс соединения с одним собеседником: RTT, джиттер, смещение часов
+
+    Пинг уносит время отправки t1, собеседник отвечает понгом с t1, временем
+    приёма t2 и временем ответа t3, а t4 - когда понг пришёл к нам:
+    RTT = (t4 - t1) - (t3 - t2), смещение = ((t2 - t1) + (t3 - t4)) / 2.
+    Смещение берётся из замера с наименьшим RTT в окне - на нём меньше
+    всего сказались очереди. Мёртвым собеседник считается, только если он
+    уже прислал пинг или понг: старые версии пинги молча игнорируют.
+    """
+
+    def __init__(self, now=None):
+        now = time.monotonic() if now is None else now
+        self.samples = collections.deque(maxlen=HEARTBEAT_WINDOW)  # (RTT, смещение)
+        self.rtt = None
+        self.last_rtt = None
+        self.jitter = 0.0
+        self.offset = None
+        self.capable = False
+        self.last_heard = now
+        self.next_ping = now
+        self.pings = 0
+        self.pongs = 0
+
+    def heard(self, now):
+        """Любые данные от собеседника доказывают, что он жив"""
+        self.last_heard = now
+
+    def on_ping(self):
+        self.capable = True
+
+    def ping_due(self, now):
+        if now < self.next_ping:
+            return False
+        self.next_ping = now + HEARTBEAT_INTERVAL
+        self.pings += 1
+        return True
+
+    def on_pong(self, pong, arrived):
+        """Учитывает понг; arrived - время прихода (time.time(), t4)"""
+        self.capable = True
+        self.pongs += 1
+        t1, t2, t3 = pong['origin'], pong['received'], pong['timestamp']
+        rtt = max(0.0, (arrived - t1) - (t3 - t2))
+        offset = ((t2 - t1) + (t3 - arrived)) / 2
+        if self.rtt is None:
+            self.rtt = rtt
+        else:
+            # Сглаживание как у TCP (RFC 6298) и джиттер как в RTP (RFC 3550)
+            self.rtt += (rtt - self.rtt) / 8
+            self.jitter += (abs(rtt - self.last_rtt) - self.jitter) / 16
+        self.last_rtt = rtt
+        self.samples.append((rtt, offset))
+        self.offset = min(self.samples)[1]
+
+    def timeout(self):
+        """Сколько тишины терпеть: интервал пульса и запас на RTT и джиттер (как RTO в TCP)"""
+        if self.rtt is None:
+            return HEARTBEAT_TIMEOUT
+        return HEARTBEAT_INTERVAL + max(HEARTBEAT_MARGIN, self.rtt + 4 * self.jitter)
+
+    def is_dead(self, now):
+        return self.capable and now - self.last_heard > self.timeout()
+
+    def next_deadline(self):
+        """Когда пора пинговать или объявлять собеседника мёртвым"""
+        return min(self.next_ping, self.last_heard + self.timeout())
+
+    def one_way(self, timestamp, received):
+        """Задержка в одну сторону: часы отправителя приводятся к нашим"""
+        if self.offset is None:
+            return received - timestamp
+        return received - (timestamp - self.offset)
+
+    def get_stats(self):
+        return {
+            'rtt_ms': self.rtt * 1000 if self.rtt is not None else None,
+            'jitter_ms': self.jitter * 1000,
+            'offset_ms': self.offset * 1000 if self.offset is not None else None,
+            'pings': self.pings,
+            'pongs': self.pongs,
+        }
+
+
+class FrameDecoder:
+    """Собирает кадры из потока TCP (склеенные и разрезанные сегменты)"""
+
+    def __init__(self):
+        self.buffer = bytearray()
+
+    def feed(self, data):
+        """Добавляет принятые байты, возвращает список готовых команд"""
+        # Обычно в буфере пусто и пришли целые кадры - разбираем без копирования
+        if self.buffer:
+            self.buffer += data
+            data = self.buffer
+
+        commands = []
+        offset = 0
+        size = len(data)
+        header_size = FRAME_HEADER.size
+
+        while size - offset >= header_size:
+            length, msg_type, flags, timestamp = FRAME_HEADER.unpack_from(data, offset)
+            if length > MAX_FRAME_BODY:
+                raise ProtocolError(f"Слишком большой кадр: {length} байт")
+            end = offset + header_size + length
+            if end > size:
+                break
+
+            if msg_type == MSG_KEY_PRESS and length == KEY_INDEX.size and not flags:
+                index = KEY_INDEX.unpack_from(data, offset + header_size)[0]
+                if index >= len(KEY_TABLE):
+                    raise ProtocolError(f"Неизвестный код клавиши: {index}")
+                command = {'type': 'key_press', 'key': KEY_TABLE[index], 'timestamp': timestamp}
+            else:
+                command = decode_frame(msg_type, flags, timestamp, data[offset + header_size:end])
+            if command is not None:
+                commands.append(command)
+            offset = end
+
+        if data is self.buffer:
+            del self.buffer[:offset]
+        elif offset < size:
+            self.buffer += data[offset:]
+        return commands
+
+
+def decode_frames(data):
+    """Разбирает датаграмму целиком (кадр не может продолжаться в следующей)"""
+    decoder = FrameDecoder()
+    commands = decoder.feed(data)
+    if decoder.buffer:
+        raise ProtocolError("Обрезанный кадр в датаграмме")
+    return commands
+
+
+class UdpSession:
+    """UDP-сессия клиента: подавление дублей и окно переупорядочивания"""
+
+    def __init__(self, session_id, address, first_seq):
+        self.session_id = session_id
+        self.address = address
+        self.expected = first_seq
+        self.pending = {}  # номер -> (время прихода, команды)
+        self.last_seen = time.monotonic()
+        self.heartbeat = Heartbeat(self.last_seen)
+        self.client = None  # Запись в NetworkServer.clients
+        self.received = 0
+        self.duplicates = 0
+        self.reordered = 0
+        self.lost = 0
+
+    def receive(self, seq, commands, now):
+        """Принимает датаграмму, возвращает команды, готовые к выполнению"""
+        self.last_seen = now
+        if seq < self.expected or seq in self.pending:
+            self.duplicates += 1
+            return []
+
+        self.received += 1
+        if seq != self.expected:
+            # Пришла раньше предыдущей - ждём дыру не дольше UDP_REORDER_TIMEOUT
+            self.pending[seq] = (now, commands)
+            if len(self.pending) > UDP_REORDER_WINDOW:
+                return self._skip_gap()
+            return []
+
+        self.expected += 1
+        if self.pending:
+            commands = commands + self._drain()
+        return commands
+
+    def _drain(self):
+        ready = []
+        while self.expected in self.pending:
+            _, commands = self.pending.pop(self.expected)
+            ready.extend(commands)
+            self.reordered += 1
+            self.expected += 1
+        return ready
+
+    def _skip_gap(self):
+        first = min(self.pending)
+        self.lost += first - self.expected
+        self.expected = first
+        return self._drain()
+
+    def next_deadline(self):
+        """Когда истекает ожидание пропущенной датаграммы (None - не ждём)"""
+        if not self.pending:
+            return None
+        return min(arrived for arrived, _ in self.pending.values()) + UDP_REORDER_TIMEOUT
+
+    def flush_expired(self, now):
+        """Перестаёт ждать пропущенные датаграммы, если окно истекло"""
+        deadline = self.next_deadline()
+        if deadline is None or deadline > now:
+            return []
+        return self._skip_gap()
+
+
+class CommandAggregator:
+    """Режим вечеринки: сводит команды многих клиентов в одно нажатие
+
+    Политика "first" ведёт окно на каждую комбинацию клавиш: первая
+    команда с ней нажимается сразу, повторы той же клавиши гасятся до
+    конца её окна, разные клавиши нажимаются по разу. "majority" и
+    "loudness" голосуют: первая команда открывает одно окно на window
+    секунд для всех клавиш, каждый клиент отдаёт один голос, в конце
+    окна нажимается одна клавиша - поддержанная больше чем половиной
+    голосовавших или с наибольшей суммарной громкостью. Без большинства
+    окно закрывается без нажатия. У каждого клиента свой token bucket на
+    rate_limit команд в секунду. Вызывается только из цикла событий сервера.
+    """
+
+    def __init__(self, executor, policy="first", window=PARTY_WINDOW,
+                 rate_limit=PARTY_RATE_LIMIT, burst=PARTY_BURST):
+        if policy not in PARTY_POLICIES:
+            raise ValueError(f"Неизвестная политика: {policy}")
+        self.executor = executor
+        self.policy = policy
+        self.window = window
+        self.rate_limit = rate_limit
+        self.burst = burst
+        self.buckets = {}  # источник -> [токены, время последнего пополнения]
+        self.windows = {}  # "first": клавиши -> (window_start, window_end)
+        self.votes = {}  # Голосование: клавиши -> голос
+        self.voters = set()  # Кто уже голосовал в текущем окне
+        self.window_start = None
+        self.window_end = None
+        self.received = 0
+        self.limited = 0
+        self.merged = 0
+        self.undecided = 0
+        self.executed = 0
+        self.total_latency = 0.0
+        self.max_latency = 0.0
+
+    def _allow(self, source, now):
+        if self.rate_limit <= 0:
+            return True
+        bucket = self.buckets.get(source)
+        if bucket is None:
+            bucket = self.buckets[source] = [float(self.burst), now]
+        tokens = min(float(self.burst), bucket[0] + (now - bucket[1]) * self.rate_limit)
+        bucket[1] = now
+        if tokens < 1.0:
+            bucket[0] = tokens
+            return False
+        bucket[0] = tokens - 1.0
+        return True
+
+    def forget(self, source):
+        """Клиент отключился - его лимит больше не нужен"""
+        self.buckets.pop(source, None)
+
+    def submit(self, source, command, now):
+        """Принимает команду клиента"""
+        if not self._allow(source, now):
+            self.limited += 1
+            return
+        self.received += 1
+
+        if self.policy == "first":
+            keys = command_keys(command).lower()
+            window = self.windows.get(keys)
+            if window is not None and now < window[1]:
+                self.merged += 1
+                return
+            self.windows[keys] = (now, now + self.window)
+            self._execute(command, now, now)
+            return
+
+        if self.window_end is not None and now >= self.window_end:
+            self.flush(now)
+        if self.window_end is None:
+            self.window_start = now
+            self.window_end = now + self.window
+        if source in self.voters:
+            self.merged += 1
+            return
+        self.voters.add(source)
+        keys = command_keys(command).lower()
+        vote = self.votes.get(keys)
+        if vote is None:
+            vote = self.votes[keys] = {'command': command, 'weight': 0.0, 'count': 0, 'first': now}
+        vote['count'] += 1
+        if self.policy == "loudness":
+            # Складываем амплитуды: вдвое громче (+6 дБ) - вдвое больший вес
+            vote['weight'] += 10 ** (command.get('level', PARTY_DEFAULT_LEVEL) / 20)
+        else:
+            vote['weight'] += 1.0
+
+    def next_deadline(self):
+        """Когда закрыть окно голосования (None - ждать нечего)"""
+        return self.window_end if self.votes else None
+
+    def flush(self, now):
+        """Закрывает истёкшие окна; в голосовании нажимает победителя"""
+        if self.windows:
+            expired = [keys for keys, window in self.windows.items() if now >= window[1]]
+            for keys in expired:
+                del self.windows[keys]
+        if self.window_end is None or now < self.window_end:
+            return
+        if self.votes:
+            # При равенстве побеждает то, что прислали раньше
+            winner = max(self.votes.values(), key=lambda v: (v['weight'], -v['first']))
+            if self.policy == "majority" and winner['count'] * 2 <= len(self.voters):
+                self.undecided += 1
+            else:
+                self.merged += len(self.voters) - 1
+                self._execute(winner['command'], self.window_start, now)
+            self.votes = {}
+            self.voters = set()
+        self.window_start = None
+        self.window_end = None
+
+    def _execute(self, command, window_start, now):
+        latency = now - window_start
+        self.executed += 1
+        self.total_latency += latency
+        self.max_latency = max(self.max_latency, latency)
+        self.executor(command)
+
+    def get_stats(self):
+        return {
+            'policy': self.policy,
+            'received': self.received,
+            'limited': self.limited,
+            'merged': self.merged,
+            'undecided': self.undecided,
+            'executed': self.executed,
+            'avg_latency_ms': self.total_latency / self.executed * 1000 if self.executed else 0.0,
+            'max_latency_ms': self.max_latency * 1000,
+        }
+
+
+def parse_receivers(text, port=PORT):
+    """Адреса получателей из строки 'ip[:порт], ip[:порт], ...'"""
+    receivers = []
+    for item in text.replace(';', ',').split(','):
+        item = item.strip()
+        if not item:
+            continue
+        host, sep, item_port = item.rpartition(':')
+        if not sep:
+            host, item_port = item, port
+        try:
+            item_port = int(item_port)
+        except ValueError:
+            raise ValueError(f"Неверный порт: '{item}'")
+        if host == "localhost":
+            host = "127.0.0.1"
+        if (host, item_port) not in receivers:
+            receivers.append((host, item_port))
+    if not receivers:
+        raise ValueError("Не указан ни один адрес")
+    return receivers
+
+
+class ReceiverLink:
+    """Соединение клиента с одним получателем (Игроком 1)
+
+    Сокет неблокирующий: то, что не влезло в буфер ядра, копится в
+    pending и дописывается потоком клиента. Медленный или пропавший
+    получатель не тормозит остальных: канал рвётся и переподключается
+    в фоне, а команды на время обрыва ждут в коротком окне outbox.
+
+    Состояния: "up" - на связи, "connecting" - идёт попытка, "failed" -
+    только что оборвался, "down" - ждёт следующей попытки.
+    """
+
+    def __init__(self, address, transport, sock, redundancy=1, sockaddr=None):
+        self.address = address
+        self.sockaddr = sockaddr or address  # Разрешённый один раз адрес для переподключений
+        self.transport = transport
+        self.socket = sock
+        self.redundancy = redundancy
+        self.state = "up" if sock is not None else "down"
+        self.alive = sock is not None
+        self.error = ""
+        self.sent = 0
+        self.dropped = 0
+        self.attempts = 0
+        self.retry_at = None
+        self.connect_deadline = None
+        self.down_since = None
+        self.last_outage = None
+        self.reconnects = 0
+        self.outbox = collections.deque()  # (время, кадр) - команды во время обрыва
+        self.replayed = 0
+        self.expired = 0
+        self._reset_session()
+
+    def _reset_session(self):
+        self.session_id = int.from_bytes(os.urandom(4), "big")
+        self.seq = 0
+        self.pending = bytearray()
+        self.pending_since = None
+        self.heartbeat = Heartbeat()
+        self.decoder = FrameDecoder()  # Пинги и понги от получателя (TCP)
+
+    @property
+    def label(self):
+        return f"{self.address[0]}:{self.address[1]}"
+
+    def fail(self, error):
+        if self.state == "up":
+            print(f"Получатель {self.label} отключён: {error}")
+            self.down_since = time.monotonic()
+        if self.state != "down":
+            self.state = "failed"
+        self.alive = False
+        self.error = error
+
+    def next_deadline(self):
+        """Когда потоку клиента пора заняться каналом"""
+        if self.state == "down":
+            return self.retry_at
+        if self.state == "connecting":
+            return self.connect_deadline
+        if self.state == "failed":
+            return 0.0
+        return self.heartbeat.next_deadline()
+
+    def schedule_retry(self, now):
+        """Закрывает сокет; следующая попытка - через экспоненциальную паузу с разбросом"""
+        self.close()
+        self.socket = None
+        self.state = "down"
+        if self.down_since is None:
+            self.down_since = now
+        delay = min(RECONNECT_MAX_DELAY, RECONNECT_BASE_DELAY * 2 ** self.attempts)
+        # Разброс не даёт толпе клиентов ломиться на перезапущенный сервер разом
+        self.retry_at = now + random.uniform(delay / 2, delay)
+        self.attempts += 1
+
+    def reconnect(self, now):
+        """Начинает попытку: TCP - неблокирующий connect, UDP - пинг до первого понга"""
+        self._reset_session()
+        self.state = "connecting"
+        self.connect_deadline = now + CONNECT_TIMEOUT
+        try:
+            if self.transport == "udp":
+                self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+                self.socket.connect(self.sockaddr)
+                self.socket.setblocking(False)
+                self.connect_deadline = now + HEARTBEAT_TIMEOUT
+                self.socket.send(UDP_HEADER.pack(self.session_id, 0) + encode_ping())
+                return
+            self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            self.socket.setblocking(False)
+            code = self.socket.connect_ex(self.sockaddr)
+            if code not in (0, errno.EINPROGRESS, errno.EWOULDBLOCK):
+                self.fail(os.strerror(code))
+        except (BlockingIOError, InterruptedError):
+            pass
+        except OSError as e:
+            self.fail(str(e))
+
+    def finish_connect(self, now):
+        """TCP: сокет стал доступен на запись - узнаём, чем кончился connect"""
+        code = self.socket.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR)
+        if code:
+            self.fail(os.strerror(code))
+            return
+        self.socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.mark_up(now)
+
+    def mark_up(self, now):
+        """Канал снова на связи: досылает команды из окна, если они не устарели"""
+        self.state = "up"
+        self.alive = True
+        self.error = ""
+        self.attempts = 0
+        if self.down_since is not None:
+            self.reconnects += 1
+            self.last_outage = now - self.down_since
+            print(f"Получатель {self.label} снова на связи (обрыв {self.last_outage:.2f} с)")
+        self.down_since = None
+        self.expire(now)
+        held, self.outbox = self.outbox, collections.deque()
+        for _, frame in held:
+            self.send(frame, now)
+            self.replayed += 1
+
+    def hold(self, frame, now):
+        """Команда во время обрыва: окно ограничено и по числу, и по возрасту"""
+        self.expire(now)
+        if len(self.outbox) >= RECONNECT_BUFFER:
+            self.outbox.popleft()
+            self.expired += 1
+        self.outbox.append((now, frame))
+
+    def expire(self, now):
+        # Нажатие, запоздавшее больше чем на RECONNECT_FRESHNESS, уже не нужно
+        while self.outbox and now - self.outbox[0][0] > RECONNECT_FRESHNESS:
+            self.outbox.popleft()
+            self.expired += 1
+
+    def send(self, frame, now):
+        """Отправляет кадр без блокировки; True - остался хвост для потока"""
+        if not self.alive:
+            return False
+        if self.transport == "tcp":
+            return self._write(frame, now, count=1)
+        try:
+            self.seq += 1
+            datagram = UDP_HEADER.pack(self.session_id, self.seq) + frame
+            for _ in range(self.redundancy):
+                self.socket.send(datagram)
+            self.sent += 1
+        except (BlockingIOError, InterruptedError):
+            # Буфер ядра полон - датаграмму теряем, как потерю в сети
+            self.dropped += 1
+        except OSError as e:
+            self.fail(str(e))
+        return False
+
+    def send_control(self, frame, now):
+        """Служебный кадр пульса: по UDP - вне нумерации и без дублей"""
+        if not self.alive:
+            return False
+        if self.transport == "tcp":
+            return self._write(frame, now)
+        try:
+            self.socket.send(UDP_HEADER.pack(self.session_id, 0) + frame)
+        except (BlockingIOError, InterruptedError):
+            pass
+        except OSError as e:
+            self.fail(str(e))
+        return False
+
+    def _write(self, frame, now, count=0):
+        """TCP: пишет кадр вслед за хвостом; count - учитывать ли как команду"""
+        try:
+            if self.pending:
+                # Очередь уже есть - порядок кадров важнее скорости
+                if len(self.pending) + len(frame) > RECEIVER_PENDING_LIMIT:
+                    self.dropped += count
+                    self.fail("не успевает принимать команды")
+                    return False
+                self.pending += frame
+                self.sent += count
+                return True
+
+            try:
+                sent = self.socket.send(frame)
+            except (BlockingIOError, InterruptedError):
+                sent = 0
+            self.sent += count
+            if sent < len(frame):
+                self.pending += frame[sent:]
+                self.pending_since = now
+                return True
+            return False
+        except OSError as e:
+            self.fail(str(e))
+            return False
+
+    def flush(self, now):
+        """Дописывает хвост (поток клиента); True - ещё не всё ушло"""
+        try:
+            sent = self.socket.send(self.pending)
+        except (BlockingIOError, InterruptedError):
+            sent = 0
+        except OSError as e:
+            self.fail(str(e))
+            return False
+        del self.pending[:sent]
+        if not self.pending:
+            self.pending_since = None
+            return False
+        if sent:
+            self.pending_since = now
+        return True
+
+    def close(self):
+        try:
+            self.socket.close()
+        except:
+            pass
+
+
+class NetworkClient:
+    """Игрок который орет в микрофон - подключается к одному или нескольким серверам
+
+    Оборванные каналы переподключает поток клиента (см. ReceiverLink),
+    так что is_connected держится до явного disconnect().
+    """
+
+    def __init__(self, port=PORT):
+        self.links = []
+        self.is_connected = False
+        self.receive_thread = None
+        self.server_address = ""
+        self.port = port
+        self.transport = "tcp"
+        self.redundancy = UDP_REDUNDANCY
+        self.last_error = ""
+        self.lock = threading.Lock()
+        self.selector = None
+        self._wakeup_recv = None
+        self._wakeup_send = None
+
+    def connect_to_server(self, server_ip, transport="tcp", redundancy=UDP_REDUNDANCY):
+        """Подключается ко всем адресам из server_ip ('ip[:порт], ...')
+
+        Возвращается, как только ответил первый получатель; не успевшие
+        подключаются дальше в потоке клиента, про отказавших - в last_error,
+        к ним поток клиента продолжит подключаться в фоне.
+        """
+        self.disconnect()
+        try:
+            receivers = parse_receivers(server_ip, self.port)
+        except ValueError as e:
+            self.last_error = f"Ошибка адреса: {e}"
+            print(self.last_error)
+            return False
+
+        self.transport = transport
+        self.redundancy = max(1, int(redundancy))
+        resolved, errors = self._resolve(receivers)
+        if transport == "udp":
+            links, failed = self._open_udp(resolved)
+        else:
+            links, failed = self._open_tcp(resolved)
+        self.last_error = "; ".join(f"Ошибка подключения к {host}:{port}: {e}"
+                                    for (host, port), e in errors + failed)
+        for (host, port), e in errors + failed:
+            print(f"Ошибка подключения к {host}:{port}: {e}")
+        if not links:
+            return False
+
+        # Не ответившие сразу ждут переподключения наравне с оборвавшимися
+        now = time.monotonic()
+        for address, e in failed:
+            link = ReceiverLink(address, transport, None, self.redundancy, resolved[address])
+            link.error = str(e)
+            link.schedule_retry(now)
+            links.append(link)
+        links.sort(key=lambda link: receivers.index(link.address))
+
+        self.links = links
+        self.selector = selectors.DefaultSelector()
+        self._wakeup_recv, self._wakeup_send = socket.socketpair()
+        self._wakeup_recv.setblocking(False)
+        self.selector.register(self._wakeup_recv, selectors.EVENT_READ)
+        for link in links:
+            if link.socket is None:
+                continue
+            if link.state == "connecting":
+                # Подключение ещё идёт: доведёт поток клиента
+                self.selector.register(link.socket, selectors.EVENT_WRITE, link)
+                continue
+            # Чтение нужно, чтобы заметить закрытое получателем соединение
+            self.selector.register(link.socket, selectors.EVENT_READ, link)
+            if transport == "udp":
+                link.send(encode_hello(), now)
+        self._update_address()
+
+        self.is_connected = True
+        self.receive_thread = threading.Thread(target=self._io_loop)
+        self.receive_thread.daemon = True
+        self.receive_thread.start()
+
+        print(f"Подключено к {self.server_address} ({transport.upper()})")
+        return True
+
+    def _resolve(self, receivers):
+        """Адрес -> sockaddr; разрешается один раз, переподключения в DNS не ходят"""
+        resolved = {}
+        errors = []
+        for host, port in receivers:
+            try:
+                infos = socket.getaddrinfo(host, port, socket.AF_INET, socket.SOCK_STREAM)
+                resolved[(host, port)] = infos[0][4]
+            except OSError as e:
+                errors.append(((host, port), e))
+        return resolved, errors
+
+    def _open_udp(self, resolved):
+        links, errors = [], []
+        for address, sockaddr in resolved.items():
+            try:
+                sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+                sock.connect(sockaddr)
+                sock.setblocking(False)
+                links.append(ReceiverLink(address, "udp", sock, self.redundancy, sockaddr))
+            except OSError as e:
+                errors.append((address, e))
+        return links, errors
+
+    def _open_tcp(self, resolved):
+        """Подключается ко всем сразу и ждёт только первого ответившего
+
+        Остальные подключения не ждём: они уходят каналами в состоянии
+        "connecting", и их доводит (или переподключает) поток клиента,
+        так что недоступный адрес не держит поток интерфейса.
+        """
+        pending = {}
+        errors = []
+        selector = selectors.DefaultSelector()
+        for address, sockaddr in resolved.items():
+            sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            sock.setblocking(False)
+            code = sock.connect_ex(sockaddr)
+            if code not in (0, errno.EINPROGRESS, errno.EWOULDBLOCK):
+                errors.append((address, os.strerror(code)))
+                sock.close()
+                continue
+            pending[sock] = address
+            selector.register(sock, selectors.EVENT_WRITE)
+
+        links = []
+        deadline = time.monotonic() + CONNECT_TIMEOUT
+        while pending and not links:
+            timeout = deadline - time.monotonic()
+            events = selector.select(timeout) if timeout > 0 else []
+            if not events:
+                break
+            for key, _ in events:
+                sock = key.fileobj
+                address = pending.pop(sock)
+                selector.unregister(sock)
+                code = sock.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR)
+                if code:
+                    errors.append((address, os.strerror(code)))
+                    sock.close()
+                    continue
+                # Команды крошечные: отправляем сразу, без алгоритма Нейгла
+                sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+                links.append(ReceiverLink(address, "tcp", sock, sockaddr=resolved[address]))
+        selector.close()
+
+        for sock, address in pending.items():
+            if not links:
+                errors.append((address, "таймаут подключения"))
+                sock.close()
+                continue
+            link = ReceiverLink(address, "tcp", None, sockaddr=resolved[address])
+            link.socket = sock
+            link.state = "connecting"
+            link.connect_deadline = deadline
+            links.append(link)
+        return links, errors
+
+    def send_key_press(self, key_data):
+        """Рассылает команду всем живым получателям, не дожидаясь медленных
+
+        Оборвавшимся команда достанется после переподключения, если ещё
+        не устареет; False - её не получит и не ждёт никто.
+        """
+        if not self.is_connected:
+            return False
+
+        frame = encode_command(key_data)
+        now = time.monotonic()
+        delivered = False
+        wake = False
+        with self.lock:
+            for link in self.links:
+                if link.send(frame, now):
+                    wake = True
+                if link.alive:
+                    delivered = True
+                    continue
+                link.hold(frame, now)
+                delivered = True
+                if link.state == "failed":
+                    wake = True
+        if wake:
+            # Хвосты и отключения обрабатывает поток клиента
+            self._wakeup()
+        return delivered
+
+    def is_online(self):
+        """Есть ли сейчас хоть один получатель на связи"""
+        with self.lock:
+            return any(link.alive for link in self.links)
+
+    def get_receivers(self):
+        """Состояние каждого получателя для интерфейса"""
+        now = time.monotonic()
+        with self.lock:
+            return [{
+                'address': link.label,
+                'transport': link.transport,
+                'alive': link.alive,
+                'state': link.state,
+                'pending': len(link.pending),
+                'sent': link.sent,
+                'dropped': link.dropped,
+                'error': link.error,
+                'attempts': link.attempts,
+                'retry_in': max(0.0, link.retry_at - now) if link.state == "down" else None,
+                'reconnects': link.reconnects,
+                'last_outage_ms': link.last_outage * 1000 if link.last_outage is not None else None,
+                'held': len(link.outbox),
+                'replayed': link.replayed,
+                'expired': link.expired,
+                **link.heartbeat.get_stats(),
+            } for link in self.links]
+
+    def _wakeup(self):
+        try:
+            self._wakeup_send.send(b'\0')
+        except (AttributeError, OSError):
+            pass
+
+    def _io_loop(self):
+        """Поток клиента: дописывает хвосты, пингует получателей, переподключает оборвавшихся"""
+        while self.is_connected:
+            # Спим до события или ближайшего дела по каналам; с хвостами - ещё и проверяем таймаут
+            with self.lock:
+                deadlines = [link.next_deadline() for link in self.links]
+                if any(link.pending for link in self.links):
+                    deadlines.append(time.monotonic() + SLOW_RECEIVER_TIMEOUT / 4)
+            timeout = max(0.0, min(deadlines) - time.monotonic()) if deadlines else None
+            try:
+                events = self.selector.select(timeout)
+            except (OSError, ValueError):
+                break
+
+            now = time.monotonic()
+            with self.lock:
+                for key, mask in events:
+                    link = key.data
+                    if link is None:
+                        try:
+                            while self._wakeup_recv.recv(4096):
+                                pass
+                        except (BlockingIOError, InterruptedError):
+                            pass
+                        continue
+                    if link.state == "connecting" and link.transport == "tcp":
+                        link.finish_connect(now)
+                        continue
+                    if mask & selectors.EVENT_READ:
+                        self._read_link(link)
+                    if mask & selectors.EVENT_WRITE and link.alive:
+                        link.flush(now)
+
+                self._check_links(now)
+                self._update_links(now)
+
+    def _check_links(self, now):
+        """Таймауты, пинги и попытки переподключения"""
+        for link in self.links:
+            if link.state == "up":
+                if link.pending and now - link.pending_since > SLOW_RECEIVER_TIMEOUT:
+                    link.fail("не забирает данные")
+                elif link.heartbeat.is_dead(now):
+                    link.fail("не отвечает на пинг")
+                elif link.heartbeat.ping_due(now):
+                    link.send_control(encode_ping(), now)
+            elif link.state == "connecting":
+                if now > link.connect_deadline:
+                    link.fail("таймаут подключения")
+            elif link.state == "down":
+                link.expire(now)
+                if now >= link.retry_at:
+                    link.reconnect(now)
+
+    def _read_link(self, link):
+        """Принимает пульс получателя: на пинг отвечает, понг учитывает"""
+        while link.state in ("up", "connecting"):
+            try:
+                data = link.socket.recv(4096)
+                received = time.time()
+            except (BlockingIOError, InterruptedError):
+                return
+            except OSError as e:
+                link.fail(str(e))
+                return
+
+            try:
+                if link.transport == "tcp":
+                    if not data:
+                        link.fail("соединение закрыто")
+                        return
+                    frames = link.decoder.feed(data)
+                elif len(data) >= UDP_HEADER.size:
+                    frames = decode_frames(data[UDP_HEADER.size:])
+                else:
+                    continue
+            except ProtocolError as e:
+                link.fail(f"ошибка протокола: {e}")
+                return
+
+            now = time.monotonic()
+            link.heartbeat.heard(now)
+            for frame in frames:
+                if frame['type'] == 'ping':
+                    link.heartbeat.on_ping()
+                    link.send_control(encode_pong(frame, received), now)
+                elif frame['type'] == 'pong':
+                    link.heartbeat.on_pong(frame, received)
+                    if link.state == "connecting":
+                        # UDP: ответ на пинг - единственный признак, что сервер вернулся
+                        link.mark_up(now)
+
+    def _update_links(self, now):
+        """Уводит оборвавшиеся каналы на переподключение и следит за событиями сокетов"""
+        for link in self.links:
+            if link.state == "failed":
+                if link.socket is not None:
+                    try:
+                        self.selector.unregister(link.socket)
+                    except (KeyError, ValueError):
+                        pass
+                link.schedule_retry(now)
+
+        for link in self.links:
+            if link.socket is None:
+                continue
+            if link.state == "connecting" and link.transport == "tcp":
+                events = selectors.EVENT_WRITE
+            else:
+                events = selectors.EVENT_READ
+                if link.pending:
+                    events |= selectors.EVENT_WRITE
+            try:
+                key = self.selector.get_key(link.socket)
+            except KeyError:
+                self.selector.register(link.socket, events, link)
+                continue
+            if key.events != events:
+                self.selector.modify(link.socket, events, link)
+
+        self._update_address()
+
+    def _update_address(self):
+        online = [link.label for link in self.links if link.alive]
+        self.server_address = ", ".join(online) if online else "переподключение..."
+
+    def disconnect(self):
+        self.is_connected = False
+        self._wakeup()
+        if self.receive_thread is not None and self.receive_thread is not threading.current_thread():
+            self.receive_thread.join(timeout=1.0)
+        self.receive_thread = None
+
+        with self.lock:
+            for link in self.links:
+                link.close()
+            self.links = []
+        for obj in (self.selector, self._wakeup_recv, self._wakeup_send):
+            if obj is not None:
+                try:
+                    obj.close()
+                except:
+                    pass
+        self.selector = None
+        self._wakeup_recv = None
+        self._wakeup_send = None
+
+
+class NetworkServer:
+    """Игрок который получает нажатия - запускает сервер"""
+
+    def __init__(self, executor=None, port=PORT):
+        self.server_socket = None
+        self.clients = []
+        self.is_running = False
+        self.server_thread = None
+        self.lock = threading.Lock()
+        self.local_ip = "127.0.0.1"
+        self.port = port
+        self.tracer = LatencyTracer()
+        self.injector = InjectionWorker(executor, tracer=self.tracer)
+        self.aggregator = None  # CommandAggregator в режиме вечеринки
+        self.holders = {}  # зажатые клавиши ('shift+w') -> сколько клиентов их держат
+        self.selector = None
+        self.udp_socket = None
+        self.udp_sessions = {}
+        self._wakeup_recv = None
+        self._wakeup_send = None
+        self.last_error = ""
+
+    def get_local_ip(self):
+        """Получение локального IP адреса"""
+        try:
+            # Простой способ получить IP
+            s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            s.connect(("8.8.8.8", 80))
+            ip_address = s.getsockname()[0]
+            s.close()
+            self.local_ip = ip_address
+            return ip_address
+        except:
+            try:
+                hostname = socket.gethostname()
+                ip_address = socket.gethostbyname(hostname)
+                self.local_ip = ip_address
+                return ip_address
+            except:
+                self.local_ip = "127.0.0.1"
+                return "127.0.0.1"
+
+    def start_server(self):
+        try:
+            self.server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            self.server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            self.server_socket.bind(('0.0.0.0', self.port))  # Слушаем все интерфейсы
+            self.server_socket.listen(SERVER_BACKLOG)
+            self.server_socket.setblocking(False)
+
+            # UDP-режим слушаем на том же порту
+            self.udp_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            self.udp_socket.bind(('0.0.0.0', self.port))
+            self.udp_socket.setblocking(False)
+            self.udp_sessions = {}
+
+            # Один цикл событий на accept и чтение всех клиентов
+            self.selector = selectors.DefaultSelector()
+            self.selector.register(self.server_socket, selectors.EVENT_READ)
+            self.selector.register(self.udp_socket, selectors.EVENT_READ)
+
+            # Пара сокетов, чтобы разбудить цикл при остановке/обновлении
+            self._wakeup_recv, self._wakeup_send = socket.socketpair()
+            self._wakeup_recv.setblocking(False)
+            self.selector.register(self._wakeup_recv, selectors.EVENT_READ)
+
+            self.is_running = True
+
+            # Бэкенд нажатий выбираем заранее, а не на первой команде
+            if platform.system() == "Linux":
+                KeyPresser.get_backend()
+            self.injector.reset_stats()
+            self.injector.start()
+
+            # Запускаем поток обработки команд
+            self.server_thread = threading.Thread(target=self.process_commands)
+            self.server_thread.daemon = True
+            self.server_thread.start()
+
+            return True
+        except Exception as e:
+            self.last_error = f"Ошибка запуска сервера: {e}"
+            print(self.last_error)
+            self._close_sockets()
+            return False
+
+    def process_commands(self):
+        """Цикл событий: просыпается, только когда сокет готов к чтению"""
+        while self.is_running:
+            try:
+                events = self.selector.select(self._next_timeout())
+            except (OSError, ValueError):
+                break
+
+            for key, _ in events:
+                if key.fileobj is self.server_socket:
+                    self._accept_clients()
+                elif key.fileobj is self.udp_socket:
+                    self._read_datagrams()
+                elif key.fileobj is self._wakeup_recv:
+                    self._drain_wakeup()
+                else:
+                    self._read_client(key.data)
+
+            if self.udp_sessions:
+                self._expire_udp()
+            self._heartbeat(time.monotonic())
+            aggregator = self.aggregator
+            if aggregator is not None:
+                aggregator.flush(time.monotonic())
+            self._remove_disconnected()
+
+    def configure_party(self, policy=None, window=PARTY_WINDOW, rate_limit=PARTY_RATE_LIMIT,
+                        burst=PARTY_BURST):
+        """Включает режим вечеринки (policy из PARTY_POLICIES) или выключает (None)"""
+        aggregator = self.aggregator
+        if policy is None:
+            self.aggregator = None
+        elif (aggregator is None or aggregator.policy != policy or aggregator.window != window
+              or aggregator.rate_limit != rate_limit or aggregator.burst != burst):
+            self.aggregator = CommandAggregator(self.injector.submit, policy, window, rate_limit, burst)
+        # Цикл должен пересчитать таймаут под новое окно
+        self._wakeup()
+
+    def get_party_stats(self):
+        aggregator = self.aggregator
+        return aggregator.get_stats() if aggregator is not None else None
+
+    def _dispatch(self, client, command, now, trace=None):
+        """Команда клиента -> очередь нажатий (или голосование в режиме вечеринки)"""
+        if command['type'] in ('key_down', 'key_up'):
+            # Удержание в голосовании не участвует: отпускание нельзя проглотить
+            self._hold(client, command, trace)
+            return
+        aggregator = self.aggregator
+        if aggregator is None:
+            self.injector.submit(command, trace)
+        else:
+            aggregator.submit(client['address'], command, now)
+
+    def _hold(self, client, command, trace=None):
+        """Зажатие/отпускание клиента; на машине клавиша зажата, пока её держит хоть один"""
+        name = command_keys(command).lower()
+        if command['type'] == 'key_down':
+            if name in client['held']:
+                return  # Повтор (дубликат UDP или досылка после обрыва)
+            client['held'][name] = command['keys']
+            self.holders[name] = self.holders.get(name, 0) + 1
+            if self.holders[name] == 1:
+                self.injector.submit(command, trace)
+        elif client['held'].pop(name, None) is not None:
+            self._release(name, command, trace)
+
+    def _release(self, name, command, trace=None):
+        count = self.holders.get(name, 0) - 1
+        if count > 0:
+            self.holders[name] = count
+            return
+        self.holders.pop(name, None)
+        self.injector.submit(command, trace)
+
+    def _release_client(self, client, reason):
+        """Отпускает всё, что держит клиент (отключение или молчание)"""
+        if not client['held']:
+            return
+        print(f"Клиент {client['address'][0]}:{client['address'][1]} {reason}, "
+              f"отпускаем: {', '.join(client['held'])}")
+        for name, keys in client['held'].items():
+            self._release(name, {'type': 'key_up', 'keys': keys, 'timestamp': time.time()})
+        client['held'] = {}
+
+    @staticmethod
+    def _trace(command, received, decoded, heartbeat=None):
+        trace = {'decode': decoded - received}
+        if command.get('timestamp'):
+            # С известным смещением часов клиента - честная задержка в одну сторону
+            if heartbeat is not None:
+                trace['network'] = heartbeat.one_way(command['timestamp'], received)
+            else:
+                trace['network'] = received - command['timestamp']
+        return trace
+
+    def _handle_heartbeat(self, client, frames, received, now):
+        """Отвечает на пинги и учитывает понги; возвращает остальные команды"""
+        heartbeat = client['heartbeat']
+        heartbeat.heard(now)
+        commands = []
+        for frame in frames:
+            if frame['type'] == 'ping':
+                heartbeat.on_ping()
+                self._send_control(client, encode_pong(frame, received))
+            elif frame['type'] == 'pong':
+                heartbeat.on_pong(frame, received)
+            else:
+                commands.append(frame)
+        return commands
+
+    def _send_control(self, client, frame):
+        """Кадр пульса клиенту; не ушёл в буфер ядра - значит, клиент не читает"""
+        try:
+            if client['socket'] is None:
+                session = client['session']
+                self.udp_socket.sendto(UDP_HEADER.pack(session.session_id, 0) + frame, session.address)
+                return
+            sent = client['socket'].send(frame)
+        except (BlockingIOError, InterruptedError):
+            sent = 0
+        except OSError as e:
+            print(f"Ошибка отправки пульса {client['address'][0]}: {e}")
+            client['connected'] = False
+            return
+        if client['socket'] is not None and sent < len(frame):
+            # Обрезанный кадр сломал бы поток - такого клиента отключаем
+            print(f"Клиент {client['address'][0]}:{client['address'][1]} не забирает данные")
+            client['connected'] = False
+
+    def _heartbeat(self, now):
+        """Пингует клиентов, знающих пульс, и отключает замолчавших"""
+        with self.lock:
+            holding = [c for c in self.clients if c['connected'] and c['held']]
+            clients = [c for c in self.clients if c['connected'] and c['heartbeat'].capable]
+        for client in holding:
+            # Отпускание могло потеряться вместе со связью - не ждём отключения
+            if now - client['heartbeat'].last_heard > HOLD_TIMEOUT:
+                self._release_client(client, "молчит")
+        for client in clients:
+            heartbeat = client['heartbeat']
+            if heartbeat.is_dead(now):
+                print(f"Клиент {client['address'][0]}:{client['address'][1]} не отвечает на пинг")
+                client['connected'] = False
+                if client['socket'] is None:
+                    self.udp_sessions.pop(client['session'].session_id, None)
+            elif heartbeat.ping_due(now):
+                self._send_control(client, encode_ping())
+
+    def _next_timeout(self):
+        """Сколько спать до ближайшего дедлайна UDP, пульса, удержания или окна голосования (None - до события)"""
+        aggregator = self.aggregator
+        party_deadline = aggregator.next_deadline() if aggregator is not None else None
+        with self.lock:
+            heartbeats = [c['heartbeat'] for c in self.clients if c['connected'] and c['heartbeat'].capable]
+            holds = [c['heartbeat'].last_heard + HOLD_TIMEOUT for c in self.clients if c['connected'] and c['held']]
+        if not self.udp_sessions and party_deadline is None and not heartbeats and not holds:
+            return None
+        now = time.monotonic()
+        deadlines = [d for d in (s.next_deadline() for s in self.udp_sessions.values()) if d is not None]
+        deadlines.extend(heartbeat.next_deadline() for heartbeat in heartbeats)
+        deadlines.extend(holds)
+        if party_deadline is not None:
+            deadlines.append(party_deadline)
+        # Раз в секунду проверяем простаивающие сессии
+        timeout = min(deadlines) - now if deadlines else 1.0
+        return max(0.0, min(timeout, 1.0))
+
+    def _read_datagrams(self):
+        now = time.monotonic()
+        while True:
+            try:
+                data, addr = self.udp_socket.recvfrom(4096)
+            except (BlockingIOError, InterruptedError):
+                return
+            except OSError as e:
+                print(f"Ошибка получения UDP: {e}")
+                return
+
+            if len(data) < UDP_HEADER.size:
+                continue
+            received = time.time()
+            session_id, seq = UDP_HEADER.unpack_from(data)
+            try:
+                commands = decode_frames(data[UDP_HEADER.size:])
+                decoded = time.time()
+            except ProtocolError as e:
+                print(f"Ошибка протокола UDP от {addr[0]}: {e}")
+                continue
+
+            session = self.udp_sessions.get(session_id)
+            if session is None:
+                # Пульс (номер 0) идёт вне нумерации, команды клиента начинаются с 1
+                session = UdpSession(session_id, addr, seq or 1)
+                self.udp_sessions[session_id] = session
+                client = {
+                    'socket': None,
+                    'address': addr,
+                    'connected': True,
+                    'transport': 'udp',
+                    'session': session,
+                    'heartbeat': session.heartbeat,
+                    'held': {}
+                }
+                session.client = client
+                with self.lock:
+                    self.clients.append(client)
+                print(f"Новая UDP-сессия от {addr[0]}:{addr[1]}")
+
+            commands = self._handle_heartbeat(session.client, commands, received, now)
+            if seq == 0:
+                session.last_seen = now
+                continue
+            for command in session.receive(seq, commands, now):
+                if command['type'] != 'hello':
+                    self._dispatch(session.client, command, now,
+                                   self._trace(command, received, decoded, session.heartbeat))
+
+    def _expire_udp(self):
+        now = time.monotonic()
+        for session in self.udp_sessions.values():
+            for command in session.flush_expired(now):
+                if command['type'] != 'hello':
+                    self._dispatch(session.client, command, now)
+
+        expired = [sid for sid, session in self.udp_sessions.items()
+                   if now - session.last_seen > UDP_SESSION_TIMEOUT]
+        if not expired:
+            return
+        for sid in expired:
+            del self.udp_sessions[sid]
+        with self.lock:
+            for client in self.clients:
+                if client.get('session') is not None and client['session'].session_id in expired:
+                    client['connected'] = False
+
+    def _accept_clients(self):
+        # Забираем всех ожидающих клиентов за одно пробуждение
+        while True:
+            try:
+                client_socket, addr = self.server_socket.accept()
+            except (BlockingIOError, InterruptedError):
+                return
+            except OSError:
+                if self.is_running:
+                    print("Ошибка accept клиента")
+                return
+
+            client_socket.setblocking(False)
+            client_socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            client = {
+                'socket': client_socket,
+                'address': addr,
+                'connected': True,
+                'transport': 'tcp',
+                'decoder': FrameDecoder(),
+                'heartbeat': Heartbeat(),
+                'held': {}
+            }
+            self.selector.register(client_socket, selectors.EVENT_READ, client)
+            with self.lock:
+                self.clients.append(client)
+            print(f"Новое подключение от {addr[0]}:{addr[1]}")
+
+    def _drain_wakeup(self):
+        try:
+            while self._wakeup_recv.recv(4096):
+                pass
+        except (BlockingIOError, InterruptedError):
+            pass
+
+    def _wakeup(self):
+        try:
+            self._wakeup_send.send(b'\0')
+        except (AttributeError, OSError):
+            pass
+
+    def _read_client(self, client):
+        try:
+            data = client['socket'].recv(4096)
+            received = time.time()
+        except (BlockingIOError, InterruptedError):
+            return
+        except Exception as e:
+            print(f"Ошибка получения данных: {e}")
+            client['connected'] = False
+            return
+
+        if not data:
+            print(f"Клиент {client['address'][0]}:{client['address'][1]} отключился")
+            client['connected'] = False
+            return
+
+        try:
+            commands = client['decoder'].feed(data)
+            decoded = time.time()
+        except Exception as e:
+            # После битого кадра границы потока потеряны - отключаем клиента
+            print(f"Ошибка протокола от {client['address'][0]}: {e}")
+            client['connected'] = False
+            return
+
+        now = time.monotonic()
+        for command in self._handle_heartbeat(client, commands, received, now):
+            # Нажатие выполнит поток инъекции
+            self._dispatch(client, command, now,
+                           self._trace(command, received, decoded, client['heartbeat']))
+
+    def _remove_disconnected(self):
+        """Удаляет отключенных клиентов (вызывается только из цикла событий)"""
+        with self.lock:
+            disconnected = [c for c in self.clients if not c['connected']]
+            if not disconnected:
+                return
+            self.clients = [c for c in self.clients if c['connected']]
+
+        aggregator = self.aggregator
+        for client in disconnected:
+            self._release_client(client, "отключился")
+            if aggregator is not None:
+                aggregator.forget(client['address'])
+            if client['socket'] is None:
+                continue
+            try:
+                self.selector.unregister(client['socket'])
+            except (KeyError, ValueError):
+                pass
+            try:
+                client['socket'].close()
+            except:
+                pass
+
+    def get_connected_clients(self):
+        """Возвращает список подключенных клиентов"""
+        with self.lock:
+            return [c for c in self.clients if c['connected']]
+
+    def get_link_stats(self):
+        """Качество связи с каждым клиентом (RTT, джиттер, смещение часов)"""
+        with self.lock:
+            return [{
+                'address': f"{c['address'][0]}:{c['address'][1]}",
+                'transport': c['transport'],
+                'heartbeat': c['heartbeat'].capable,
+                'held': list(c['held']),
+                **c['heartbeat'].get_stats(),
+            } for c in self.clients if c['connected']]
+
+    def refresh_connection(self):
+        """Пингует клиентов немедленно, не дожидаясь очередного интервала"""
+        with self.lock:
+            for client in self.clients:
+                client['heartbeat'].next_ping = 0.0
+
+        # Пинги отправит и замолчавших отключит цикл событий
+        self._wakeup()
+
+    def get_injection_stats(self):
+        """Счётчики очереди нажатий"""
+        return self.injector.get_stats()
+
+    def get_held_keys(self):
+        """Зажатые сейчас клавиши -> сколько клиентов их держат"""
+        return dict(self.holders)
+
+    def stop_server(self):
+        self.is_running = False
+        self._wakeup()
+        if self.server_thread is not None:
+            self.server_thread.join(timeout=1.0)
+            self.server_thread = None
+        self.injector.stop()
+        # Отпускания из очереди выполнил injector.stop; что ещё держат клиенты - отпускаем напрямую
+        with self.lock:
+            held = {name: keys for c in self.clients for name, keys in c['held'].items()}
+        for keys in held.values():
+            try:
+                self.injector.executor({'type': 'key_up', 'keys': keys, 'timestamp': time.time()})
+            except Exception as e:
+                print(f"Не удалось отпустить {'+'.join(keys)}: {e}")
+        self.holders = {}
+
+        with self.lock:
+            for client in self.clients:
+                try:
+                    if client['socket'] is not None:
+                        client['socket'].close()
+                except:
+                    pass
+            self.clients.clear()
+        self.udp_sessions = {}
+
+        self._close_sockets()
+
+    def _close_sockets(self):
+        if self.selector is not None:
+            try:
+                self.selector.close()
+            except:
+                pass
+            self.selector = None
+
+        for name in ('server_socket', 'udp_socket', '_wakeup_recv', '_wakeup_send'):
+            sock = getattr(self, name)
+            if sock:
+                try:
+                    sock.close()
+                except:
+                    pass
+                setattr(self, name, None)
+
+
+def db_from_sum_squares(sum_squares, count):
+    """Сумма квадратов int16 -> уровень в дБ относительно полной шкалы"""
+    if count == 0 or sum_squares <= 0:
+        return DB_FLOOR
+    return 10 * math.log10(sum_squares / count / FULL_SCALE_SQ)
+
+
+_thread_meters = threading.local()
+
+
+def calculate_volume(audio_data):
+    if audio_data is None or len(audio_data) == 0:
+        return DB_FLOOR
+
+    try:
+        # Буфер измерителя свой у каждого потока - без выделений на вызов
+        meter = getattr(_thread_meters, 'meter', None)
+        if meter is None:
+            meter = _thread_meters.meter = LoudnessMeter()
+        return db_from_sum_squares(meter.sum_squares(audio_data), len(audio_data))
+    except:
+        return DB_FLOOR
+
+
+def calculate_volumes(block):
+    """Уровень в дБ для каждой строки 2D-блока чанков одним векторным вызовом"""
+    block = np.asarray(block)
+    if block.ndim != 2 or block.shape[1] == 0:
+        raise ValueError("Ожидается 2D-блок чанков")
+
+    sum_squares = np.einsum('ij,ij->i', block, block, dtype=np.int64)
+    mean_square = sum_squares / (block.shape[1] * FULL_SCALE_SQ)
+    db = 10 * np.log10(np.maximum(mean_square, 1e-30))
+    return np.where(sum_squares > 0, db, DB_FLOOR)
+
+
+class LoudnessMeter:
+    """Потоковый измеритель громкости: дБ чанка и скользящего окна
+
+    Квадраты считаются через предвыделенный float64-буфер и BLAS dot:
+    для int16 сумма квадратов чанка - точное целое (меньше 2^53), а суммы
+    окна накапливаются целыми Python, так что на чанк нет выделений памяти.
+    Окно сдвигается с шагом в один чанк.
+    """
+
+    def __init__(self, window_ms=None, rate=RATE, max_chunk=CHUNK * 8):
+        self.rate = rate
+        self.window_samples = int(rate * window_ms / 1000) if window_ms else 0
+        self._scratch = np.empty(max_chunk, dtype=np.float64)
+        self._window = collections.deque()
+        self.reset()
+
+    def reset(self):
+        self._window.clear()
+        self._window_sum = 0
+        self._window_count = 0
+        self.total_sum = 0
+        self.total_count = 0
+        self.chunk_db = DB_FLOOR
+        self.window_db = DB_FLOOR
+
+    def sum_squares(self, chunk):
+        """Точная сумма квадратов чанка int16"""
+        n = len(chunk)
+        if n > len(self._scratch):
+            self._scratch = np.empty(n, dtype=np.float64)
+        scratch = self._scratch[:n]
+        np.copyto(scratch, chunk)
+        return int(np.dot(scratch, scratch))
+
+    def update(self, chunk):
+        """Добавляет чанк, возвращает уровень окна в дБ"""
+        n = len(chunk)
+        if n == 0:
+            return self.window_db
+
+        sum_squares = self.sum_squares(chunk)
+        self.total_sum += sum_squares
+        self.total_count += n
+        self.chunk_db = db_from_sum_squares(sum_squares, n)
+
+        if not self.window_samples:
+            self.window_db = self.chunk_db
+            return self.window_db
+
+        self._window.append((sum_squares, n))
+        self._window_sum += sum_squares
+        self._window_count += n
+        # Выбрасываем старые чанки, пока окно без них не короче заданного
+        while len(self._window) > 1 and self._window_count - self._window[0][1] >= self.window_samples:
+            old_sum, old_count = self._window.popleft()
+            self._window_sum -= old_sum
+            self._window_count -= old_count
+
+        self.window_db = db_from_sum_squares(self._window_sum, self._window_count)
+        return self.window_db
+
+
+class OnsetDetector:
+    """Детектор начала крика по коротким подкадрам с гистерезисом
+
+    Энергия считается сразу для всех подкадров (строки strided-вида
+    без копирования), затем автомат атаки/отпускания: начало
+    подтверждается после confirm_frames подкадров выше порога, повторно
+    сработать можно только после confirm_frames подкадров ниже
+    порога - release_db. Индексы сэмплов абсолютные (как cursor буфера).
+    """
+
+    def __init__(self, rate=RATE, threshold_db=-20, frame_ms=ONSET_FRAME_MS,
+                 confirm_frames=ONSET_CONFIRM_FRAMES, release_db=ONSET_RELEASE_DB):
+        self.rate = rate
+        self.threshold_db = threshold_db
+        self.frame = max(8, int(rate * frame_ms / 1000))
+        self.confirm_frames = confirm_frames
+        self.release_db = release_db
+        self.reset()
+
+    def reset(self, position=0):
+        self._tail = np.empty(0, dtype=np.int16)
+        self.position = position  # Абсолютный индекс первого сэмпла в _tail
+        self.active = False
+        self._run_length = 0
+        self._run_start = 0
+
+    def _refine(self, data, frame_start):
+        # Первый сэмпл подкадра, чья амплитуда уже выше порога
+        frame = data[frame_start:frame_start + self.frame]
+        amplitude = 32768.0 * 10 ** (self.threshold_db / 20)
+        above = np.flatnonzero(np.abs(frame.astype(np.int32)) >= amplitude)
+        return frame_start + (int(above[0]) if len(above) else 0)
+
+    def process(self, samples, start_index=None):
+        """Обрабатывает новые сэмплы; возвращает список подтверждённых начал
+
+        Каждое начало: onset_index (сэмпл начала), confirmed_index
+        (сэмпл, на котором начало подтвердилось) и level_db.
+        """
+        if start_index is not None and start_index != self.position + len(self._tail):
+            # Разрыв в потоке (перезапуск или потеря) - состояние не переносим
+            self.reset(start_index)
+
+        data = np.concatenate((self._tail, samples)) if len(self._tail) else samples
+        n_frames = len(data) // self.frame
+        onsets = []
+        if n_frames == 0:
+            self._tail = np.array(data, dtype=np.int16)
+            return onsets
+
+        frames = np.lib.stride_tricks.sliding_window_view(data[:n_frames * self.frame],
+                                                          self.frame)[::self.frame]
+        levels = calculate_volumes(frames)
+        attack = self.threshold_db
+        release = self.threshold_db - self.release_db
+
+        for i, level in enumerate(levels):
+            if not self.active:
+                if level > attack:
+                    if self._run_length == 0:
+                        self._run_start = self.position + self._refine(data, i * self.frame)
+                    self._run_length += 1
+                    if self._run_length >= self.confirm_frames:
+                        self.active = True
+                        self._run_length = 0
+                        onsets.append({
+                            'onset_index': self._run_start,
+                            'confirmed_index': self.position + (i + 1) * self.frame,
+                            'level_db': float(level),
+                        })
+                else:
+                    self._run_length = 0
+            else:
+                if level < release:
+                    self._run_length += 1
+                    if self._run_length >= self.confirm_frames:
+                        self.active = False
+                        self._run_length = 0
+                else:
+                    self._run_length = 0
+
+        consumed = n_frames * self.frame
+        self._tail = np.array(data[consumed:], dtype=np.int16)
+        self.position += consumed
+        return onsets
+
+
+def parse_bands(text):
+    """Полосы из текста 'низ-верх: клавиша' (по строке на полосу, Гц)"""
+    bands = []
+    for line in text.splitlines():
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            freq, key = line.split(':', 1)
+            low, high = (float(x) for x in freq.split('-'))
+        except ValueError:
+            raise ValueError(f"Не понял полосу: '{line}' (нужно, например, 80-300: space)")
+        if not 0 <= low < high:
+            raise ValueError(f"Нижняя частота должна быть меньше верхней: '{line}'")
+        if not key.strip():
+            raise ValueError(f"Не указана клавиша: '{line}'")
+        bands.append({'low': low, 'high': high, 'key': key.strip()})
+    if not bands:
+        raise ValueError("Не задано ни одной полосы")
+    return bands
+
+
+class BandMapper:
+    """Уровни частотных полос: одно БПФ и одно умножение матрицы на вектор
+
+    Окно Ханна, маски бинов и нормировка считаются один раз в
+    конструкторе и сложены в матрицу полос, поэтому уровни получаются
+    сразу в дБ относительно полной шкалы, как у calculate_volume.
+    """
+
+    def __init__(self, bands, rate=RATE, fft_size=BAND_FFT_SIZE):
+        self.bands = [dict(band) for band in bands]
+        self.rate = rate
+        self.fft_size = fft_size
+        self.window = np.hanning(fft_size)
+        self._scratch = np.empty(fft_size)
+
+        freqs = np.fft.rfftfreq(fft_size, 1.0 / rate)
+        # Парсеваль для rfft: все бины кроме DC и Найквиста учитываются дважды
+        weights = np.full(len(freqs), 2.0)
+        weights[0] = 1.0
+        if fft_size % 2 == 0:
+            weights[-1] = 1.0
+        norm = weights / (fft_size * np.dot(self.window, self.window) * FULL_SCALE_SQ)
+
+        self.matrix = np.zeros((len(self.bands), len(freqs)))
+        for i, band in enumerate(self.bands):
+            mask = (freqs >= band['low']) & (freqs < band['high'])
+            if not mask.any():
+                raise ValueError(f"Полоса {band['low']:g}-{band['high']:g} Гц не попадает "
+                                 f"ни в один бин при {rate} Гц")
+            self.matrix[i, mask] = norm[mask]
+
+    def levels(self, samples):
+        """Уровни полос в дБ по последним fft_size сэмплам"""
+        if len(samples) < self.fft_size:
+            return np.full(len(self.bands), float(DB_FLOOR))
+
+        np.multiply(samples[-self.fft_size:], self.window, out=self._scratch)
+        spectrum = np.fft.rfft(self._scratch)
+        power = np.square(spectrum.real)
+        power += np.square(spectrum.imag)
+        energy = self.matrix @ power
+        db = 10 * np.log10(np.maximum(energy, 1e-30))
+        return np.where(energy > 0, db, DB_FLOOR)
+
+    def match(self, levels, threshold_db):
+        """Индекс самой громкой полосы выше порога или None"""
+        best = int(np.argmax(levels))
+        return best if levels[best] > threshold_db else None
+
+
+class ChannelDetector:
+    """Громкость и срабатывания всех каналов за один векторный проход
+
+    Чанк - 2D (кадры x каналы). Как в LoudnessMeter, квадраты считаются
+    через предвыделенный float64-буфер (суммы int16 точны до 2^53), а суммы
+    по каналам - одно BLAS-умножение строки единиц на квадраты. Окно -
+    сумма по последним чанкам, а порог,
+    пауза между нажатиями и гистерезис удержания - сравнения массивов.
+    Python-цикл остаётся только по каналам, которые сработали.
+    """
+
+    def __init__(self, channels, rate=RATE, window_ms=None, max_chunk=CHUNK * 8):
+        self.channels = channels
+        self.rate = rate
+        self.window_samples = int(rate * window_ms / 1000) if window_ms else 0
+        self._scratch = np.empty((max_chunk, channels), dtype=np.float64)
+        self._ones = np.ones(max_chunk)
+        self._window = collections.deque()
+        self._window_sum = np.zeros(channels)
+        self._window_count = 0
+        self.levels = np.full(channels, float(DB_FLOOR))
+        self.last_trigger = np.full(channels, -np.inf)
+        self.held = np.zeros(channels, dtype=bool)
+        self.quiet_since = np.full(channels, np.nan)  # С какого момента зажатый канал тих
+
+    def update(self, block):
+        """Уровни каналов в дБ по новому чанку (с учётом окна); тише DB_FLOOR - DB_FLOOR"""
+        n = len(block)
+        if n == 0:
+            return self.levels
+        if n > len(self._scratch):
+            self._scratch = np.empty((n, self.channels), dtype=np.float64)
+            self._ones = np.ones(n)
+        scratch = self._scratch[:n]
+        np.copyto(scratch, block)
+        np.multiply(scratch, scratch, out=scratch)
+        sums = self._ones[:n] @ scratch
+        if self.window_samples:
+            self._window.append((sums, n))
+            self._window_sum += sums
+            self._window_count += n
+            while len(self._window) > 1 and self._window_count - self._window[0][1] >= self.window_samples:
+                old_sums, old_count = self._window.popleft()
+                self._window_sum -= old_sums
+                self._window_count -= old_count
+            sums, n = self._window_sum, self._window_count
+        levels = self.levels
+        np.multiply(sums, 1.0 / (n * FULL_SCALE_SQ), out=levels)
+        np.maximum(levels, 1e-30, out=levels)
+        np.log10(levels, out=levels)
+        levels *= 10
+        np.maximum(levels, DB_FLOOR, out=levels)
+        return levels
+
+    def process(self, block, now, threshold, mode="tap", cooldown=TRIGGER_COOLDOWN, hang=HOLD_HANG):
+        """Новый чанк -> события [(канал, 'tap' | 'down' | 'up')]; now - время звука, с"""
+        levels = self.update(block)
+        loud = levels > threshold
+        if mode == "hold":
+            quiet = self.held & (levels <= threshold - HOLD_RELEASE_DB)
+            if not loud.any() and not quiet.any():
+                self.quiet_since[:] = np.nan
+                return []
+            self.quiet_since = np.where(quiet, np.fmin(self.quiet_since, now), np.nan)
+            up = quiet & (now - self.quiet_since >= hang)
+            down = ~self.held & loud
+            self.held = (self.held & ~up) | down
+            return ([(int(c), 'up') for c in np.flatnonzero(up)]
+                    + [(int(c), 'down') for c in np.flatnonzero(down)])
+
+        # Из удержания переключились в нажатия - отпускаем зажатое
+        events = [(int(c), 'up') for c in self.release_all()] if self.held.any() else []
+        if not loud.any():
+            return events
+        fire = loud & (now - self.last_trigger > cooldown)
+        self.last_trigger[fire] = now
+        return events + [(int(c), 'tap') for c in np.flatnonzero(fire)]
+
+    def release_all(self):
+        """Зажатые каналы (и забывает их)"""
+        held = np.flatnonzero(self.held)
+        self.held[:] = False
+        self.quiet_since[:] = np.nan
+        return held
+
+
+def make_command(button_input):
+    """Команда нажатия из текста кнопки: 'space', комбинация 'ctrl+c'
+    или макрос 'hold shift 120, tap e'"""
+    if is_macro(button_input):
+        return {'type': 'macro', 'macro': button_input.strip(), 'timestamp': time.time()}
+    if '+' in button_input:
+        keys = [k.strip() for k in button_input.split('+')]
+        return {'type': 'hotkey', 'keys': keys, 'timestamp': time.time()}
+    return {'type': 'key_press', 'key': button_input.strip(), 'timestamp': time.time()}
+
+
+def make_hold_command(button_input, pressed):
+    """Зажатие или отпускание для режима удержания: 'w' или 'shift+w'
+
+    Макрос удерживать нельзя - он запускается при зажатии, отпускания нет (None).
+    """
+    if is_macro(button_input):
+        return make_command(button_input) if pressed else None
+    keys = [k.strip() for k in button_input.split('+')]
+    return {'type': 'key_down' if pressed else 'key_up', 'keys': keys, 'timestamp': time.time()}
+
+
+def command_keys(command):
+    """Клавиши команды текстом: 'space' или 'ctrl+c'"""
+    if command['type'] in ('hotkey', 'key_down', 'key_up'):
+        return '+'.join(command['keys'])
+    if command['type'] == 'macro':
+        return command['macro']
+    return command['key']
+
+
+def describe_command(command):
+    """Короткое описание команды для интерфейса"""
+    if command['type'] == 'hotkey':
+        return f"Комбинация: {command_keys(command)}"
+    if command['type'] == 'macro':
+        return f"Макрос: {command_keys(command)}"
+    if command['type'] == 'key_down':
+        return f"Зажата: {command_keys(command)}"
+    if command['type'] == 'key_up':
+        return f"Отпущена: {command_keys(command)}"
+    return f"Кнопка: {command_keys(command)}"
+
+
+class FlightRecorder:
+    """Бортовой самописец: события детектора и звук вокруг них в кольцевом файле
+
+    Файл постоянного размера отображён в память (mmap) и поделён на
+    слоты: заголовок события и FLIGHT_PRE + FLIGHT_POST секунд звука.
+    Поток захвата о самописце не знает, а детектор только кладёт в
+    очередь ссылку на кольцевой буфер и позицию события - звук копирует
+    свой поток, когда после события накопится FLIGHT_POST секунд.
+    Номер слота пишется последним: недописанный при падении слот не
+    читается. Записи переживают перезапуск, нумерация продолжается;
+    файл другого формата или размера не стирается, а уходит в .prev.
+    """
+
+    _default = None
+    _default_lock = threading.Lock()
+
+    def __init__(self, path=FLIGHT_PATH, size=FLIGHT_SIZE, pre=FLIGHT_PRE, post=FLIGHT_POST):
+        self.path = path
+        self.size = size
+        self.pre = pre
+        self.post = post
+        self.pending = collections.deque()
+        self.wakeup = threading.Event()
+        self.file = None
+        self.map = None
+        self.format = None  # (частота, каналы) открытого файла
+        self.slot_size = 0
+        self.slots = 0
+        self.next_seq = 1
+        self.recorded = 0
+        self.dropped = 0
+        self.last_error = ""
+        self.thread = None
+        self.is_running = False
+
+    @classmethod
+    def get_default(cls, create=True):
+        """Общий самописец интерфейса (файл FLIGHT_PATH)"""
+        if cls._default is None and create:
+            with cls._default_lock:
+                if cls._default is None:
+                    recorder = cls()
+                    recorder.start()
+                    cls._default = recorder
+        return cls._default
+
+    def open(self, rate, channels):
+        """Открывает файл под формат звука; файл другого формата уходит в .prev"""
+        self.close()
+        pre_frames = int(self.pre * rate)
+        post_frames = int(self.post * rate)
+        slot_size = FLIGHT_RECORD.size + (pre_frames + post_frames) * channels * 2
+        slots = (self.size - FLIGHT_HEADER.size) // slot_size
+        if slots < 1:
+            raise ValueError(f"Файл самописца меньше одного события ({slot_size} байт)")
+        header = FLIGHT_HEADER.pack(FLIGHT_MAGIC, FLIGHT_VERSION, channels, rate, slot_size, slots,
+                                    pre_frames, post_frames)
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        f = open(self.path, "r+b" if os.path.exists(self.path) else "w+b")
+        try:
+            fresh = f.read(len(header)) != header or os.fstat(f.fileno()).st_size != self.size
+            if fresh and os.fstat(f.fileno()).st_size:
+                # Прошлые записи не стираем: после падения они и нужны
+                f.close()
+                os.replace(self.path, self.path + ".prev")
+                f = open(self.path, "w+b")
+            if fresh:
+                f.truncate(self.size)
+                f.seek(0)
+                f.write(header)
+                f.flush()
+            self.map = mmap.mmap(f.fileno(), self.size)
+        except:
+            f.close()
+            raise
+        self.file = f
+        self.format = (rate, channels)
+        self.slot_size = slot_size
+        self.slots = slots
+        self.next_seq = 1
+        if not fresh:
+            for slot in range(slots):
+                seq = FLIGHT_SEQ.unpack_from(self.map, FLIGHT_HEADER.size + slot * slot_size)[0]
+                self.next_seq = max(self.next_seq, seq + 1)
+
+    def start(self):
+        if self.is_running:
+            return
+        self.is_running = True
+        self.thread = threading.Thread(target=self._run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def record(self, ring, position, kind, key, level, settings, channel=-1, note=""):
+        """Событие детектора: только очередь, без копирования звука
+
+        settings - (порог, детектор, режим, пауза, удержание, окно, чанк).
+        """
+        if len(self.pending) >= FLIGHT_PENDING:
+            self.dropped += 1
+            return
+        self.pending.append((ring, position, time.time(), kind, key, level, settings, channel, note))
+        self.wakeup.set()
+
+    def _run(self):
+        while self.is_running or self.pending:
+            if not self.pending:
+                self.wakeup.wait(0.5)
+                self.wakeup.clear()
+                continue
+            ring, position, wall = self.pending[0][:3]
+            # Ждём звук после события; источник встал - пишем, что успело прийти
+            if (ring.write_index < position + int(self.post * ring.rate) and self.is_running
+                    and time.time() - wall < self.post + 1.0):
+                time.sleep(0.01)
+                continue
+            item = self.pending.popleft()
+            try:
+                self._write(*item)
+            except (OSError, ValueError) as e:
+                self.dropped += 1
+                if str(e) != self.last_error:
+                    self.last_error = str(e)
+                    print(f"Ошибка самописца: {e}")
+
+    def _write(self, ring, position, wall, kind, key, level, settings, channel, note):
+        if self.format != (ring.rate, ring.channels):
+            self.open(ring.rate, ring.channels)
+        end = min(position + int(self.post * ring.rate), ring.write_index)
+        audio = ring.latest(end - max(0, position - int(self.pre * ring.rate)), end)
+        data = audio.tobytes()
+        start = end - len(audio)
+        # Быстрый источник мог обогнать нас на целый буфер - начало уже перезаписано
+        overwritten = ring.write_index - ring.capacity - start
+        if overwritten > 0:
+            data = data[overwritten * ring.channels * 2:]
+            start += overwritten
+
+        threshold, detector, mode, cooldown, hold_hang, window_ms, chunk = settings
+        offset = FLIGHT_HEADER.size + (self.next_seq - 1) % self.slots * self.slot_size
+        body = offset + FLIGHT_RECORD.size
+        FLIGHT_SEQ.pack_into(self.map, offset, 0)
+        self.map[body:body + len(data)] = data
+        FLIGHT_RECORD.pack_into(self.map, offset, 0, wall, position, start, len(data) // (ring.channels * 2),
+                                channel, list(FLIGHT_EVENTS).index(kind), list(DETECTORS).index(detector),
+                                list(TRIGGER_MODES).index(mode), chunk, level, threshold, cooldown, hold_hang,
+                                window_ms or 0, key.encode("utf-8")[:48], note.encode("utf-8")[:48])
+        FLIGHT_SEQ.pack_into(self.map, offset, self.next_seq)
+        self.next_seq += 1
+        self.recorded += 1
+
+    def get_stats(self):
+        return {
+            'path': self.path,
+            'recorded': self.recorded,
+            'dropped': self.dropped,
+            'pending': len(self.pending),
+            'slots': self.slots,
+            'last_error': self.last_error,
+        }
+
+    def close(self):
+        if self.map is not None:
+            self.map.flush()
+            self.map.close()
+            self.map = None
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+        self.format = None
+
+    def stop(self):
+        """Дописывает очередь и закрывает файл"""
+        self.is_running = False
+        self.wakeup.set()
+        if self.thread is not None:
+            self.thread.join(timeout=2.0)
+            self.thread = None
+        self.close()
+
+    @staticmethod
+    def read(path):
+        """Файл самописца -> (заголовок, события по порядку номеров)"""
+        with open(path, "rb") as f:
+            data = f.read()
+        if len(data) < FLIGHT_HEADER.size:
+            raise ValueError(f"{path}: не файл самописца")
+        magic, version, channels, rate, slot_size, slots, pre_frames, post_frames = FLIGHT_HEADER.unpack_from(data)
+        if magic != FLIGHT_MAGIC:
+            raise ValueError(f"{path}: не файл самописца")
+        if version != FLIGHT_VERSION:
+            raise ValueError(f"{path}: версия {version}, поддерживается {FLIGHT_VERSION}")
+        info = {'rate': rate, 'channels': channels, 'slots': slots,
+                'pre': pre_frames / rate, 'post': post_frames / rate}
+        kinds = list(FLIGHT_EVENTS)
+        detectors = list(DETECTORS)
+        modes = list(TRIGGER_MODES)
+        records = []
+        for slot in range(slots):
+            offset = FLIGHT_HEADER.size + slot * slot_size
+            if offset + slot_size > len(data):
+                break
+            (seq, wall, position, audio_start, frames, channel, kind, detector, mode, chunk, level, threshold,
+             cooldown, hold_hang, window_ms, key, note) = FLIGHT_RECORD.unpack_from(data, offset)
+            if not seq:
+                continue
+            body = offset + FLIGHT_RECORD.size
+            audio = np.frombuffer(data, dtype=np.int16, count=frames * channels, offset=body)
+            records.append({
+                'seq': seq,
+                'time': wall,
+                'position': position,
+                'audio_start': audio_start,
+                'kind': kinds[kind],
+                'channel': channel,
+                'detector': detectors[detector],
+                'mode': modes[mode],
+                'chunk': chunk,
+                'level': level,
+                'threshold': threshold,
+                'cooldown': cooldown,
+                'hold_hang': hold_hang,
+                'window_ms': window_ms,
+                'key': key.rstrip(b"\0").decode("utf-8", "ignore"),
+                'note': note.rstrip(b"\0").decode("utf-8", "ignore"),
+                'rate': rate,
+                'channels': channels,
+                'audio': audio.reshape(-1, channels) if channels > 1 else audio,
+            })
+        records.sort(key=lambda record: record['seq'])
+        return info, records
+
+
+def replay_flight_record(record, bands=None, **settings):
+    """Прогоняет звук события через детектор: [(смещение от события в с, команда)]
+
+    Настройки - записанные, если не переданы другие. Детектор стартует
+    с чистого состояния: паузы и окна до начала записи он не знает.
+    """
+    source = FlightSource(record)
+    engine = DetectionEngine(source)
+    values = {name: record[name] for name in ('threshold', 'detector', 'mode', 'cooldown', 'hold_hang', 'window_ms')}
+    values.update({name: value for name, value in settings.items() if value is not None})
+    events = []
+
+    def sender(command):
+        offset = (source.start_position + engine.position - record['position']) / source.rate
+        events.append((offset, command))
 
-    def disconnect(self):
-        self.is_connected = False
-        if self.socket:
-            try:
-                self.socket.close()
-            except:
-                pass
-            self.socket = None
+    key = record['key'] or "space"
+    channel_keys = [key if i == record['channel'] else f"канал {i + 1}" for i in range(source.channels)]
+    engine.configure(button_input=key, channel_keys=channel_keys, sender=sender, sender_stage="inject",
+                     bands=bands, **values)
+    engine.start()
+    source.start_recording()
+    source.finished.wait()
+    while engine.position < source.ring.write_index:
+        time.sleep(0.001)
+    engine.stop()
+    source.stop_recording()
+    return events
 
 
-class NetworkServer:
-    """Игрок который получает нажатия - запускает сервер"""
+class DetectionEngine:
+    """Поток детекции: просыпается на каждый чанк и сам отправляет нажатия
 
-    def __init__(self):
-        self.server_socket = None
-        self.clients = []
+    Интерфейс только читает snapshot, поэтому перезапуски Streamlit
+    не останавливают захват и детекцию.
+    """
+
+    def __init__(self, processor):
+        self.processor = processor
+        self.threshold = -20
+        self.cooldown = TRIGGER_COOLDOWN
+        self.button_input = "space"
+        self.sender = execute_command
+        self.window_ms = None  # None - уровень по каждому чанку
+        self.detector = "volume"
+        self.mode = "tap"
+        self.hold_hang = HOLD_HANG
+        self.channel_keys = []  # Кнопки каналов многоканального звука (не хватит - button_input)
+        self.bands = parse_bands(DEFAULT_BANDS)
+        self.tracer = LatencyTracer()
+        self.recorder = None  # FlightRecorder: события и звук вокруг них
+        self.sender_stage = "send"  # В одиночном режиме отправка - это само нажатие
+        self.position = 0  # Сколько сэмплов потока обработано (часы детектора)
         self.is_running = False
-        self.server_thread = None
-        self.lock = threading.Lock()
-        self.local_ip = "127.0.0.1"
+        self.thread = None
+        self.snapshot = self._make_snapshot()
 
-    def get_local_ip(self):
-        """Получение локального IP адреса"""
-        try:
-            # Простой способ получить IP
-            s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-            s.connect(("8.8.8.8", 80))
-            ip_address = s.getsockname()[0]
-            s.close()
-            self.local_ip = ip_address
-            return ip_address
-        except:
-            try:
-                hostname = socket.gethostname()
-                ip_address = socket.gethostbyname(hostname)
-                self.local_ip = ip_address
-                return ip_address
-            except:
-                self.local_ip = "127.0.0.1"
-                return "127.0.0.1"
+    def configure(self, threshold=None, button_input=None, sender=None, cooldown=None,
+                  window_ms=None, detector=None, bands=None, sender_stage=None, mode=None,
+                  hold_hang=None, channel_keys=None, recorder=None):
+        """Меняет настройки на лету (значения читаются на каждом чанке)
 
-    def start_server(self):
-        try:
-            self.server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            self.server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-            self.server_socket.bind(('0.0.0.0', PORT))  # Слушаем все интерфейсы
-            self.server_socket.listen(5)
-            self.server_socket.settimeout(1.0)  # Таймаут для accept
-            self.is_running = True
+        recorder=False отключает самописец.
+        """
+        if recorder is not None:
+            self.recorder = recorder or None
+        if channel_keys is not None:
+            self.channel_keys = list(channel_keys)
+        if mode is not None:
+            if mode not in TRIGGER_MODES:
+                raise ValueError(f"Неизвестный режим: {mode}")
+            self.mode = mode
+        if hold_hang is not None:
+            self.hold_hang = hold_hang
+        if sender_stage is not None:
+            self.sender_stage = sender_stage
+        if bands is not None:
+            BandMapper(bands, self.processor.rate)  # Проверка: полосы попадают в спектр
+            self.bands = [dict(band) for band in bands]
+        if detector is not None:
+            if detector not in DETECTORS:
+                raise ValueError(f"Неизвестный детектор: {detector}")
+            self.detector = detector
+        if window_ms is not None:
+            self.window_ms = window_ms or None
+        if threshold is not None:
+            self.threshold = threshold
+        if button_input is not None:
+            self.button_input = button_input
+        if sender is not None:
+            self.sender = sender
+        if cooldown is not None:
+            self.cooldown = cooldown
 
-            def accept_clients():
-                while self.is_running:
-                    try:
-                        client_socket, addr = self.server_socket.accept()
-                        client_socket.settimeout(0.1)
-                        with self.lock:
-                            self.clients.append({
-                                'socket': client_socket,
-                                'address': addr,
-                                'connected': True
-                            })
-                        print(f"Новое подключение от {addr[0]}:{addr[1]}")
-                    except socket.timeout:
-                        continue
-                    except:
-                        if self.is_running:
-                            print("Ошибка accept клиента")
-                        break
+    def _make_snapshot(self, **values):
+        snapshot = {
+            'volume': -100.0,
+            'state': 'idle',
+            'cooldown_left': 0.0,
+            'triggers': 0,
+            'failures': 0,
+            'last_action': "",
+            'last_keys': "",
+            'last_error': "",
+            'last_trigger_time': 0.0,
+            'onset_delay_ms': 0.0,
+            'held_keys': "",
+            'band_levels': (),
+            'channel_levels': (),
+            'updated_at': time.time(),
+        }
+        snapshot.update(values)
+        return snapshot
 
-            self.server_thread = threading.Thread(target=accept_clients)
-            self.server_thread.daemon = True
-            self.server_thread.start()
+    def get_snapshot(self):
+        """Последнее состояние детектора (словарь заменяется целиком)"""
+        return self.snapshot
 
-            # Запускаем поток обработки команд
-            process_thread = threading.Thread(target=self.process_commands)
-            process_thread.daemon = True
-            process_thread.start()
+    def start(self):
+        if self.is_running:
+            return
+        self.is_running = True
+        self.thread = threading.Thread(target=self._run)
+        self.thread.daemon = True
+        self.thread.start()
 
-            return True
+    def stop(self):
+        self.is_running = False
+        if self.thread is not None:
+            self.thread.join(timeout=1.0)
+            self.thread = None
+        self.snapshot = self._make_snapshot(triggers=self.snapshot['triggers'],
+                                            failures=self.snapshot['failures'])
+
+    def _fire(self, button_input=None, level=None, pressed=None):
+        """Отправляет нажатие; pressed - зажатие (True) или отпускание (False) в режиме удержания"""
+        if pressed is None:
+            command = make_command(button_input or self.button_input)
+        else:
+            command = make_hold_command(button_input or self.button_input, pressed)
+            if command is None:
+                return None, True, ""
+        if level is not None:
+            # Громкость крика нужна серверу в режиме вечеринки
+            command['level'] = level
+        try:
+            ok = self.sender(command)
         except Exception as e:
-            st.error(f"Ошибка запуска сервера: {e}")
-            return False
+            return command, False, str(e)
+        # KeyPresser ничего не возвращает, NetworkClient - признак успеха
+        if ok is False:
+            return command, False, "Ошибка отправки, проверьте подключение"
+        return command, True, ""
 
-    def process_commands(self):
-        """Обработка входящих команд и нажатие клавиш"""
-        while self.is_running:
-            disconnected = []
-            with self.lock:
-                for i, client in enumerate(self.clients):
-                    if client['connected']:
-                        try:
-                            data = client['socket'].recv(4096)
-                            if data:
-                                try:
-                                    command = pickle.loads(data)
-                                    # Нажимаем клавишу
-                                    if command.get('type') == 'key_press':
-                                        key = command.get('key', '')
-                                        if key:
-                                            try:
-                                                KeyPresser.press(key)
-                                                print(f"Нажата клавиша: {key}")
-                                            except Exception as e:
-                                                print(f"Ошибка нажатия {key}: {e}")
-                                    elif command.get('type') == 'hotkey':
-                                        keys = command.get('keys', [])
-                                        if keys and len(keys) >= 2:
-                                            try:
-                                                KeyPresser.hotkey(*keys)
-                                                print(f"Нажата комбинация: {keys}")
-                                            except Exception as e:
-                                                print(f"Ошибка комбинации {keys}: {e}")
-                                except Exception as e:
-                                    print(f"Ошибка десериализации: {e}")
-                        except socket.timeout:
-                            pass
-                        except Exception as e:
-                            print(f"Ошибка получения данных: {e}")
-                            client['connected'] = False
-                            disconnected.append(i)
+    def _record(self, ring, kind, key, level, channel=-1, note=""):
+        """Событие в самописец (если он подключён); позиция - конец прочитанного звука"""
+        recorder = self.recorder
+        if recorder is not None:
+            recorder.record(ring, self.position, kind, key, level,
+                            (self.threshold, self.detector, self.mode, self.cooldown, self.hold_hang,
+                             self.window_ms, self.processor.chunk), channel, note)
 
-            # Удаляем отключенных клиентов
-            if disconnected:
-                with self.lock:
-                    for idx in sorted(disconnected, reverse=True):
-                        try:
-                            self.clients[idx]['socket'].close()
-                        except:
-                            pass
-                        self.clients.pop(idx)
+    def get_channel_keys(self, channels):
+        """Кнопка каждого канала"""
+        keys = self.channel_keys
+        return [keys[i] if i < len(keys) and keys[i] else self.button_input for i in range(channels)]
 
-            time.sleep(0.01)
+    def _process_channels(self, detector, block, now, ring, woke, snap):
+        """Многоканальный звук: все каналы одним проходом ChannelDetector
 
-    def get_connected_clients(self):
-        """Возвращает список подключенных клиентов"""
-        with self.lock:
-            return [c for c in self.clients if c['connected']]
+        Детектор здесь всегда по громкости: онсет и полосы считаются
+        по одному каналу и векторно не складываются.
+        """
+        events = detector.process(block, now, self.threshold, self.mode, self.cooldown, self.hold_hang)
+        levels = detector.levels
+        keys = self.get_channel_keys(detector.channels)
+        values = {
+            'volume': float(levels.max()),
+            'channel_levels': tuple(float(x) for x in levels),
+            'state': 'quiet',
+            'triggers': snap['triggers'],
+            'failures': snap['failures'],
+            'last_action': snap['last_action'],
+            'last_keys': snap['last_keys'],
+            'last_error': snap['last_error'],
+            'last_trigger_time': snap['last_trigger_time'],
+        }
+        for channel, action in events:
+            decided = time.time()
+            pressed = None if action == 'tap' else action == 'down'
+            command, ok, error = self._fire(keys[channel], float(levels[channel]), pressed)
+            if command is None:
+                continue
+            if not ok:
+                if action == 'down':
+                    detector.held[channel] = False
+                values.update(state='error', failures=values['failures'] + 1, last_error=error)
+                self._record(ring, 'error', keys[channel], float(levels[channel]), channel, error)
+                continue
+            self._trace(ring, woke, decided)
+            self._record(ring, action, keys[channel], float(levels[channel]), channel)
+            values.update(last_action=f"Канал {channel + 1}: {describe_command(command)}",
+                          last_keys=command_keys(command), last_error="")
+            if action != 'up':
+                values.update(state='triggered', triggers=values['triggers'] + 1, last_trigger_time=time.time())
+        held = np.flatnonzero(detector.held)
+        if len(held):
+            values['held_keys'] = ", ".join(keys[c] for c in held)
+            if values['state'] == 'quiet':
+                values['state'] = 'holding'
+        return self._make_snapshot(**values)
 
-    def refresh_connection(self):
-        """Обновляет состояние подключений"""
-        disconnected = []
-        with self.lock:
-            for i, client in enumerate(self.clients):
-                if client['connected']:
-                    try:
-                        # Проверяем соединение
-                        client['socket'].send(b'ping')
-                    except:
-                        client['connected'] = False
-                        disconnected.append(i)
+    def _release_channels(self, detector):
+        keys = self.get_channel_keys(detector.channels)
+        for channel in detector.release_all():
+            self._fire(keys[channel], pressed=False)
 
-            for idx in sorted(disconnected, reverse=True):
-                try:
-                    self.clients[idx]['socket'].close()
-                except:
-                    pass
-                self.clients.pop(idx)
+    def _trace(self, ring, woke, decided):
+        # Этапы по последнему чанку: он и вызвал срабатывание
+        written = ring.last_write_time
+        sent = time.time()
+        self.tracer.record_trace({
+            'capture': ring.last_adc_delay,
+            'wakeup': max(0.0, woke - written),
+            'detect': decided - woke,
+            self.sender_stage: sent - decided,
+            'total': sent - written + ring.last_adc_delay,
+        })
 
-    def stop_server(self):
-        self.is_running = False
-        with self.lock:
-            for client in self.clients:
-                try:
-                    client['socket'].close()
-                except:
-                    pass
-            self.clients.clear()
+    def _run(self):
+        ring = self.processor.ring
+        cursor = ring.write_index
+        window_ms = self.window_ms
+        meter = LoudnessMeter(window_ms, ring.rate)
+        onset = OnsetDetector(ring.rate, self.threshold)
+        onset.reset(cursor)
+        bands = self.bands
+        mapper = BandMapper(bands, ring.rate)
+        # Паузу между нажатиями меряем по часам звука: у файла в ускоренном
+        # режиме секунда звука проходит быстрее секунды настенных часов
+        last_trigger = -math.inf
+        # Удержание: что зажато, по какой полосе и с какого момента стало тихо
+        held = None
+        held_band = None
+        quiet_since = None
+        # Почти крики и крики в паузе пишутся в самописец не чаще раза за его окно
+        # и не сразу после срабатывания (его хвост и так в записи)
+        last_near = -math.inf
+        # Многоканальный звук (по каналу на игрока) идёт мимо детекторов одного канала
+        channels = ChannelDetector(ring.channels, ring.rate, window_ms) if ring.channels > 1 else None
+        snap = self.snapshot
 
-        if self.server_socket:
-            try:
-                self.server_socket.close()
-            except:
-                pass
-            self.server_socket = None
+        while self.is_running:
+            # При перезапуске микрофона буфер пересоздаётся
+            if self.processor.ring is not ring or self.window_ms != window_ms:
+                if held is not None:
+                    self._fire(held, pressed=False)
+                    held = None
+                if channels is not None:
+                    self._release_channels(channels)
+                ring = self.processor.ring
+                cursor = ring.write_index
+                window_ms = self.window_ms
+                meter = LoudnessMeter(window_ms, ring.rate)
+                onset = OnsetDetector(ring.rate, self.threshold)
+                onset.reset(cursor)
+                last_trigger = -math.inf
+                last_near = -math.inf
+                channels = ChannelDetector(ring.channels, ring.rate, window_ms) if ring.channels > 1 else None
+            if self.bands != bands or mapper.rate != ring.rate:
+                bands = self.bands
+                mapper = BandMapper(bands, ring.rate)
 
+            if not ring.wait_for_data(cursor, timeout=0.5):
+                continue
+            woke = time.time()
+            audio_data, cursor = ring.read_since(cursor)
+            self.position = cursor
+            if channels is not None:
+                snap = self._process_channels(channels, audio_data, cursor / ring.rate, ring, woke, snap)
+                self.snapshot = snap
+                continue
 
-def calculate_volume(audio_data):
-    if audio_data is None or len(audio_data) == 0:
-        return -100
+            volume = meter.update(audio_data)
+            now = cursor / ring.rate
+            values = {
+                'volume': float(volume),
+                'triggers': snap['triggers'],
+                'failures': snap['failures'],
+                'last_action': snap['last_action'],
+                'last_keys': snap['last_keys'],
+                'last_error': snap['last_error'],
+                'last_trigger_time': snap['last_trigger_time'],
+                'onset_delay_ms': snap['onset_delay_ms'],
+            }
 
-    try:
-        audio_float = audio_data.astype(np.float32)
-        rms = np.sqrt(np.mean(audio_float ** 2))
+            button_input = None
+            band = None
+            levels = None
+            level = float(volume)
+            if self.detector == "onset" and self.processor.chunk >= ONSET_MIN_CHUNK:
+                onset.threshold_db = self.threshold
+                onsets = onset.process(audio_data, cursor - len(audio_data))
+                loud = bool(onsets)
+                if onsets:
+                    level = onsets[0]['level_db']
+            elif self.detector == "bands":
+                # БПФ по последним сэмплам буфера, а не только по новому чанку
+                onsets = []
+                levels = mapper.levels(ring.latest(mapper.fft_size, cursor))
+                band = mapper.match(levels, self.threshold)
+                values['band_levels'] = tuple(float(x) for x in levels)
+                loud = band is not None
+                if loud:
+                    button_input = bands[band]['key']
+                    level = float(levels[band])
+            else:
+                onsets = []
+                loud = volume > self.threshold
 
-        if rms > 0:
-            db = 20 * np.log10(rms / 32768.0)
-        else:
-            db = -100
-        return db
-    except:
-        return -100
+            if held is not None:
+                # Гистерезис: отпускаем, когда уровень ниже порога на HOLD_RELEASE_DB
+                # дольше hold_hang, - короткие паузы между словами не считаются
+                if held_band is not None:
+                    current = float(levels[held_band]) if levels is not None and held_band < len(levels) else DB_FLOOR
+                else:
+                    current = float(volume)
+                if current > self.threshold - HOLD_RELEASE_DB:
+                    quiet_since = None
+                elif quiet_since is None:
+                    quiet_since = now
+                changed = self.mode != "hold" or (held_band is None and held != self.button_input)
+                if changed or (quiet_since is not None and now - quiet_since >= self.hold_hang):
+                    decided = time.time()
+                    command, ok, error = self._fire(held, current, pressed=False)
+                    # Не дошло - сервер отпустит сам по отключению или молчанию
+                    if command is not None:
+                        if ok:
+                            self._trace(ring, woke, decided)
+                        values.update(last_action=describe_command(command), last_keys=command_keys(command))
+                    self._record(ring, 'up' if ok else 'error', held, current, note=error)
+                    held = None
+                    values.update(state='quiet')
+                else:
+                    values.update(state='holding', held_keys=held)
+            elif self.mode == "hold":
+                if loud:
+                    decided = time.time()
+                    command, ok, error = self._fire(button_input, level, pressed=True)
+                    self._record(ring, 'down' if ok else 'error', button_input or self.button_input, level,
+                                 note=error)
+                    if ok:
+                        self._trace(ring, woke, decided)
+                        last_near = now
+                        held = button_input or self.button_input
+                        held_band = band
+                        quiet_since = None
+                        values.update(state='holding', held_keys=held, triggers=snap['triggers'] + 1,
+                                      last_action=describe_command(command),
+                                      last_keys=command_keys(command), last_error="",
+                                      last_trigger_time=time.time())
+                    else:
+                        values.update(state='error', failures=snap['failures'] + 1, last_error=error)
+                else:
+                    values.update(state='quiet')
+            elif loud and now - last_trigger > self.cooldown:
+                decided = time.time()
+                command, ok, error = self._fire(button_input, level)
+                self._record(ring, 'tap' if ok else 'error', button_input or self.button_input, level, note=error)
+                if ok:
+                    self._trace(ring, woke, decided)
+                    last_trigger = last_near = now
+                    values.update(state='triggered', triggers=snap['triggers'] + 1,
+                                  last_action=describe_command(command),
+                                  last_keys=command_keys(command), last_error="",
+                                  last_trigger_time=time.time())
+                    if onsets:
+                        # Сколько звука прошло от начала крика до нажатия
+                        values['onset_delay_ms'] = (cursor - onsets[0]['onset_index']) / ring.rate * 1000
+                else:
+                    values.update(state='error', failures=snap['failures'] + 1, last_error=error)
+            elif loud or volume > self.threshold:
+                values.update(state='cooldown', cooldown_left=max(0.0, self.cooldown - (now - last_trigger)))
+            else:
+                values.update(state='quiet')
+
+            # Для разбора пропущенных нажатий: громко, но без срабатывания
+            if (self.recorder is not None and held is None and values['state'] in ('quiet', 'cooldown')
+                    and volume > self.threshold - FLIGHT_NEAR_DB
+                    and now - last_near >= FLIGHT_PRE + FLIGHT_POST):
+                last_near = now
+                paused = values['state'] == 'cooldown' and now - last_trigger <= self.cooldown
+                self._record(ring, 'cooldown' if paused else 'near', self.button_input, float(volume))
+
+            snap = self._make_snapshot(**values)
+            self.snapshot = snap
+
+        if held is not None:
+            self._fire(held, pressed=False)
+        if channels is not None:
+            self._release_channels(channels)
 
 
 def main():
@@ -526,6 +4663,9 @@ def main():
         st.session_state.server = NetworkServer()
     if 'client' not in st.session_state:
         st.session_state.client = NetworkClient()
+    if 'engine' not in st.session_state:
+        st.session_state.engine = DetectionEngine(st.session_state.processor)
+        st.session_state.engine.configure(recorder=FlightRecorder.get_default())
     if 'mode' not in st.session_state:
         st.session_state.mode = "solo"
     if 'app_running' not in st.session_state:
@@ -587,6 +4727,7 @@ def main():
                      help="Один игрок, один микрофон, одна кнопка"):
             st.session_state.mode = "solo"
             # Останавливаем всё при смене режима
+            st.session_state.engine.stop()
             st.session_state.processor.stop_recording()
             st.session_state.server.stop_server()
             st.session_state.client.disconnect()
@@ -599,6 +4740,7 @@ def main():
                      help="Один кричит, другой получает нажатия"):
             st.session_state.mode = "coop"
             # Останавливаем всё при смене режима
+            st.session_state.engine.stop()
             st.session_state.processor.stop_recording()
             st.session_state.server.stop_server()
             st.session_state.client.disconnect()
@@ -616,6 +4758,7 @@ def main():
     # Кнопка для принудительной остановки всего
     st.markdown("---")
     if st.button("🛑 АВАРИЙНАЯ ОСТАНОВКА", type="secondary"):
+        st.session_state.engine.stop()
         st.session_state.processor.stop_recording()
         st.session_state.server.stop_server()
         st.session_state.client.disconnect()
@@ -634,8 +4777,9 @@ def solo_interface():
         button_input = st.text_input(
             "Кнопка для нажатия:",
             value="space",
-            help="Например: space, enter, a, 1, f1, ctrl+c"
+            help="Например: space, enter, a, 1, f1, ctrl+c или макрос: hold shift 120, tap e, wait 30, tap r"
         )
+        check_macro(button_input)
 
     with col2:
         threshold = st.slider(
@@ -646,19 +4790,36 @@ def solo_interface():
             help="Чем выше значение, тем чувствительнее"
         )
 
+    detector = detector_select()
+    mode = trigger_mode_select()
+    if detector == "bands":
+        bands_panel()
+    calibration_panel()
+
+    # Настройки применяются к работающему детектору сразу
+    st.session_state.engine.configure(threshold=threshold, button_input=button_input,
+                                      sender=execute_command, detector=detector,
+                                      sender_stage="inject", mode=mode)
+
     # Управление
     col_start, col_stop, col_status = st.columns([1, 1, 2])
 
     with col_start:
         if st.button("▶️ ЗАПУСТИТЬ", type="primary", use_container_width=True):
             if button_input.strip():
+                if platform.system() == "Linux":
+                    KeyPresser.get_backend()
                 if st.session_state.processor.start_recording():
+                    st.session_state.engine.start()
                     st.success("✅ Микрофон активирован!")
                     time.sleep(0.5)
                     st.rerun()
+                else:
+                    st.error(st.session_state.processor.last_error)
 
     with col_stop:
         if st.button("⏹️ ОСТАНОВИТЬ", type="secondary", use_container_width=True):
+            st.session_state.engine.stop()
             st.session_state.processor.stop_recording()
             st.info("⏸️ Микрофон выключен")
             time.sleep(0.5)
@@ -670,76 +4831,236 @@ def solo_interface():
         else:
             st.markdown('<div class="status-box disconnected">⏸️ МИКРОФОН ВЫКЛЮЧЕН</div>', unsafe_allow_html=True)
 
-    # Мониторинг
+    # Мониторинг: фрагмент обновляется сам, страница остаётся отзывчивой
     if st.session_state.processor.is_recording:
         st.markdown("---")
+        refresh = refresh_select("solo_refresh", MONITOR_REFRESH)
+        reset_view("solo")
+        st.fragment(detection_monitor, run_every=refresh)(threshold, refresh)
+        tracing_section(st.session_state.engine.tracer, "solo")
 
-        vol_col, status_col = st.columns(2)
 
-        with vol_col:
-            vol_display = st.empty()
+def check_macro(button_input):
+    """Показывает ошибку, если текст кнопки - макрос с ошибкой"""
+    if not is_macro(button_input):
+        return
+    try:
+        events = parse_macro(button_input)
+    except ValueError as e:
+        st.error(f"❌ {e}")
+        return
+    st.caption(f"Макрос: {len(events)} событий, {events[-1][0] * 1000:.0f} мс")
 
-        with status_col:
-            trigger_display = st.empty()
 
-        # Цикл обработки
-        last_press_time = 0
-        max_iterations = 1000  # Защита от бесконечного цикла
-        
-        iteration = 0
-        while st.session_state.processor.is_recording and iteration < max_iterations:
-            iteration += 1
-            
-            audio_data = st.session_state.processor.get_audio_data()
+def refresh_select(key, default):
+    """Частота обновления панели мониторинга"""
+    return st.select_slider(
+        "Обновление экрана, с:",
+        options=REFRESH_OPTIONS,
+        value=default,
+        key=key,
+        help="Реже - меньше нагрузка на браузер и сервер. На детекцию не влияет"
+    )
 
-            if audio_data is not None:
-                current_volume = calculate_volume(audio_data)
 
-                # Отображение громкости
-                with vol_display:
-                    if current_volume > threshold:
-                        st.metric("🔊 ГРОМКОСТЬ", f"{current_volume:.1f} дБ", delta="ГРОМКО")
-                    else:
-                        st.metric("🔈 ГРОМКОСТЬ", f"{current_volume:.1f} дБ")
+def view_changed(key, view):
+    """Запоминает, что показывает фрагмент; False - то же, что уже на странице
 
-                # Проверка триггера
-                current_time = time.time()
+    Запуск фрагмента, который ничего не вывел, оставляет на странице
+    прошлый вывод, поэтому при тех же данных можно ничего не слать в
+    браузер. Страница перед вызовом фрагмента сбрасывает ключ
+    (reset_view): полный перезапуск скрипта стирает всё, что не выведено.
+    """
+    key = f"{key}_view"
+    if st.session_state.get(key) == view:
+        return False
+    st.session_state[key] = view
+    return True
 
-                if current_volume > threshold and (current_time - last_press_time) > 0.5:
-                    with trigger_display:
-                        st.warning("⚡ СРАБАТЫВАНИЕ...")
 
-                    try:
-                        if '+' in button_input:
-                            keys = [k.strip() for k in button_input.split('+')]
-                            KeyPresser.hotkey(*keys)
-                            action_text = f"Комбинация: {'+'.join(keys)}"
-                        else:
-                            KeyPresser.press(button_input)
-                            action_text = f"Кнопка: {button_input}"
+def reset_view(key):
+    st.session_state.pop(f"{key}_view", None)
 
-                        last_press_time = current_time
 
-                        with trigger_display:
-                            st.success(f"✅ {action_text}")
-                        time.sleep(0.3)
+def detection_monitor(threshold, refresh, remote=False, key="solo"):
+    """Показания детектора (фрагмент, запускается каждые refresh секунд)
 
-                    except Exception as e:
-                        with trigger_display:
-                            st.error(f"❌ Ошибка: {str(e)[:50]}")
+    Читает только снимок DetectionEngine и не держит поток скрипта,
+    поэтому кнопки страницы работают во время мониторинга.
+    Перерисовывается, только если изменилось то, что видно на экране.
+    """
+    engine = st.session_state.engine
+    processor = st.session_state.processor
+    if not (processor.is_recording and engine.is_running):
+        notice = ("info", "⏸️ Детектор остановлен")
+    elif remote and not st.session_state.client.is_connected:
+        notice = ("warning", "🔌 Соединение с сервером потеряно")
+    else:
+        notice = None
+    if notice is not None:
+        if view_changed(key, notice):
+            getattr(st, notice[0])(notice[1])
+        return
+    reconnecting = remote and not st.session_state.client.is_online()
+
+    snapshot = engine.get_snapshot()
+    current_volume = snapshot['volume']
+    # Нажатие показываем хотя бы на одном кадре обновления
+    flash = max(0.3, refresh * 2)
+
+    label = "ТЕКУЩАЯ ГРОМКОСТЬ" if remote else "ГРОМКОСТЬ"
+    if current_volume > threshold:
+        metric = (f"🔊 {label}", f"{current_volume:.1f} дБ", "ГРОМКО")
+    else:
+        metric = (f"🔈 {label}", f"{current_volume:.1f} дБ", None)
+
+    if snapshot['state'] == 'error':
+        status = ("error", f"❌ Ошибка: {snapshot['last_error'][:50]}")
+    elif snapshot['state'] == 'holding':
+        status = ("success", f"⏬ Зажата: {snapshot['held_keys']}")
+    elif time.time() - snapshot['last_trigger_time'] < flash:
+        if remote:
+            status = ("success", f"✅ Отправлено: {snapshot['last_keys']}")
+        else:
+            status = ("success", f"✅ {snapshot['last_action']}")
+    elif snapshot['state'] == 'cooldown':
+        status = ("info", f"⏳ Жду {snapshot['cooldown_left']:.1f} сек")
+    elif current_volume > threshold:
+        status = ("info", "🔔 ГОТОВ К ОТПРАВКЕ" if remote else "🔔 ГОТОВО К НАЖАТИЮ")
+    else:
+        status = ("info", "🔈 КРИЧИТЕ ГРОМЧЕ..." if remote else "🔈 ГОВОРИТЕ ГРОМЧЕ...")
+
+    captions = [audio_losses_text(processor), band_levels_text(snapshot, engine)]
+    if remote:
+        captions.append(receivers_text(st.session_state.client))
+    captions = tuple(text for text in captions if text)
+
+    if not view_changed(key, (reconnecting, metric, status, captions)):
+        return
+    if reconnecting:
+        st.warning("🔄 Связь с сервером оборвалась, переподключаемся...")
+    vol_col, status_col = st.columns(2)
+    vol_col.metric(metric[0], metric[1], delta=metric[2])
+    getattr(status_col, status[0])(status[1])
+    for text in captions:
+        st.caption(text)
+
+
+def link_quality(stats):
+    """Строка RTT/джиттер/смещение по статистике пульса ('' - замеров ещё нет)"""
+    if stats['rtt_ms'] is None:
+        return ""
+    return (f"RTT {stats['rtt_ms']:.1f} мс, джиттер {stats['jitter_ms']:.1f} мс, "
+            f"часы {stats['offset_ms']:+.1f} мс")
+
+
+def receivers_text(client):
+    """Получатели рассылки и качество связи с каждым (пусто - получателей нет)"""
+    receivers = client.get_receivers()
+    if not receivers:
+        return ""
+    lines = []
+    for r in receivers:
+        if r['state'] == "connecting":
+            lines.append(f"🔄 {r['address']}: подключаемся (попытка {r['attempts']})")
+            continue
+        if not r['alive']:
+            retry = f", повтор через {r['retry_in']:.1f} с" if r['retry_in'] is not None else ""
+            held = f", ждут отправки: {r['held']}" if r['held'] else ""
+            lines.append(f"❌ {r['address']} ({r['error']}{retry}{held})")
+            continue
+        quality = link_quality(r)
+        if r['last_outage_ms'] is not None:
+            quality += (f" · обрыв {r['last_outage_ms'] / 1000:.1f} с, дослано {r['replayed']}, "
+                        f"устарело {r['expired']}")
+        lines.append(f"✅ {r['address']}" + (f" · {quality}" if quality else ""))
+    return "  \n".join(lines)
+
+
+def detector_select():
+    """Выбор детектора срабатывания"""
+    return st.radio(
+        "Детектор:",
+        list(DETECTORS),
+        format_func=DETECTORS.get,
+        horizontal=True,
+        help="Онсет срабатывает по первым миллисекундам крика, "
+             "не дожидаясь громкого целого чанка; один крик - одно нажатие. "
+             f"На буфере меньше {ONSET_MIN_CHUNK} выигрыша нет - там работает громкость чанка. "
+             "Полосы частот нажимают разные кнопки на гул и на свист"
+    )
+
+
+def trigger_mode_select():
+    """Нажатие на каждый крик или удержание клавиши, пока кричишь"""
+    return st.radio(
+        "Режим:",
+        list(TRIGGER_MODES),
+        format_func=TRIGGER_MODES.get,
+        horizontal=True,
+        help="В режиме удержания клавиша зажимается в начале крика и отпускается, "
+             "когда станет тише порога - например, бег, пока кричишь"
+    )
 
-                else:
-                    with trigger_display:
-                        if current_volume > threshold:
-                            time_left = 0.5 - (current_time - last_press_time)
-                            if time_left > 0:
-                                st.info(f"⏳ Жду {time_left:.1f} сек")
-                            else:
-                                st.info("🔔 ГОТОВО К НАЖАТИЮ")
-                        else:
-                            st.info("🔈 ГОВОРИТЕ ГРОМЧЕ...")
 
-            time.sleep(0.05)
+def bands_panel():
+    """Настройка полос частот: своя кнопка на каждую полосу"""
+    text = st.text_area(
+        "Полосы частот (Гц) и кнопки:",
+        value=DEFAULT_BANDS,
+        help="По строке на полосу: 'низ-верх: кнопка'. Срабатывает самая "
+             "громкая полоса выше порога"
+    )
+    try:
+        st.session_state.engine.configure(bands=parse_bands(text))
+    except ValueError as e:
+        st.error(f"❌ {e}")
+
+
+def band_levels_text(snapshot, engine):
+    """Уровни полос частот из снимка детектора"""
+    if engine.detector != "bands" or not snapshot['band_levels']:
+        return ""
+    return "  ".join(f"{band['low']:g}-{band['high']:g} Гц → {band['key']}: {level:.0f} дБ"
+                     for band, level in zip(engine.bands, snapshot['band_levels']))
+
+
+def calibration_panel():
+    """Калибровка задержки звука для текущего микрофона"""
+    processor = st.session_state.processor
+
+    with st.expander("🎚️ Калибровка задержки микрофона"):
+        buffer_ms = processor.chunk / processor.rate * 1000
+        st.write(f"Сейчас: **{processor.rate} Гц**, буфер **{processor.chunk}** "
+                 f"сэмплов ({buffer_ms:.1f} мс)")
+        if processor.profile:
+            st.caption(f"Профиль от {processor.profile['calibrated_at']}: "
+                       f"задержка ≈ {processor.profile['latency_ms']} мс")
+
+        if st.button("🎚️ Откалибровать", disabled=processor.is_recording,
+                     help="Пробует всё меньшие буферы и частоты и сохраняет самый быстрый стабильный"):
+            try:
+                with st.spinner("Калибровка... не шумите"):
+                    chosen, report = processor.calibrate()
+            except Exception as e:
+                st.error(f"Ошибка калибровки: {e}")
+                return
+
+            if chosen:
+                st.success(f"✅ Выбрано: {chosen['rate']} Гц, буфер {chosen['chunk']} "
+                           f"(задержка ≈ {chosen['latency_ms']:.1f} мс)")
+            else:
+                st.warning("⚠️ Стабильной конфигурации не найдено, настройки не изменены")
+            st.dataframe(report, use_container_width=True)
+
+
+def audio_losses_text(processor):
+    """Потери звука, если они были"""
+    losses = processor.get_overruns()
+    if not (losses['input_overflows'] or losses['dropped_samples']):
+        return ""
+    dropped_ms = losses['dropped_samples'] / processor.ring.rate * 1000
+    return f"⚠️ Потери звука: переполнений входа {losses['input_overflows']}, пропущено {dropped_ms:.0f} мс"
 
 
 def coop_interface():
@@ -825,6 +5146,8 @@ def player1_interface():
                 st.success("✅ Сервер запущен!")
                 time.sleep(0.5)
                 st.rerun()
+            else:
+                st.error(st.session_state.server.last_error)
 
     with col_stop:
         if st.button("⏹️ ОСТАНОВИТЬ СЕРВЕР", type="secondary", use_container_width=True,
@@ -834,6 +5157,8 @@ def player1_interface():
             time.sleep(0.5)
             st.rerun()
 
+    party_panel()
+
     # Инструкция
     st.markdown("---")
     st.subheader("📋 Инструкция для Игрока 1")
@@ -849,24 +5174,152 @@ def player1_interface():
     if st.session_state.server.is_running:
         st.markdown("---")
         st.subheader("📊 Активность сервера")
+        refresh = refresh_select("player1_refresh", SERVER_REFRESH)
+        reset_view("player1")
+        st.fragment(server_monitor, run_every=refresh)()
+        tracing_section(st.session_state.server.tracer, "player1")
 
-        activity_display = st.empty()
-        max_checks = 100  # Ограничиваем количество проверок
-        
-        for i in range(max_checks):
-            if not st.session_state.server.is_running:
-                break
-                
-            connected_clients = len(st.session_state.server.get_connected_clients())
 
-            with activity_display:
-                if connected_clients > 0:
-                    st.success(f"✅ Активных подключений: {connected_clients}")
-                    st.info("🎮 Готов к работе! Игрок 2 может кричать в микрофон")
-                else:
-                    st.warning("⏳ Ожидание подключения Игрока 2...")
+def server_monitor():
+    """Активность сервера и очередь нажатий (фрагмент, перерисовывается при изменениях)"""
+    server = st.session_state.server
+    if not server.is_running:
+        if view_changed("player1", "stopped"):
+            st.info("⏸️ Сервер остановлен")
+        return
+
+    connected_clients = len(server.get_connected_clients())
+    stats = server.get_injection_stats()
+    injection = (stats['depth'], stats['max_depth'], stats['executed'], stats['dropped'],
+                 f"{stats['avg_wait_ms']:.1f}", f"{stats['max_wait_ms']:.1f}")
+    held = ", ".join(f"{keys} ({count})" if count > 1 else keys for keys, count in server.get_held_keys().items())
+    links = tuple((
+        ("Клиент", link['address']),
+        ("Протокол", link['transport'].upper()),
+        ("RTT, мс", round(link['rtt_ms'], 2)),
+        ("Джиттер, мс", round(link['jitter_ms'], 2)),
+        ("Смещение часов, мс", round(link['offset_ms'], 2)),
+    ) for link in server.get_link_stats() if link['rtt_ms'] is not None)
+
+    macros = MacroScheduler.get_default(create=False)
+    macro_view = None
+    if macros is not None:
+        m = macros.get_stats()
+        macro_view = (m['completed'], m['active'], m['dropped'], f"{m['late_p50_ms']:.2f}",
+                      f"{m['late_p99_ms']:.2f}", f"{m['late_max_ms']:.2f}", tuple((
+                          ("Макрос", run['macro']),
+                          ("План, мс", round(run['planned_ms'], 1)),
+                          ("Факт, мс", round(run['duration_ms'], 1)),
+                          ("Опоздание макс., мс", round(run['max_late_ms'], 3)),
+                          ("Джиттер, мс", round(run['jitter_ms'], 3)),
+                      ) for run in reversed(m['recent'][-10:])))
+
+    party = server.get_party_stats()
+    party_view = None
+    if party is not None:
+        party_view = (party['received'], party['merged'], party['undecided'], party['limited'],
+                      f"{party['avg_latency_ms']:.0f}", f"{party['max_latency_ms']:.0f}")
+
+    if not view_changed("player1", (connected_clients, injection, held, links, macro_view, party_view)):
+        return
+
+    if connected_clients > 0:
+        st.success(f"✅ Активных подключений: {connected_clients}")
+        st.info("🎮 Готов к работе! Игрок 2 может кричать в микрофон")
+    else:
+        st.warning("⏳ Ожидание подключения Игрока 2...")
+
+    depth, max_depth, executed, dropped, avg_wait, max_wait = injection
+    q1, q2, q3, q4 = st.columns(4)
+    q1.metric("📥 В очереди", depth, help=f"Максимум: {max_depth}")
+    q2.metric("⌨️ Нажато", executed)
+    q3.metric("🗑️ Отброшено", dropped)
+    q4.metric("⏱️ Ожидание", f"{avg_wait} мс", help=f"Максимум: {max_wait} мс")
+
+    if held:
+        st.info("⏬ Зажаты: " + held)
+
+    if links:
+        st.dataframe([dict(row) for row in links], hide_index=True, use_container_width=True)
+
+    if macro_view is not None:
+        completed, active, macros_dropped, late_p50, late_p99, late_max, recent = macro_view
+        m1, m2, m3, m4 = st.columns(4)
+        m1.metric("🎹 Макросов", completed, help=f"Сейчас идут: {active}, отброшено: {macros_dropped}")
+        m2.metric("⏱️ Опоздание p50", f"{late_p50} мс")
+        m3.metric("⏱️ Опоздание p99", f"{late_p99} мс")
+        m4.metric("📈 Максимум", f"{late_max} мс")
+        if recent:
+            st.dataframe([dict(row) for row in recent], hide_index=True, use_container_width=True)
 
-            time.sleep(2)
+    if party_view is not None:
+        received, merged, undecided, limited, avg_latency, max_latency = party_view
+        p1, p2, p3, p4 = st.columns(4)
+        p1.metric("🎉 Команд от гостей", received)
+        p2.metric("🤝 Слито в одно нажатие", merged, help=f"Окон без большинства: {undecided}")
+        p3.metric("🚦 Сверх лимита", limited)
+        p4.metric("⏱️ Сбор голосов", f"{avg_latency} мс", help=f"Максимум: {max_latency} мс")
+
+
+def tracing_section(tracer, key):
+    """Задержка по этапам: таблица во фрагменте, сброс - кнопкой страницы
+
+    Кнопка вне фрагмента: фрагмент без изменений ничего не выводит, и
+    нажатие его собственной кнопки потерялось бы.
+    """
+    with st.expander("⏱️ Где теряются миллисекунды"):
+        reset_view(f"{key}_trace")
+        st.fragment(tracing_panel, run_every=TRACE_REFRESH)(tracer, key)
+        st.button("🧹 Сбросить", key=f"{key}_trace_reset", on_click=tracer.reset)
+
+
+def tracing_panel(tracer, key):
+    """Перцентили по этапам и выгрузка в CSV/JSON (фрагмент, перерисовывается при изменениях)"""
+    rows = tracer.summary()
+    if not view_changed(f"{key}_trace", rows):
+        return
+    if not rows:
+        st.caption("Срабатываний ещё не было")
+        return
+    st.dataframe(
+        [{"Этап": row['label'], "Замеров": row['count'], "p50, мс": row['p50_ms'],
+          "p90, мс": row['p90_ms'], "p99, мс": row['p99_ms'], "Макс, мс": row['max_ms']}
+         for row in rows],
+        hide_index=True,
+        use_container_width=True
+    )
+    col_csv, col_json = st.columns(2)
+    col_csv.download_button("📄 CSV", tracer.export_csv(), file_name=f"latency_{key}.csv",
+                            mime="text/csv", key=f"{key}_trace_csv", use_container_width=True)
+    col_json.download_button("🧾 JSON", tracer.export_json(), file_name=f"latency_{key}.json",
+                             mime="application/json", key=f"{key}_trace_json",
+                             use_container_width=True)
+
+
+def party_panel():
+    """Режим вечеринки: много кричащих клиентов - одно нажатие"""
+    with st.expander("🎉 Режим вечеринки (много Игроков 2)"):
+        enabled = st.checkbox(
+            "Сводить команды гостей",
+            help="Без этого каждая команда каждого клиента - отдельное нажатие"
+        )
+        policy = st.radio(
+            "Кто решает:",
+            list(PARTY_POLICIES),
+            format_func=PARTY_POLICIES.get,
+            horizontal=True,
+            disabled=not enabled,
+            help="Кто первый - нажатие сразу, повторы той же клавиши в окне гасятся. "
+                 "Большинство и громкость ждут конца окна и нажимают одну клавишу: "
+                 "большинство - только если за неё больше половины гостей"
+        )
+        window_ms = st.slider("Окно сбора голосов, мс:", 20, 1000, int(PARTY_WINDOW * 1000),
+                              step=10, disabled=not enabled)
+        rate_limit = st.number_input("Лимит на гостя, команд/с:", min_value=0.0, max_value=50.0,
+                                     value=PARTY_RATE_LIMIT, step=0.5, disabled=not enabled,
+                                     help="0 - без ограничения")
+    st.session_state.server.configure_party(policy if enabled else None,
+                                            window=window_ms / 1000, rate_limit=rate_limit)
 
 
 def player2_interface():
@@ -879,15 +5332,18 @@ def player2_interface():
         server_ip = st.text_input(
             "IP адрес Игрока 1:",
             value="localhost",
-            help="Введите IP адрес который вам сообщил Игрок 1"
+            help="Введите IP адрес который вам сообщил Игрок 1. Несколько "
+                 "получателей - через запятую, порт через двоеточие: 192.168.1.5, 192.168.1.6:12346"
         )
 
     with col2:
         button_input = st.text_input(
             "Кнопка для нажатия:",
             value="space",
-            help="Какую кнопку нажимать у Игрока 1"
+            help="Какую кнопку нажимать у Игрока 1: space, ctrl+c или макрос "
+                 "(hold shift 120, tap e, wait 30, tap r) - его исполнит Игрок 1"
         )
+        check_macro(button_input)
 
     # Порог громкости
     threshold = st.slider(
@@ -898,15 +5354,51 @@ def player2_interface():
         help="При какой громкости отправлять команду"
     )
 
+    detector = detector_select()
+    mode = trigger_mode_select()
+    if detector == "bands":
+        bands_panel()
+
+    # Транспорт
+    col_transport, col_redundancy = st.columns(2)
+
+    with col_transport:
+        transport_label = st.radio(
+            "Транспорт:",
+            ["TCP (надёжный)", "UDP (LAN, минимальная задержка)"],
+            horizontal=True,
+            disabled=st.session_state.client.is_connected,
+            help="UDP не ждёт повторной передачи после потерь, дубли отбрасываются сервером"
+        )
+        transport = "udp" if transport_label.startswith("UDP") else "tcp"
+
+    with col_redundancy:
+        redundancy = st.number_input(
+            "Повторов каждого UDP-пакета:",
+            min_value=1,
+            max_value=5,
+            value=UDP_REDUNDANCY,
+            disabled=transport != "udp" or st.session_state.client.is_connected,
+            help="Потеря одного пакета не потеряет нажатие"
+        )
+
     # Статус подключения
     col_status, col_connect = st.columns([3, 1])
 
     with col_status:
-        if st.session_state.client.is_connected:
+        if st.session_state.client.is_connected and not st.session_state.client.is_online():
+            st.markdown("""
+            <div class="status-box waiting">
+                <h3>🔄 ПЕРЕПОДКЛЮЧЕНИЕ</h3>
+                <p><strong>Связь оборвалась, подключаемся заново в фоне</strong></p>
+            </div>
+            """, unsafe_allow_html=True)
+        elif st.session_state.client.is_connected:
             st.markdown(f"""
             <div class="status-box connected">
                 <h3>✅ ПОДКЛЮЧЕНО</h3>
-                <p><strong>Сервер:</strong> {st.session_state.client.server_address}</p>
+                <p><strong>Сервер:</strong> {st.session_state.client.server_address}
+                ({st.session_state.client.transport.upper()})</p>
                 <p><strong>Статус:</strong> Готов отправвать команды</p>
             </div>
             """, unsafe_allow_html=True)
@@ -922,121 +5414,65 @@ def player2_interface():
         if st.session_state.client.is_connected:
             if st.button("🔌 ОТКЛЮЧИТЬСЯ", type="secondary", use_container_width=True):
                 st.session_state.client.disconnect()
+                st.session_state.engine.stop()
                 st.session_state.processor.stop_recording()
                 st.info("⏸️ Отключено от сервера")
                 time.sleep(0.5)
                 st.rerun()
         else:
             if st.button("🔗 ПОДКЛЮЧИТЬСЯ", type="primary", use_container_width=True):
-                if st.session_state.client.connect_to_server(server_ip):
+                if st.session_state.client.connect_to_server(server_ip, transport, redundancy):
+                    st.success(f"✅ Успешно подключено к {st.session_state.client.server_address} "
+                               f"({transport.upper()})")
+                    if st.session_state.client.last_error:
+                        st.warning(st.session_state.client.last_error)
+                        time.sleep(2)
                     time.sleep(0.5)
                     st.rerun()
+                else:
+                    st.error(st.session_state.client.last_error)
+
+    # Детектор сам отправляет команды через клиента
+    st.session_state.engine.configure(threshold=threshold, button_input=button_input,
+                                      sender=st.session_state.client.send_key_press,
+                                      detector=detector, sender_stage="send", mode=mode)
 
     # Управление микрофоном
     if st.session_state.client.is_connected:
         st.markdown("---")
 
+        calibration_panel()
+
         col_start, col_stop = st.columns(2)
 
         with col_start:
             if st.button("🎤 ЗАПУСТИТЬ МИКРОФОН", type="primary", use_container_width=True,
                          disabled=st.session_state.processor.is_recording):
                 if st.session_state.processor.start_recording():
+                    st.session_state.engine.start()
                     st.success("✅ Микрофон активирован!")
                     time.sleep(0.5)
                     st.rerun()
+                else:
+                    st.error(st.session_state.processor.last_error)
 
         with col_stop:
             if st.button("⏹️ ОСТАНОВИТЬ МИКРОФОН", type="secondary", use_container_width=True,
                          disabled=not st.session_state.processor.is_recording):
+                st.session_state.engine.stop()
                 st.session_state.processor.stop_recording()
                 st.info("⏸️ Микрофон выключен")
                 time.sleep(0.5)
                 st.rerun()
 
-        # Мониторинг и отправка команд
+        # Мониторинг (детекция и отправка идут в отдельном потоке)
         if st.session_state.processor.is_recording:
             st.markdown("---")
             st.subheader("🎤 Мониторинг громкости")
-
-            vol_display = st.empty()
-            command_display = st.empty()
-
-            last_send_time = 0
-            max_iterations = 1000  # Защита от бесконечного цикла
-            
-            iteration = 0
-            while (st.session_state.client.is_connected and
-                   st.session_state.processor.is_recording and
-                   iteration < max_iterations):
-                
-                iteration += 1
-                audio_data = st.session_state.processor.get_audio_data()
-
-                if audio_data is not None:
-                    current_volume = calculate_volume(audio_data)
-
-                    # Отображение громкости
-                    with vol_display:
-                        if current_volume > threshold:
-                            st.metric("🔊 ТЕКУЩАЯ ГРОМКОСТЬ", f"{current_volume:.1f} дБ", delta="ГРОМКО")
-                        else:
-                            st.metric("🔈 ТЕКУЩАЯ ГРОМКОСТЬ", f"{current_volume:.1f} дБ")
-
-                    # Проверка условия для отправки
-                    current_time = time.time()
-
-                    if current_volume > threshold and (current_time - last_send_time) > 0.5:
-                        with command_display:
-                            st.warning("⚡ ОТПРАВЛЯЮ КОМАНДУ...")
-
-                        try:
-                            # Формируем команду для отправки
-                            if '+' in button_input:
-                                keys = [k.strip() for k in button_input.split('+')]
-                                key_data = {
-                                    'type': 'hotkey',
-                                    'keys': keys,
-                                    'timestamp': time.time()
-                                }
-                            else:
-                                key_data = {
-                                    'type': 'key_press',
-                                    'key': button_input,
-                                    'timestamp': time.time()
-                                }
-
-                            # Отправляем команду
-                            if st.session_state.client.send_key_press(key_data):
-                                last_send_time = current_time
-
-                                with command_display:
-                                    if 'keys' in key_data:
-                                        st.success(f"✅ Отправлено: {'+'.join(key_data['keys'])}")
-                                    else:
-                                        st.success(f"✅ Отправлено: {key_data['key']}")
-
-                                time.sleep(0.3)
-                            else:
-                                with command_display:
-                                    st.error("❌ Ошибка отправки, проверьте подключение")
-
-                        except Exception as e:
-                            with command_display:
-                                st.error(f"❌ Ошибка: {str(e)[:50]}")
-
-                    else:
-                        with command_display:
-                            if current_volume > threshold:
-                                time_left = 0.5 - (current_time - last_send_time)
-                                if time_left > 0:
-                                    st.info(f"⏳ Жду {time_left:.1f} сек")
-                                else:
-                                    st.info("🔔 ГОТОВ К ОТПРАВКЕ")
-                            else:
-                                st.info("🔈 КРИЧИТЕ ГРОМЧЕ...")
-
-                time.sleep(0.05)
+            refresh = refresh_select("player2_refresh", MONITOR_REFRESH)
+            reset_view("player2")
+            st.fragment(detection_monitor, run_every=refresh)(threshold, refresh, remote=True, key="player2")
+            tracing_section(st.session_state.engine.tracer, "player2")
 
         else:
             # Инструкция когда подключены но микрофон выключен
@@ -1052,5 +5488,367 @@ def player2_interface():
             """)
 
 
+def log(message):
+    """Строка журнала для режима командной строки"""
+    print(f"[{time.strftime('%H:%M:%S')}] {message}", flush=True)
+
+
+def load_config(path):
+    """Настройки из JSON-файла: ключи как у параметров командной строки"""
+    if not path:
+        return {}
+    with open(path, encoding="utf-8") as f:
+        config = json.load(f)
+    if not isinstance(config, dict):
+        raise ValueError(f"{path}: ожидается JSON-объект")
+    # threshold и --threshold, window-ms и window_ms - одно и то же
+    return {key.lstrip('-').replace('-', '_'): value for key, value in config.items()}
+
+
+def build_arg_parser(config=None):
+    parser = argparse.ArgumentParser(
+        description="Voice Co-op Controller без веб-интерфейса. "
+                    "Веб-интерфейс: streamlit run voice_coop.py"
+    )
+    parser.add_argument("--config", help="JSON-файл с настройками (параметры командной строки важнее)")
+    commands = parser.add_subparsers(dest="command", metavar="serve|shout|solo|flight")
+    commands.required = True
+
+    serve = commands.add_parser("serve", help="Игрок 1: принимать команды и нажимать кнопки")
+    serve.add_argument("--stats-interval", type=float, default=30.0,
+                       help="Как часто печатать статистику, с (0 - не печатать)")
+    serve.add_argument("--party", choices=list(PARTY_POLICIES),
+                       help="Режим вечеринки: как сводить команды многих клиентов")
+    serve.add_argument("--party-window", type=float, default=PARTY_WINDOW, help="Окно сбора голосов, с")
+    serve.add_argument("--party-rate", type=float, default=PARTY_RATE_LIMIT,
+                       help="Лимит команд в секунду на клиента (0 - без ограничения)")
+
+    shout = commands.add_parser("shout", help="Игрок 2: слушать микрофон и отправлять команды")
+    shout.add_argument("--server", help="IP адрес Игрока 1")
+    shout.add_argument("--transport", choices=list(TRANSPORTS), default="tcp")
+    shout.add_argument("--redundancy", type=int, default=UDP_REDUNDANCY,
+                       help="Копий каждой UDP-датаграммы")
+
+    solo = commands.add_parser("solo", help="Один игрок: слушать микрофон и нажимать кнопки здесь")
+
+    flight = commands.add_parser("flight", help="Бортовой самописец: события, их звук и повтор через детектор")
+    flight.add_argument("path", nargs="?", default=FLIGHT_PATH, help="Файл самописца (прошлый формат - с суффиксом .prev)")
+    flight.add_argument("--last", type=int, default=20, help="Сколько последних событий показать (0 - все)")
+    flight.add_argument("--seq", type=int, action="append", help="Только событие с этим номером (можно повторять)")
+    flight.add_argument("--kind", help="Только события этих видов через запятую: " + ",".join(FLIGHT_EVENTS))
+    flight.add_argument("--wav", help="Сохранить звук событий в папку")
+    flight.add_argument("--replay", action="store_true", help="Прогнать звук событий через детектор")
+    flight.add_argument("--threshold", type=float, help="Порог для повтора, дБ (по умолчанию записанный)")
+    flight.add_argument("--detector", choices=list(DETECTORS), help="Детектор для повтора")
+    flight.add_argument("--mode", choices=list(TRIGGER_MODES), help="Режим для повтора")
+    flight.add_argument("--cooldown", type=float, help="Пауза между нажатиями для повтора, с")
+    flight.add_argument("--hold-hang", type=float, help="Удержание для повтора, с")
+    flight.add_argument("--window-ms", type=float, help="Окно громкости для повтора, мс")
+    flight.add_argument("--bands", default=DEFAULT_BANDS, help="Полосы частот для детектора bands")
+
+    for sub in (serve, shout, solo):
+        sub.add_argument("--port", type=int, default=PORT)
+        sub.add_argument("--trace-export", help="Куда сохранить задержки по этапам при выходе (.csv или .json)")
+        sub.add_argument("--key-backend", choices=list(KEY_BACKENDS),
+                         help=f"Бэкенд нажатий на Linux (то же, что {KEY_BACKEND_ENV})")
+    for sub in (shout, solo):
+        sub.add_argument("--key", default="space", help="Кнопка, комбинация или макрос: space, f1, ctrl+c, "
+                                                          "'hold shift 120, tap e, wait 30, tap r'")
+        sub.add_argument("--threshold", type=float, default=-20, help="Порог, дБ")
+        sub.add_argument("--detector", choices=list(DETECTORS), default="volume")
+        sub.add_argument("--bands", default=DEFAULT_BANDS,
+                         help="Полосы частот 'низ-верх: кнопка' через ';' или перевод строки")
+        sub.add_argument("--cooldown", type=float, default=TRIGGER_COOLDOWN, help="Пауза между нажатиями, с")
+        sub.add_argument("--mode", choices=list(TRIGGER_MODES), default="tap",
+                         help="tap - нажатие на крик, hold - держать клавишу, пока кричишь")
+        sub.add_argument("--hold-hang", type=float, default=HOLD_HANG,
+                         help="Сколько тишины терпеть до отпускания в режиме hold, с")
+        sub.add_argument("--window-ms", type=float, default=0, help="Скользящее окно громкости, мс (0 - по чанку)")
+        sub.add_argument("--device", type=int, help="Индекс устройства ввода")
+        sub.add_argument("--source", default="mic",
+                         help="Источник звука: mic, multi:0,1 (несколько микрофонов) или multi:2x4 "
+                              "(многоканальный вход), wav:файл.wav, synthetic[:tone|noise|shout], null; "
+                              "несколько через запятую - по каналу на каждый")
+        sub.add_argument("--channel-keys", default="",
+                         help="Кнопки каналов через запятую (space,enter,w); по умолчанию у всех --key")
+        sub.add_argument("--flight", default=FLIGHT_PATH,
+                         help="Файл бортового самописца: события и звук вокруг них (пусто - не писать)")
+        sub.add_argument("--flight-size", type=float, default=FLIGHT_SIZE / 2 ** 20, help="Размер самописца, МБ")
+    for sub in (serve, shout, solo):
+        sub.set_defaults(**(config or {}))
+    return parser
+
+
+def parse_cli_args(argv):
+    # Сначала только --config: его значения становятся умолчаниями подкоманд
+    pre = argparse.ArgumentParser(add_help=False)
+    pre.add_argument("--config")
+    known, _ = pre.parse_known_args(argv)
+    parser = build_arg_parser(load_config(known.config))
+    args = parser.parse_args(argv)
+    if args.command == "shout" and not args.server:
+        parser.error("shout: нужен --server (или \"server\" в конфиге)")
+    return args
+
+
+def _wait_for_stop(tick, interval=0.1):
+    """Крутит tick() до Ctrl+C или SIGTERM"""
+    stopping = threading.Event()
+    signal.signal(signal.SIGTERM, lambda *_: stopping.set())
+    try:
+        while not stopping.is_set():
+            tick()
+            stopping.wait(interval)
+    except KeyboardInterrupt:
+        pass
+    log("Остановка...")
+
+
+def _start_detection(args, sender, sender_stage="send"):
+    """Источник звука и детектор для shout/solo; None, если звук не запустился"""
+    if is_macro(args.key):
+        try:
+            parse_macro(args.key)
+        except ValueError as e:
+            log(f"Макрос не разобран: {e}")
+            return None, None
+    try:
+        processor = open_audio_source(args.source)
+    except (OSError, ValueError, wave.Error) as e:
+        log(f"Источник звука не открыт: {e}")
+        return None, None
+    if args.device is not None and isinstance(processor, AudioProcessor):
+        processor.device_index = args.device
+    engine = DetectionEngine(processor)
+    engine.configure(threshold=args.threshold, button_input=args.key, sender=sender,
+                     sender_stage=sender_stage, mode=args.mode, hold_hang=args.hold_hang,
+                     channel_keys=[key.strip() for key in args.channel_keys.split(",")] if args.channel_keys else [],
+                     cooldown=args.cooldown, window_ms=args.window_ms, detector=args.detector,
+                     bands=parse_bands(args.bands.replace(';', '\n')))
+    if not processor.start_recording():
+        processor.cleanup()
+        return None, None
+    if args.flight:
+        # Только после запуска: профиль калибровки мог сменить частоту и каналы
+        recorder = FlightRecorder(args.flight, int(args.flight_size * 2 ** 20))
+        try:
+            recorder.open(processor.ring.rate, processor.ring.channels)
+        except (OSError, ValueError) as e:
+            log(f"Самописец не открыт: {e}")
+        else:
+            recorder.start()
+            engine.configure(recorder=recorder)
+            log(f"Самописец: {args.flight}, последние {recorder.slots} событий")
+    engine.start()
+    log(f"Звук: {processor.get_device_name()}, {processor.rate} Гц, буфер {processor.chunk}")
+    if processor.channels > 1:
+        keys = engine.get_channel_keys(processor.channels)
+        log(f"Каналов: {processor.channels}, кнопки: " + ", ".join(f"{i + 1}: {key}" for i, key in enumerate(keys))
+            + f", порог {args.threshold:g} дБ")
+    else:
+        log(f"Детектор: {DETECTORS[args.detector]}, порог {args.threshold:g} дБ, кнопка {args.key}")
+    return processor, engine
+
+
+def _watch_engine(engine, processor):
+    """tick() для журнала: печатает нажатия, ошибки и потери звука"""
+    seen = {'triggers': 0, 'failures': 0, 'losses': (0, 0), 'held': ""}
+
+    def tick():
+        snapshot = engine.get_snapshot()
+        if snapshot['triggers'] > seen['triggers']:
+            seen['triggers'] = snapshot['triggers']
+            log(f"{snapshot['last_action']} ({snapshot['volume']:.1f} дБ, всего {snapshot['triggers']})")
+        if seen['held'] and not snapshot['held_keys']:
+            log(f"Отпущена: {seen['held']}")
+        seen['held'] = snapshot['held_keys']
+        if snapshot['failures'] > seen['failures']:
+            seen['failures'] = snapshot['failures']
+            log(f"Ошибка: {snapshot['last_error']}")
+        losses = processor.get_overruns()
+        current = (losses['input_overflows'], losses['dropped_samples'])
+        if current != seen['losses']:
+            seen['losses'] = current
+            log(f"Потери звука: переполнений входа {current[0]}, "
+                f"пропущено {current[1] / processor.ring.rate * 1000:.0f} мс")
+
+    return tick
+
+
+def _save_trace(tracer, path):
+    if not path:
+        return
+    try:
+        tracer.save(path)
+        log(f"Задержки по этапам сохранены: {path}")
+    except OSError as e:
+        log(f"Не удалось сохранить задержки: {e}")
+
+
+def cli_serve(args):
+    server = NetworkServer(port=args.port)
+    if not server.start_server():
+        return 1
+    log(f"Сервер запущен: {server.get_local_ip()}:{args.port} (TCP и UDP)")
+    if args.party:
+        server.configure_party(args.party, window=args.party_window, rate_limit=args.party_rate)
+        log(f"Режим вечеринки: {PARTY_POLICIES[args.party]}, окно {args.party_window * 1000:.0f} мс")
+
+    state = {'clients': 0, 'next_stats': time.monotonic() + args.stats_interval}
+
+    def tick():
+        clients = server.get_connected_clients()
+        if len(clients) != state['clients']:
+            state['clients'] = len(clients)
+            log(f"Подключено клиентов: {len(clients)}")
+        if args.stats_interval > 0 and time.monotonic() >= state['next_stats']:
+            state['next_stats'] = time.monotonic() + args.stats_interval
+            stats = server.get_injection_stats()
+            log(f"Нажатий: {stats['executed']}, отброшено: {stats['dropped']}, "
+                f"очередь: {stats['depth']}, ожидание: {stats['avg_wait_ms']:.2f} мс")
+            for link in server.get_link_stats():
+                quality = link_quality(link)
+                if quality:
+                    log(f"Связь с {link['address']}: {quality}")
+            macros = MacroScheduler.get_default(create=False)
+            if macros is not None:
+                m = macros.get_stats()
+                log(f"Макросов: {m['completed']}, идут: {m['active']}, опоздание шагов "
+                    f"p50 {m['late_p50_ms']:.2f} / p99 {m['late_p99_ms']:.2f} / макс. {m['late_max_ms']:.2f} мс")
+            party = server.get_party_stats()
+            if party is not None:
+                log(f"Вечеринка: команд {party['received']}, слито {party['merged']}, "
+                    f"без большинства {party['undecided']}, сверх лимита {party['limited']}, "
+                    f"сбор {party['avg_latency_ms']:.0f} мс")
+
+    try:
+        _wait_for_stop(tick)
+    finally:
+        server.stop_server()
+        MacroScheduler.stop_default()
+        _save_trace(server.tracer, args.trace_export)
+    return 0
+
+
+def cli_shout(args):
+    client = NetworkClient(port=args.port)
+    if not client.connect_to_server(args.server, args.transport, args.redundancy):
+        return 1
+    processor, engine = _start_detection(args, client.send_key_press)
+    if engine is None:
+        client.disconnect()
+        return 1
+
+    try:
+        _wait_for_stop(_watch_engine(engine, processor))
+    finally:
+        engine.stop()
+        processor.cleanup()
+        if engine.recorder is not None:
+            engine.recorder.stop()
+        client.disconnect()
+        _save_trace(engine.tracer, args.trace_export)
+    return 0
+
+
+def cli_solo(args):
+    if platform.system() == "Linux":
+        KeyPresser.get_backend()
+    processor, engine = _start_detection(args, execute_command, "inject")
+    if engine is None:
+        return 1
+
+    try:
+        _wait_for_stop(_watch_engine(engine, processor))
+    finally:
+        engine.stop()
+        processor.cleanup()
+        if engine.recorder is not None:
+            engine.recorder.stop()
+        MacroScheduler.stop_default()
+        _save_trace(engine.tracer, args.trace_export)
+    return 0
+
+
+def describe_flight_record(record):
+    """Строка журнала самописца: номер, время, событие, кнопка, громкость и настройки"""
+    moment = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(record['time'])) + f".{int(record['time'] % 1 * 1000):03d}"
+    channel = f", канал {record['channel'] + 1}" if record['channel'] >= 0 else ""
+    note = f" - {record['note']}" if record['note'] else ""
+    return (f"#{record['seq']} {moment} {FLIGHT_EVENTS[record['kind']]}: {record['key']}{channel}, "
+            f"{record['level']:.1f} дБ (порог {record['threshold']:g}, {DETECTORS[record['detector']]}, "
+            f"{record['mode']}){note}")
+
+
+def _save_flight_wav(record, directory):
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, f"flight_{record['seq']}_{record['kind']}.wav")
+    with wave.open(path, "wb") as f:
+        f.setnchannels(record['channels'])
+        f.setsampwidth(2)
+        f.setframerate(record['rate'])
+        f.writeframes(record['audio'].tobytes())
+    return path
+
+
+def cli_flight(args):
+    try:
+        info, records = FlightRecorder.read(args.path)
+    except (OSError, ValueError) as e:
+        log(f"Самописец не прочитан: {e}")
+        return 1
+    if args.seq:
+        records = [record for record in records if record['seq'] in args.seq]
+    if args.kind:
+        kinds = {kind.strip() for kind in args.kind.split(",")}
+        records = [record for record in records if record['kind'] in kinds]
+    if args.last:
+        records = records[-args.last:]
+    log(f"{args.path}: {info['rate']} Гц, каналов {info['channels']}, звук {info['pre'] * 1000:.0f} мс до "
+        f"и {info['post'] * 1000:.0f} мс после события, показано {len(records)}")
+
+    bands = parse_bands(args.bands.replace(';', '\n'))
+    for record in records:
+        print(describe_flight_record(record))
+        if args.wav:
+            print(f"    WAV: {_save_flight_wav(record, args.wav)}")
+        if args.replay:
+            events = replay_flight_record(record, bands=bands, threshold=args.threshold, detector=args.detector,
+                                          mode=args.mode, cooldown=args.cooldown, hold_hang=args.hold_hang,
+                                          window_ms=args.window_ms)
+            if not events:
+                print("    Повтор: срабатываний нет")
+            end = (record['audio_start'] + len(record['audio']) - record['position']) / record['rate']
+            for offset, command in events:
+                level = f", {command['level']:.1f} дБ" if 'level' in command else ""
+                # Зажатое на конец звука детектор отпускает при остановке
+                if command['type'] == 'key_up' and offset >= end - 1e-6:
+                    level += " (конец записи)"
+                print(f"    Повтор: {offset * 1000:+.0f} мс от события - {describe_command(command)}{level}")
+    return 0
+
+
+def cli(argv=None):
+    """Режим командной строки: python voice_coop.py serve|shout|solo|flight"""
+    try:
+        args = parse_cli_args(sys.argv[1:] if argv is None else argv)
+    except (OSError, ValueError) as e:
+        print(f"Ошибка конфига: {e}")
+        return 2
+    if getattr(args, "key_backend", None):
+        os.environ[KEY_BACKEND_ENV] = args.key_backend
+
+    try:
+        return {"serve": cli_serve, "shout": cli_shout, "solo": cli_solo, "flight": cli_flight}[args.command](args)
+    except ValueError as e:
+        # Неверные полосы частот и т.п.
+        print(f"Ошибка: {e}")
+        return 2
+
+
 if __name__ == "__main__":
-    main()
+    # streamlit run уже импортировал streamlit - значит нужен веб-интерфейс
+    if "streamlit" in sys.modules:
+        main()
+    else:
+        sys.exit(cli())